@@ -1,24 +1,88 @@
 import sqlite3
+import threading
+import time
 from queue import Queue
+from typing import Callable
 from src.backend.Consts import DB_PATH
 
+MMAP_SIZE = 64 * 1024 * 1024
+CACHE_SIZE_KB = 16 * 1024
+
 
 class Pool:
-    def __init__(self, number_of_connections: int):
+    def __init__(self, number_of_connections: int, db_path: str = DB_PATH, shared_cache: bool = False, idle_check_s: float = 30.0,
+                 on_wait: Callable[[float], None] | None = None):
         self.num = number_of_connections
+        self.db_path = db_path
+        self.shared_cache = shared_cache
+        self.idle_check_s = idle_check_s
+        self.on_wait = on_wait  # called with every checkout's queueing time, from the calling thread
         self.pool = Queue(-1)
+        self._stats_lock = threading.Lock()
+        self._in_use = 0
+        self._checkouts = 0
+        self._reconnects = 0
+        self._wait_total_s = 0.0
+        self._wait_max_s = 0.0
         for i in range(self.num):
-            self.pool.put(sqlite3.connect(DB_PATH))
+            self.pool.put((self.connect(), time.monotonic()))
+
+    def connect(self) -> sqlite3.Connection:
+        # connections are handed between worker threads (asyncio.to_thread), never shared concurrently
+        if self.shared_cache:
+            conn = sqlite3.connect(f"file:{self.db_path}?cache=shared", uri=True, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("pragma journal_mode=WAL")
+        conn.execute("pragma synchronous=NORMAL")
+        conn.execute("pragma busy_timeout=5000")
+        conn.execute("pragma temp_store=MEMORY")
+        conn.execute(f"pragma mmap_size={MMAP_SIZE}")
+        conn.execute(f"pragma cache_size=-{CACHE_SIZE_KB}")
+        return conn
 
     def get(self):
-        while True:
-            conn = self.pool.get()
-            if Pool.check_alive(conn):
-                return PooledConnection(self, conn)
-            self.pool.put(sqlite3.connect(DB_PATH))
+        start = time.perf_counter()
+        conn, released_at = self.pool.get()
+        waited = time.perf_counter() - start
+        if time.monotonic() - released_at > self.idle_check_s and not Pool.check_alive(conn):
+            conn = self._reconnect(conn)
+        with self._stats_lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._wait_total_s += waited
+            self._wait_max_s = max(self._wait_max_s, waited)
+        if self.on_wait is not None:
+            self.on_wait(waited)
+        return PooledConnection(self, conn)
 
-    def release(self, conn: sqlite3.Connection):
-        self.pool.put(sqlite3.connect(DB_PATH))
+    def release(self, conn: sqlite3.Connection, failed: bool = False):
+        if failed and not Pool.check_alive(conn):
+            conn = self._reconnect(conn)
+        with self._stats_lock:
+            self._in_use -= 1
+        self.pool.put((conn, time.monotonic()))
+
+    def _reconnect(self, conn: sqlite3.Connection) -> sqlite3.Connection:
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._stats_lock:
+            self._reconnects += 1
+        return self.connect()
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "size": self.num,
+                "in_use": self._in_use,
+                "occupancy": self._in_use / self.num if self.num else 0.0,
+                "checkouts": self._checkouts,
+                "reconnects": self._reconnects,
+                "wait_avg_ms": self._wait_total_s / self._checkouts * 1000 if self._checkouts else 0.0,
+                "wait_max_ms": self._wait_max_s * 1000,
+            }
 
     @staticmethod
     def check_alive(conn: sqlite3.Connection):
@@ -38,9 +102,14 @@ class PooledConnection:
         return self.conn
 
     def __exit__(self, exc_type, exc, tb):
-        if exc_type:
-            self.conn.rollback()
-        else:
-            self.conn.commit()
-
-        self.pool.release(self.conn)
+        failed = exc_type is not None
+        try:
+            if failed:
+                self.conn.rollback()
+            else:
+                self.conn.commit()
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.pool.release(self.conn, failed=failed)
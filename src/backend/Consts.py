@@ -1,4 +1,21 @@
 LIMIT = 5
 PREMIUM_LIMIT = 20
+QUOTA_PERIOD_S = 24 * 60 * 60
+TOKEN_LIMIT = 20_000  # weighted tokens per quota period
+PREMIUM_TOKEN_LIMIT = 200_000
+# what one token costs from the token budget, relative to llama8b; unlisted models count 1
+MODEL_TOKEN_WEIGHTS = {
+    "llama8b": 1,
+    "mistral7b": 1,
+    "gemma7b": 1,
+    "phi3mini": 1,
+    "deepseekv3": 3,
+    "qwen3coder": 3,
+    "kimi2.5": 4,
+    "llama70b": 5,
+    "arctic": 5,
+    "nemotron340b": 20,
+    "llama405b": 25,
+}
 DB_PATH = "db.db"
 ADMIN_PW = ""
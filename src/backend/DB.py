@@ -1,36 +1,24 @@
+import sqlite3
 from src.backend.ConnectionPool import Pool
-from src.backend.Consts import LIMIT, PREMIUM_LIMIT
+from src.backend.Consts import LIMIT, PREMIUM_LIMIT, TOKEN_LIMIT, PREMIUM_TOKEN_LIMIT
 from datetime import datetime
 
+USER_COLUMNS = "Id, Balance, PaidRequests, IsPremium, PremiumDate, IsAdmin, LastModel, Requests, ResetAt, Tokens"
 
-class DB:
-    def __init__(self, pool: Pool):
-        self.pool = pool
-
-    def execute(self, cmd: str, params: tuple = None):  # NEVER use when handling user input (not injection-safe)
-        with self.pool.get() as conn: # FIX: cursor does not have context manager
-            if params:
-                cursor = conn.execute(cmd, params)
-            else:
-                cursor = conn.execute(cmd)
-            conn.commit()
-            return cursor.fetchall()
-
-    def create_user(self, uid):
-        self.execute(f"insert into Users(id) values ({uid})") # FIX: braces
-
-    def get_user(self, uid) -> User | None: # ADD: return type
-        rows = self.execute(f"select * from Users where Id=({uid})") # FIX(1,2)
-        # 1: execute returns fetchall() already, return type is list
-        # 2: braces
-        if not rows:
-            return None
-        data = rows[0]
-        return User(self, *data)
+SAVE_USER_SQL = """
+    INSERT OR REPLACE INTO Users(
+        id, balance, paidrequests, ispremium, premiumdate, isadmin, lastmodel, requests, resetat, tokens
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """
 
 
 class User:
-    def __init__(self, db, uid, balance=0, paid_requests=0, is_premium=False, premium_datetime=0, is_admin=False, last_model=None):
+    # slotted: the user cache may hold millions of these, a per-instance __dict__ would dominate.
+    # touched is the cache's last-access time, kept here to avoid a per-entry wrapper object
+    __slots__ = ("db", "id", "balance", "paid_requests", "is_premium", "premium_datetime", "is_admin", "last_model", "requests", "reset_at", "tokens", "touched")
+
+    def __init__(self, db, uid, balance=0, paid_requests=0, is_premium=False, premium_datetime=0, is_admin=False, last_model=None, requests=None, reset_at=0,
+                 tokens=None):
         self.db = db
         self.id = uid
         self.balance = balance
@@ -39,40 +27,175 @@ class User:
         self.premium_datetime = premium_datetime   # check expiration when starting the dialogue
         self.is_admin = is_admin
         self.last_model = last_model
-        self.requests = PREMIUM_LIMIT if is_premium else LIMIT
+        self.requests = requests if requests is not None else (PREMIUM_LIMIT if is_premium else LIMIT)
+        self.reset_at = reset_at  # unix time when the current quota window ends, 0 if no window is open
+        self.tokens = tokens if tokens is not None else (PREMIUM_TOKEN_LIMIT if is_premium else TOKEN_LIMIT)  # weighted tokens left in the window
+        self.touched = 0.0
+
+    @classmethod
+    def from_row(cls, db, row: tuple) -> "User":
+        # row is in USER_COLUMNS order; skips __init__ argument binding and defaults
+        user = cls.__new__(cls)
+        user.db = db
+        user.id, user.balance, user.paid_requests, user.is_premium, user.premium_datetime, user.is_admin, user.last_model, requests, user.reset_at, tokens = row
+        user.requests = requests if requests is not None else (PREMIUM_LIMIT if user.is_premium else LIMIT)
+        user.tokens = tokens if tokens is not None else (PREMIUM_TOKEN_LIMIT if user.is_premium else TOKEN_LIMIT)
+        user.touched = 0.0
+        return user
 
     def can_make_request(self) -> bool:
-        if self.requests <= 0:
+        # token usage is only known after the answer, so the last request of a window may overdraw
+        if self.requests <= 0 or self.tokens <= 0:
             return False
         self.requests -= 1
         return True
 
+    def charge_tokens(self, tokens: int):
+        self.tokens -= tokens
+
     def set_premium(self, value: bool):
         self.is_premium = value
         self.requests = PREMIUM_LIMIT if value else LIMIT
+        self.tokens = PREMIUM_TOKEN_LIMIT if value else TOKEN_LIMIT
         self.premium_datetime = datetime.now() if value else None
 
-    def save(self):
-        if isinstance(self.db, str) and self.db == "mock":
-            return
-        cmd = """
-            INSERT OR REPLACE INTO Users(
-                id, balance, paidrequests, ispremium, premiumdate, isadmin, lastmodel
-            ) VALUES (?, ?, ?, ?, ?, ?, ?)
-            """
-        params = (
+    def as_row(self) -> tuple:
+        return (
             self.id,
             self.balance,
             self.paid_requests,
             self.is_premium,
             self.premium_datetime,
             self.is_admin,
-            self.last_model
+            self.last_model,
+            self.requests,
+            self.reset_at,
+            self.tokens
         )
-        self.db.execute(cmd, params)
+
+    def save(self):
+        if isinstance(self.db, str) and self.db == "mock":
+            return
+        self.db.execute(SAVE_USER_SQL, self.as_row())
 
     def reset_requests(self):
-        pass
+        self.requests = PREMIUM_LIMIT if self.is_premium else LIMIT
+        self.tokens = PREMIUM_TOKEN_LIMIT if self.is_premium else TOKEN_LIMIT
+        self.reset_at = 0
+
 
-    def create_reset_timer(self):
-        pass
+class DB:
+    def __init__(self, pool: Pool):
+        self.pool = pool
+
+    def execute(self, cmd: str, params: tuple = None):  # NEVER use when handling user input (not injection-safe)
+        with self.pool.get() as conn: # FIX: cursor does not have context manager
+            if params:
+                cursor = conn.execute(cmd, params)
+            else:
+                cursor = conn.execute(cmd)
+            return cursor.fetchall()  # commit happens once, in PooledConnection.__exit__
+
+    def ensure_schema(self):
+        columns = {row[1].lower() for row in self.execute("pragma table_info(Users)")}
+        for name, definition in (("Requests", "INTEGER"), ("ResetAt", "INTEGER NOT NULL DEFAULT 0"), ("Tokens", "INTEGER")):
+            if name.lower() not in columns:
+                self._add_column("Users", name, definition)
+
+    def _add_column(self, table: str, name: str, definition: str):
+        # several processes may migrate the same file at once; whoever loses the race is done too
+        try:
+            self.execute(f"alter table {table} add column {name} {definition}")
+        except sqlite3.OperationalError as e:
+            if "duplicate column name" not in str(e):
+                raise
+
+    def create_user(self, uid):
+        self.execute(f"insert into Users(id) values ({uid})") # FIX: braces
+
+    def get_user(self, uid) -> User | None: # ADD: return type
+        rows = self.execute(f"select {USER_COLUMNS} from Users where Id=?", (uid,))
+        if not rows:
+            return None
+        return User.from_row(self, rows[0])
+
+    def save_users(self, rows: list[tuple]):
+        with self.pool.get() as conn:
+            conn.executemany(SAVE_USER_SQL, rows)
+
+    def ensure_response_cache_schema(self):
+        self.execute("""
+            create table if not exists ResponseCache(
+                Key TEXT PRIMARY KEY,
+                Model TEXT NOT NULL,
+                Answer TEXT NOT NULL,
+                CreatedAt INTEGER NOT NULL
+            )
+            """)
+
+    def get_cached_response(self, key: str, not_before: int) -> str | None:
+        rows = self.execute("select Answer from ResponseCache where Key=? and CreatedAt>=?", (key, not_before))
+        return rows[0][0] if rows else None
+
+    def put_cached_responses(self, rows: list[tuple]):
+        with self.pool.get() as conn:
+            conn.executemany("insert or replace into ResponseCache(Key, Model, Answer, CreatedAt) values (?, ?, ?, ?)", rows)
+
+    def prune_response_cache(self, not_before: int):
+        self.execute("delete from ResponseCache where CreatedAt<?", (not_before,))
+
+    def ensure_fsm_schema(self):
+        self.execute("""
+            create table if not exists FSMState(
+                Key TEXT PRIMARY KEY,
+                State TEXT,
+                Data TEXT NOT NULL,
+                UpdatedAt INTEGER NOT NULL
+            )
+            """)
+
+    def get_fsm_record(self, key: str, not_before: int) -> tuple[str | None, str] | None:
+        rows = self.execute("select State, Data from FSMState where Key=? and UpdatedAt>=?", (key, not_before))
+        return rows[0] if rows else None
+
+    def save_fsm_records(self, rows: list[tuple], deleted: list[str]):
+        with self.pool.get() as conn:
+            conn.executemany("insert or replace into FSMState(Key, State, Data, UpdatedAt) values (?, ?, ?, ?)", rows)
+            conn.executemany("delete from FSMState where Key=?", [(key,) for key in deleted])
+
+    def touch_fsm_records(self, keys: list[str], updated_at: int):
+        with self.pool.get() as conn:
+            conn.executemany("update FSMState set UpdatedAt=? where Key=?", [(updated_at, key) for key in keys])
+
+    def prune_fsm(self, not_before: int):
+        self.execute("delete from FSMState where UpdatedAt<?", (not_before,))
+
+    def ensure_token_usage_schema(self):
+        self.execute("""
+            create table if not exists TokenUsage(
+                UserId INTEGER NOT NULL,
+                Model TEXT NOT NULL,
+                PeriodStart INTEGER NOT NULL,
+                Requests INTEGER NOT NULL DEFAULT 0,
+                PromptTokens INTEGER NOT NULL DEFAULT 0,
+                CompletionTokens INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (UserId, Model, PeriodStart)
+            )
+            """)
+
+    def add_token_usage(self, rows: list[tuple]):
+        # rows are increments: (user_id, model, period_start, requests, prompt_tokens, completion_tokens)
+        with self.pool.get() as conn:
+            conn.executemany("""
+                insert into TokenUsage(UserId, Model, PeriodStart, Requests, PromptTokens, CompletionTokens) values (?, ?, ?, ?, ?, ?)
+                on conflict(UserId, Model, PeriodStart) do update set
+                    Requests=Requests+excluded.Requests,
+                    PromptTokens=PromptTokens+excluded.PromptTokens,
+                    CompletionTokens=CompletionTokens+excluded.CompletionTokens
+                """, rows)
+
+    def get_token_usage(self, user_id: int, since: int) -> list[tuple]:
+        return self.execute(
+            "select Model, sum(Requests), sum(PromptTokens), sum(CompletionTokens) from TokenUsage where UserId=? and PeriodStart>=? group by Model",
+            (user_id, since),
+        )
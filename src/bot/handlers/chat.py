@@ -1,11 +1,15 @@
+from datetime import datetime
 from aiogram import Router, F
 from aiogram.types import Message
 from aiogram.fsm.context import FSMContext
 from src.bot.services.user_manager import UserManager
 from src.bot.keyboards.user import keyboard_chat, keyboard_default
 from src.bot.context.states import Chat
+from src.bot.middlewares.flood_control import FREE_INTERVAL_S, PREMIUM_INTERVAL_S
 from src.bot.services.api_manager import ApiManager
+from src.bot.services.quota_manager import QuotaManager
 from src.bot.utils.models_list import models_dict
+from src.bot.utils.streaming import answer_streaming
 
 handler_chat = Router()
 
@@ -16,7 +20,7 @@ async def build_initial_chat_message(user_id: int) -> str:
 
 <b>🤖 Модель:</b> <code>{user.last_model}</code>  
 <b>📦 Ваш план:</b> <code>{"Premium" if user.is_premium else "Free"}</code>  
-<b>⏱ Частота запросов:</b> <code>{"unlimited" if user.is_premium else "1.6s/шт"}</code>
+<b>⏱ Частота запросов:</b> <code>{PREMIUM_INTERVAL_S if user.is_premium else FREE_INTERVAL_S:g}s/шт</code>
 
 Чтобы писать сообщения — используйте клавиатуру телефона.
 
@@ -24,6 +28,14 @@ async def build_initial_chat_message(user_id: int) -> str:
     """
     return text
 
+def build_limit_message(reset_at: int) -> str:
+    reset_time = datetime.fromtimestamp(reset_at).strftime("%d.%m %H:%M")
+    return f"""
+<b>⛔ Лимит запросов исчерпан</b>
+
+Новые запросы станут доступны <code>{reset_time}</code>.
+    """
+
 @handler_chat.message(F.text == "💬Новый чат")
 async def chat_start(message: Message, state: FSMContext):
     initial_msg = await build_initial_chat_message(message.from_user.id)
@@ -36,9 +48,12 @@ async def chat_exit(message: Message, state: FSMContext):
     await message.answer(text, reply_markup=keyboard_default)
     await state.clear()
 
-@handler_chat.message(Chat.waiting_for_exit)
+@handler_chat.message(Chat.waiting_for_exit, flags={"rate_limit": True})
 async def chat_continuous_dialog(message):
     user = await UserManager.get_user(message.from_user.id)
+    if not QuotaManager.try_consume(user):
+        await message.answer(build_limit_message(user.reset_at), parse_mode="HTML", reply_markup=keyboard_chat)
+        return
     model_short_id = models_dict[user.last_model]
-    model_answer = await ApiManager.send_request(model_short_id, message.text)
-    await message.answer(model_answer, reply_markup=keyboard_chat)
\ No newline at end of file
+    chunks = ApiManager.stream_request(model_short_id, message.text, user.id, premium=user.is_premium)
+    await answer_streaming(message, chunks, reply_markup=keyboard_chat)
\ No newline at end of file
@@ -25,6 +25,6 @@ async def model_choice(message: Message, state: FSMContext):
         user = await UserManager.get_user(message.from_user.id)
         if user.last_model != text:
             user.last_model = text
-            user.save()
+            UserManager.save_user(user)
     else:
         await message.answer("Выберите модель используя отображенные телеграм-кнопки")
@@ -1,11 +1,22 @@
+from time import time
 from aiogram import Router, F
 from aiogram.types import Message
+from src.backend.Consts import QUOTA_PERIOD_S
+from src.bot.services.token_usage import TokenUsage
 from src.bot.services.user_manager import UserManager
 
 handler_profile = Router()
 
 async def build_profile_message(user_id: int) -> str:
     user = await UserManager.get_user(user_id)
+    # usage since the current quota window opened (or over the last period when none is open)
+    now = int(time())
+    window_start = user.reset_at - QUOTA_PERIOD_S if user.reset_at > now else now - QUOTA_PERIOD_S
+    usage = await TokenUsage.usage_for(user.id, window_start)
+    usage_lines = "\n".join(
+        f"• <code>{model}</code>: {requests} запр., {prompt + completion} ток."
+        for model, (requests, prompt, completion) in sorted(usage.items())
+    ) or "—"
     text = f"""
 <b>👤 Ваш профиль</b>
 
@@ -13,6 +24,9 @@ async def build_profile_message(user_id: int) -> str:
 <b>💰 Баланс:</b> <code>{user.balance} ⭐</code>
 
 <b>📦 Оплачено запросов:</b> <code>{user.paid_requests}</code>
+<b>🔢 Осталось токенов:</b> <code>{max(user.tokens, 0)}</code>
+<b>📊 Использовано за период:</b>
+{usage_lines}
 
 <b>💎 Премиум-статус:</b> <code>{user.is_premium}</code>
 <b>📅 Действует до:</b> <code>{user.premium_datetime}</code>
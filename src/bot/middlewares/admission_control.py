@@ -0,0 +1,122 @@
+from asyncio import CancelledError, Future, get_running_loop, wait_for
+from collections import deque
+from time import monotonic, perf_counter
+from typing import Any, Awaitable, Callable
+from aiogram import BaseMiddleware
+from aiogram.types import Message
+
+BUSY_MESSAGE = "⚠️ Бот сейчас перегружен. Попробуйте ещё раз через несколько секунд."
+
+
+class AdaptiveLimiter:
+    # AIMD concurrency limit: every completion under the latency target grows the limit by
+    # 1/limit (about +1 per limit completions) while at least half of it is in use, so light
+    # load does not inflate it past what was ever tested; a completion above it shrinks the limit by
+    # `backoff`, at most once per target window so one slow burst does not collapse it.
+    # Beyond the limit, up to max_queue updates wait at most max_wait_s; the rest are shed.
+    def __init__(self, initial_limit: float = 200, min_limit: float = 10, max_limit: float = 5000,
+                 target_latency_s: float = 5.0, backoff: float = 0.9, max_queue: int = 500, max_wait_s: float = 2.0):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency_s = target_latency_s
+        self.backoff = backoff
+        self.max_queue = max_queue
+        self.max_wait_s = max_wait_s
+        self.in_flight = 0
+        self._waiters: deque[Future] = deque()
+        self._next_decrease = 0.0
+        self.admitted = 0
+        self.queued = 0
+        self.shed_queue_full = 0
+        self.shed_timeout = 0
+
+    async def acquire(self) -> bool:
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+        if len(self._waiters) >= self.max_queue:
+            self.shed_queue_full += 1
+            return False
+        waiter = get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        try:
+            await wait_for(waiter, self.max_wait_s)
+        except TimeoutError:
+            self._discard(waiter)
+            self.shed_timeout += 1
+            return False
+        except CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.in_flight -= 1  # admitted just as we were cancelled: give the slot back
+                self._wake()
+            else:
+                self._discard(waiter)
+            raise
+        self.admitted += 1
+        return True
+
+    def release(self, latency_s: float):
+        binding = self.in_flight >= self.limit / 2
+        self.in_flight -= 1
+        if latency_s <= self.target_latency_s:
+            if binding:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        else:
+            now = monotonic()
+            if now >= self._next_decrease:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._next_decrease = now + self.target_latency_s
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def _discard(self, waiter: Future):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queue_depth": len(self._waiters),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "shed_queue_full": self.shed_queue_full,
+            "shed_timeout": self.shed_timeout,
+        }
+
+
+class AdmissionControlMiddleware(BaseMiddleware):
+    def __init__(self, limiter: AdaptiveLimiter | None = None):
+        self.limiter = limiter or AdaptiveLimiter()
+
+    async def __call__(
+        self,
+        handler: Callable[[Message, dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: dict[str, Any],
+    ) -> Any:
+        if not await self.limiter.acquire():
+            try:
+                await event.answer(BUSY_MESSAGE)
+            except Exception as e:
+                print(f"Failed to send busy reply: {e}")
+            return None
+        start = perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.limiter.release(perf_counter() - start)
+
+    def stats(self) -> dict:
+        return self.limiter.stats()
@@ -0,0 +1,85 @@
+from time import monotonic
+from typing import Any, Awaitable, Callable
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import Message
+from src.bot.services.user_manager import UserManager
+
+FREE_INTERVAL_S = 1.6
+FREE_BURST = 3
+PREMIUM_INTERVAL_S = 0.3
+PREMIUM_BURST = 10
+
+
+class GCRALimiter:
+    # Generic cell rate algorithm: one float (theoretical arrival time) per user,
+    # O(1) per check. Entries whose TAT is in the past carry no state and are pruned.
+    def __init__(self, prune_every_s: float = 60.0):
+        self._tat: dict[int, float] = {}
+        self.prune_every_s = prune_every_s
+        self._next_prune = monotonic() + prune_every_s
+
+    def __len__(self) -> int:
+        return len(self._tat)
+
+    def allow(self, key: int, now: float, interval_s: float, burst: int) -> bool:
+        tat = self._tat.get(key, now)
+        if tat < now:
+            tat = now
+        if tat - now > interval_s * (burst - 1):
+            return False
+        self._tat[key] = tat + interval_s
+        if now >= self._next_prune:
+            self.prune(now)
+        return True
+
+    def prune(self, now: float):
+        self._tat = {key: tat for key, tat in self._tat.items() if tat > now}
+        self._next_prune = now + self.prune_every_s
+
+
+class FloodControlMiddleware(BaseMiddleware):
+    # inner middleware: only handlers flagged rate_limit (the LLM-bound chat messages) are
+    # limited, so menu buttons, commands and "❌Завершить чат" always get through
+    def __init__(self, free_interval_s: float = FREE_INTERVAL_S, free_burst: int = FREE_BURST,
+                 premium_interval_s: float = PREMIUM_INTERVAL_S, premium_burst: int = PREMIUM_BURST):
+        self.free = (free_interval_s, free_burst)
+        self.premium = (premium_interval_s, premium_burst)
+        self.limiter = GCRALimiter()
+        self._warned: dict[int, float] = {}  # user_id -> when the current burst warning expires
+        self._next_warned_prune = monotonic() + 60.0
+        self.allowed = 0
+        self.dropped = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[Message, dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: dict[str, Any],
+    ) -> Any:
+        if event.from_user is None or not get_flag(data, "rate_limit"):
+            return await handler(event, data)
+        user_id = event.from_user.id
+        # only the in-memory copy is consulted: users we have not loaded yet are treated as free
+        user = UserManager.peek_user(user_id)
+        interval_s, burst = self.premium if user is not None and user.is_premium else self.free
+        now = monotonic()
+        if self.limiter.allow(user_id, now, interval_s, burst):
+            self.allowed += 1
+            return await handler(event, data)
+
+        self.dropped += 1
+        if now >= self._next_warned_prune:
+            self._warned = {key: until for key, until in self._warned.items() if until > now}
+            self._next_warned_prune = now + 60.0
+        if self._warned.get(user_id, 0.0) <= now:
+            self._warned[user_id] = now + interval_s * burst
+            await event.answer(f"⏳ Слишком много сообщений. Подождите {interval_s:g} с. перед следующим запросом.")
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "allowed": self.allowed,
+            "dropped": self.dropped,
+            "tracked_users": len(self.limiter),
+        }
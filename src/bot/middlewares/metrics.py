@@ -0,0 +1,55 @@
+from time import perf_counter
+from typing import Any, Awaitable, Callable
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import Message
+from src.bot.services.metrics import ERRORS, HANDLER_SECONDS, IN_FLIGHT, TELEGRAM_SECONDS
+from src.bot.services.tracing import add_span, annotate
+
+
+class MetricsMiddleware(BaseMiddleware):
+    # inner middleware: runs after the filters picked a handler, so the handler's name is the label
+    async def __call__(
+        self,
+        handler: Callable[[Message, dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object is not None else "unknown"
+        annotate(handler=name)
+        IN_FLIGHT.inc("updates")
+        start = perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            ERRORS.inc("handler", type(e).__name__)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(perf_counter() - start, name)
+            IN_FLIGHT.dec("updates")
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    # session middleware: every Bot API call (answer, edit_text, ...) timed by method name
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        name = type(method).__name__
+        IN_FLIGHT.inc("telegram_requests")
+        start = perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            ERRORS.inc("telegram", type(e).__name__)
+            raise
+        finally:
+            end = perf_counter()
+            TELEGRAM_SECONDS.observe(end - start, name)
+            add_span(f"telegram.{name}", start, end)
+            IN_FLIGHT.dec("telegram_requests")
@@ -0,0 +1,31 @@
+from typing import Any, Awaitable, Callable
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+from src.bot.services.tracing import Tracer, _current
+
+
+class TracingMiddleware(BaseMiddleware):
+    # outer middleware on dp.update: the trace spans everything from flood control to the
+    # last Telegram call, and services add their spans through the context variable
+    def __init__(self, tracer: Tracer):
+        self.tracer = tracer
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: dict[str, Any],
+    ) -> Any:
+        trace = self.tracer.start(event.update_id)
+        user = data.get("event_from_user")
+        if user is not None:
+            trace.attrs["user_id"] = user.id
+        token = _current.set(trace)
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            trace.error = type(e).__name__
+            raise
+        finally:
+            _current.reset(token)
+            self.tracer.finish(trace)
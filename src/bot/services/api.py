@@ -1,6 +1,11 @@
+import asyncio
 import openai
+import random
+import threading
 import time
-from typing import List, Dict, Optional, Any
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Callable, List, Dict, Optional, Any, Tuple
 
 MODELS = {
   'llama8b': 'meta/llama3-8b-instruct',
@@ -16,24 +21,146 @@ MODELS = {
   'kimi2.5': 'kimi/kimi-2.5'
 }
 
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError)
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+  response = getattr(error, "response", None)
+  if response is None:
+    return None
+  headers = response.headers
+  value = headers.get("retry-after-ms")
+  if value is not None:
+    try:
+      return float(value) / 1000
+    except ValueError:
+      pass
+  value = headers.get("retry-after")
+  if value is None:
+    return None
+  try:
+    return max(float(value), 0.0)
+  except ValueError:
+    pass
+  try:
+    return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+  except (TypeError, ValueError):
+    return None
+
+
+@dataclass
+class KeyStats:
+  requests: int = 0
+  rate_limited: int = 0
+  errors: int = 0
+  waited_s: float = 0.0
+
+
+class TokenBucket:
+  def __init__(self, rate_per_minute: float, burst: int, now: float):
+    self.rate = rate_per_minute / 60
+    self.capacity = float(burst)
+    self.tokens = float(burst)
+    self.updated = now
+    self.blocked_until = 0.0
+
+  def delay(self, now: float) -> float:
+    tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+    wait = 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+    return max(wait, self.blocked_until - now)
+
+  def take(self, now: float):
+    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate) - 1
+    self.updated = now
+
+  def block(self, now: float, seconds: float):
+    self.blocked_until = max(self.blocked_until, now + seconds)
+    self.tokens = min(self.tokens, 0.0)
+
+
+class RateLimitScheduler:
+  # One token bucket per (model, key). Slots are reserved up front, so concurrent
+  # callers queue behind each other instead of all waking up at the same moment.
+  def __init__(self, requests_per_minute: float = 40, burst: int = 1, clock: Callable[[], float] = time.monotonic):
+    self.requests_per_minute = requests_per_minute
+    self.burst = burst
+    self.clock = clock
+    self.started = clock()
+    self.buckets: Dict[str, List[TokenBucket]] = {}
+    self.stats: Dict[str, List[KeyStats]] = {}
+    self._lock = threading.Lock()
+
+  def add_model(self, model: str, keys_count: int):
+    now = self.clock()
+    self.buckets[model] = [TokenBucket(self.requests_per_minute, self.burst, now) for _ in range(keys_count)]
+    self.stats[model] = [KeyStats() for _ in range(keys_count)]
+
+  def reserve(self, model: str) -> Tuple[int, float]:
+    buckets = self.buckets.get(model)
+    if not buckets:
+      raise ValueError(f"Model {model} not found.")
+    with self._lock:
+      now = self.clock()
+      stats = self.stats[model]
+      index = min(range(len(buckets)), key=lambda i: (buckets[i].delay(now), stats[i].requests))
+      delay = buckets[index].delay(now)
+      buckets[index].take(now)
+      stats[index].requests += 1
+      stats[index].waited_s += delay
+      return index, delay
+
+  def penalize(self, model: str, index: int, seconds: float, rate_limited: bool = True):
+    with self._lock:
+      self.buckets[model][index].block(self.clock(), seconds)
+      if rate_limited:
+        self.stats[model][index].rate_limited += 1
+      else:
+        self.stats[model][index].errors += 1
+
+  def utilisation(self) -> Dict[str, List[Dict[str, float]]]:
+    elapsed = max(self.clock() - self.started, 1e-9)
+    capacity = elapsed * self.requests_per_minute / 60 + self.burst
+    return {
+      model: [
+        {
+          "requests": s.requests,
+          "rate_limited": s.rate_limited,
+          "errors": s.errors,
+          "avg_wait_s": s.waited_s / s.requests if s.requests else 0.0,
+          "utilisation": min(s.requests / capacity, 1.0),
+        }
+        for s in stats
+      ]
+      for model, stats in self.stats.items()
+    }
+
+
 class NvidiaNIMClient:
-  def __init__(self, api_keys: Dict[str, List[str]], base_url: str = "https://integrate.api.nvidia.com/v1", use_aliases: bool = True):
+  _client_cls = openai.OpenAI
+
+  def __init__(self, api_keys: Dict[str, List[str]], base_url: str = "https://integrate.api.nvidia.com/v1", use_aliases: bool = True, requests_per_minute: float = 40, max_retries: int = 5, backoff_base: float = 1.0, backoff_cap: float = 60.0):
     self.use_aliases = use_aliases
     self.clients = {}
-    self.current_key_index = {}
+    self.scheduler = RateLimitScheduler(requests_per_minute)
+    self.max_retries = max_retries
+    self.backoff_base = backoff_base
+    self.backoff_cap = backoff_cap
     for alias_or_model, keys in api_keys.items():
       model = MODELS.get(alias_or_model, alias_or_model) if use_aliases else alias_or_model
       self.clients[model] = []
       for key in keys:
-        self.clients[model].append(openai.OpenAI(base_url=base_url, api_key=key))
-      self.current_key_index[model] = 0
-    self.rate_limit_wait = 60 / 40 + 0.1
+        # retries are driven by the scheduler, not by the SDK
+        self.clients[model].append(self._client_cls(base_url=base_url, api_key=key, max_retries=0))
+      self.scheduler.add_model(model, len(keys))
 
   def list_models(self):
     print("Available models (short name: full name):")
     for alias, full in MODELS.items():
       print(f"{alias}: {full}")
 
+  def key_stats(self) -> Dict[str, List[Dict[str, float]]]:
+    return self.scheduler.utilisation()
+
   def get_available_models(self) -> List[str]:
     if not self.clients:
       print("There are no initialized models/keys.")
@@ -55,59 +182,105 @@ class NvidiaNIMClient:
     clients = self.clients.get(model)
     if not clients:
       raise ValueError(f"Model {model} not found.")
-    index = self.current_key_index[model]
-    client = clients[index]
-    self.current_key_index[model] = (index + 1) % len(clients)
-    return client
+    index, delay = self.scheduler.reserve(model)
+    return index, clients[index], delay
+
+  def _on_retryable_error(self, model: str, index: int, error: Exception, attempt: int):
+    backoff = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+    retry_after = retry_after_seconds(error)
+    if retry_after is not None:
+      backoff = retry_after + random.uniform(0, self.backoff_base)
+    self.scheduler.penalize(model, index, backoff, rate_limited=isinstance(error, openai.RateLimitError))
+
+  def _request(self, model: str, create: Callable[[Any], Any], stream: bool) -> Dict:
+    for attempt in range(self.max_retries + 1):
+      index, client, delay = self._get_client(model)
+      if delay > 0:
+        time.sleep(delay)
+      try:
+        response = create(client)
+        if stream:
+          return response
+        return response.model_dump()
+      except RETRYABLE_ERRORS as e:
+        self._on_retryable_error(model, index, e, attempt)
+        if attempt == self.max_retries:
+          print(f"Error: {e}")
+          return {"error": str(e)}
+      except Exception as e:
+        print(f"Error: {e}")
+        return {"error": str(e)}
 
   def chat_completion(self, model: str, messages: List[Dict[str, str]], max_tokens: int = 100, temperature: float = 0.7, top_p: float = 1.0, presence_penalty: float = 0.0, frequency_penalty: float = 0.0, stream: bool = False, **kwargs: Any) -> Dict:
     if self.use_aliases:
       model = MODELS.get(model, model)
-    time.sleep(self.rate_limit_wait)
-    client = self._get_client(model)
-    try:
-      response = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        max_tokens=max_tokens,
-        temperature=temperature,
-        top_p=top_p,
-        presence_penalty=presence_penalty,
-        frequency_penalty=frequency_penalty,
-        stream=stream,
-        **kwargs
-      )
-      if stream:
-        return response
-      return response.model_dump()
-    except openai.RateLimitError:
-      time.sleep(60)
-      return self.chat_completion(model, messages, max_tokens, temperature, top_p, presence_penalty, frequency_penalty, stream, **kwargs)
-    except Exception as e:
-      print(f"Error: {e}")
-      return {"error": str(e)}
+    return self._request(model, lambda client: client.chat.completions.create(
+      model=model,
+      messages=messages,
+      max_tokens=max_tokens,
+      temperature=temperature,
+      top_p=top_p,
+      presence_penalty=presence_penalty,
+      frequency_penalty=frequency_penalty,
+      stream=stream,
+      **kwargs
+    ), stream)
 
   def completion(self, model: str, prompt: str, max_tokens: int = 100, temperature: float = 0.7, top_p: float = 1.0, stream: bool = False, **kwargs: Any) -> Dict:
     if self.use_aliases:
       model = MODELS.get(model, model)
-    time.sleep(self.rate_limit_wait)
-    client = self._get_client(model)
+    return self._request(model, lambda client: client.completions.create(
+      model=model,
+      prompt=prompt,
+      max_tokens=max_tokens,
+      temperature=temperature,
+      top_p=top_p,
+      stream=stream,
+      **kwargs
+    ), stream)
+
+
+class AsyncNvidiaNIMClient(NvidiaNIMClient):
+  _client_cls = openai.AsyncOpenAI
+
+  async def get_available_models(self) -> List[str]:
+    if not self.clients:
+      print("There are no initialized models/keys.")
+      return []
+    first_model = next(iter(self.clients))
+    client = self.clients[first_model][0]
     try:
-      response = client.completions.create(
-        model=model,
-        prompt=prompt,
-        max_tokens=max_tokens,
-        temperature=temperature,
-        top_p=top_p,
-        stream=stream,
-        **kwargs
-      )
-      if stream:
-        return response
-      return response.model_dump()
-    except openai.RateLimitError:
-      time.sleep(60)
-      return self.completion(model, prompt, max_tokens, temperature, top_p, stream, **kwargs)
+      response = await client.models.list()
+      models = [m.id for m in response.data]
+      print(f"List of current models from API (on {first_model}):")
+      for m in models:
+        print(m)
+      return models
     except Exception as e:
-      print(f"Error: {e}")
-      return {"error": str(e)}
\ No newline at end of file
+      print(f"Error fetching models list from API: {e}")
+      return []
+
+  async def _request(self, model: str, create: Callable[[Any], Any], stream: bool) -> Dict:
+    for attempt in range(self.max_retries + 1):
+      index, client, delay = self._get_client(model)
+      if delay > 0:
+        await asyncio.sleep(delay)
+      try:
+        response = await create(client)
+        if stream:
+          return response
+        return response.model_dump()
+      except RETRYABLE_ERRORS as e:
+        self._on_retryable_error(model, index, e, attempt)
+        if attempt == self.max_retries:
+          print(f"Error: {e}")
+          return {"error": str(e)}
+      except Exception as e:
+        print(f"Error: {e}")
+        return {"error": str(e)}
+
+  async def chat_completion(self, model: str, messages: List[Dict[str, str]], max_tokens: int = 100, temperature: float = 0.7, top_p: float = 1.0, presence_penalty: float = 0.0, frequency_penalty: float = 0.0, stream: bool = False, **kwargs: Any) -> Dict:
+    return await super().chat_completion(model, messages, max_tokens, temperature, top_p, presence_penalty, frequency_penalty, stream, **kwargs)
+
+  async def completion(self, model: str, prompt: str, max_tokens: int = 100, temperature: float = 0.7, top_p: float = 1.0, stream: bool = False, **kwargs: Any) -> Dict:
+    return await super().completion(model, prompt, max_tokens, temperature, top_p, stream, **kwargs)
@@ -1,27 +1,63 @@
-from src.bot.services.api import NvidiaNIMClient, MODELS
+from src.bot.services.api import AsyncNvidiaNIMClient, MODELS
+from src.bot.services.response_cache import ResponseCache
+from src.bot.services.single_flight import SingleFlight
+from src.bot.services.metrics import ERRORS, IN_FLIGHT, LLM_TOKENS, STAGE_SECONDS
+from src.bot.services.tracing import add_span
+from src.bot.services.llm_scheduler import LLMScheduler
+from src.bot.services.token_usage import TokenUsage
+from src.backend.ConnectionPool import Pool
+from src.backend.DB import DB
 from os import getenv
-from asyncio import to_thread, Lock, sleep as async_sleep
+from time import perf_counter
+from asyncio import Lock, sleep as async_sleep
+from typing import AsyncIterator, Callable, Iterable
+
+SYSTEM_PROMPT = "Ты полезный ассистент. Отвечай по-русски."
+MAX_TOKENS = 300
 
 class ApiManager:
-    _nv_client: NvidiaNIMClient | None = None
+    _nv_client: AsyncNvidiaNIMClient | None = None
     _is_mock = False
     _mock_delay_ms: int | None = None
+    _mock_latency: Callable[[], float] | None = None  # seconds to the first mocked token
+    _mock_token_ms = 0.0  # per further word, like the mock NIM server's token_ms
     _init_lock = Lock()
+    _cache: ResponseCache | None = None
+    _flights = SingleFlight()
+    _base_url: str | None = None
+    _api_keys: list[str] | None = None
+    _requests_per_minute = 40.0
 
     @classmethod
-    def setup(cls, mock: bool = False, mock_delay_ms: int = 0):
+    def setup(cls, mock: bool = False, mock_delay_ms: int = 0, cache: bool = True, cache_size: int = 10_000, cache_ttl_s: float = 3600.0,
+              cache_persistent: bool = False, cache_opt_out: Iterable[str] = (), base_url: str | None = None, api_keys: list[str] | None = None,
+              requests_per_minute: float = 40.0, mock_latency: Callable[[], float] | None = None, mock_token_ms: float = 0.0):
         cls._is_mock = mock
         cls._mock_delay_ms = mock_delay_ms
+        cls._mock_latency = mock_latency
+        cls._mock_token_ms = mock_token_ms
+        cls._base_url = base_url
+        cls._api_keys = api_keys
+        cls._requests_per_minute = requests_per_minute
+        cls._flights = SingleFlight()
+        cls._cache = None
+        if cache:
+            cache_db = DB(pool=Pool(number_of_connections=1)) if cache_persistent else None
+            cls._cache = ResponseCache(max_size=cache_size, ttl_s=cache_ttl_s, db=cache_db, opt_out=[MODELS.get(m, m) for m in cache_opt_out])
         if mock:
             cls._nv_client = None
             return
+        cls._create_client()
 
-        keys = getenv("NVAPI_KEYS").strip().split("\n")
+    @classmethod
+    def _create_client(cls):
+        keys = cls._api_keys or getenv("NVAPI_KEYS").strip().split("\n")
         if not keys:
             raise RuntimeError("No NVIDIA API keys found in env (NVAPI_KEYS)")
 
         api_keys = {alias: keys for alias in MODELS.keys()}
-        cls._nv_client = NvidiaNIMClient(api_keys)
+        kwargs = {"base_url": cls._base_url} if cls._base_url else {}
+        cls._nv_client = AsyncNvidiaNIMClient(api_keys, requests_per_minute=cls._requests_per_minute, **kwargs)
 
     @classmethod
     async def _ensure_init(cls):
@@ -33,32 +69,188 @@ class ApiManager:
         async with cls._init_lock:
             if cls._nv_client is not None:
                 return
-            cls.setup(mock=False)
+            cls._create_client()
 
     @classmethod
-    async def send_request(cls, model: str, message: str) -> str:
-        if cls._is_mock:
-            if cls._mock_delay_ms:
-                await async_sleep(cls._mock_delay_ms / 1000)
-            return f"mock({model}): {message[:50]}"
-
-        await cls._ensure_init()
+    def key_stats(cls) -> dict:
         if cls._nv_client is None:
-            raise RuntimeError("NvidiaNIMClient not initialized")
+            return {}
+        return cls._nv_client.key_stats()
+
+    @classmethod
+    def cache_stats(cls) -> dict:
+        if cls._cache is None:
+            return {}
+        return cls._cache.stats()
+
+    @classmethod
+    def flight_stats(cls) -> dict:
+        return cls._flights.stats()
+
+    @classmethod
+    async def shutdown(cls):
+        if cls._cache is not None:
+            await cls._cache.flush()
+
+    @classmethod
+    def _mock_delay_s(cls) -> float:
+        if cls._mock_latency is not None:
+            return cls._mock_latency()
+        return (cls._mock_delay_ms or 0) / 1000
 
-        messages = [
-            {"role": "system", "content": "Ты полезный ассистент. Отвечай по-русски."},
+    @staticmethod
+    def _build_messages(message: str) -> list[dict[str, str]]:
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": message},
         ]
 
-        def _call():
-            return cls._nv_client.chat_completion(
-                model=model,
-                messages=messages,
-                max_tokens=300,
-            )
+    @classmethod
+    def _cache_key(cls, model: str, message: str) -> str | None:
+        if cls._cache is None:
+            return None
+        return cls._cache.key(MODELS.get(model, model), SYSTEM_PROMPT, message)
+
+    @classmethod
+    async def send_request(cls, model: str, message: str, user_id: int | None = None, premium: bool = False) -> str:
+        key = cls._cache_key(model, message)
+        if key is not None:
+            cached = await cls._cache.get(key)
+            if cached is not None:
+                return cached
+        flight_key = ("complete", MODELS.get(model, model), SYSTEM_PROMPT, message, MAX_TOKENS)
+        answer = await cls._flights.do(flight_key, lambda: cls._complete(model, message, user_id, premium))
+        if key is not None:
+            cls._cache.put(key, MODELS.get(model, model), answer)
+        return answer
+
+    @classmethod
+    async def stream_request(cls, model: str, message: str, user_id: int | None = None, premium: bool = False) -> AsyncIterator[str]:
+        key = cls._cache_key(model, message)
+        if key is not None:
+            cached = await cls._cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+        chunks = []
+        flight_key = ("stream", MODELS.get(model, model), SYSTEM_PROMPT, message, MAX_TOKENS)
+        async for chunk in cls._flights.stream(flight_key, lambda: cls._stream(model, message, user_id, premium)):
+            chunks.append(chunk)
+            yield chunk
+        if key is not None and chunks:
+            cls._cache.put(key, MODELS.get(model, model), "".join(chunks))
+
+    @staticmethod
+    def _record_usage(model: str, user_id: int | None, prompt_tokens: int, completion_tokens: int):
+        # cache hits and single-flight followers cost nothing upstream, so only the caller
+        # whose request actually reached the model is charged
+        name = MODELS.get(model, model)
+        LLM_TOKENS.inc(name, "prompt", amount=prompt_tokens)
+        LLM_TOKENS.inc(name, "completion", amount=completion_tokens)
+        if user_id is not None:
+            TokenUsage.record(user_id, model, prompt_tokens, completion_tokens)
 
-        response = await to_thread(_call)
+    @classmethod
+    async def _complete(cls, model: str, message: str, user_id: int | None = None, premium: bool = False) -> str:
+        # only the single-flight leader gets here, so cache hits and followers never hold a scheduler slot
+        async with LLMScheduler.slot(model, premium):
+            IN_FLIGHT.inc("llm_requests")
+            start = perf_counter()
+            try:
+                return await cls._request_completion(model, message, user_id)
+            except Exception as e:
+                ERRORS.inc("llm", type(e).__name__)
+                raise
+            finally:
+                end = perf_counter()
+                STAGE_SECONDS.observe(end - start, "llm_complete")
+                add_span("llm_complete", start, end, model=model)
+                IN_FLIGHT.dec("llm_requests")
+
+    @classmethod
+    async def _request_completion(cls, model: str, message: str, user_id: int | None) -> str:
+        if cls._is_mock:
+            answer = f"mock({model}): {message[:50]}"
+            delay_s = cls._mock_delay_s() + cls._mock_token_ms * (len(answer.split(" ")) - 1) / 1000
+            if delay_s:
+                await async_sleep(delay_s)
+            cls._record_usage(model, user_id, len(SYSTEM_PROMPT.split()) + len(message.split()), len(answer.split()))
+            return answer
+
+        await cls._ensure_init()
+        if cls._nv_client is None:
+            raise RuntimeError("AsyncNvidiaNIMClient not initialized")
+
+        response = await cls._nv_client.chat_completion(
+            model=model,
+            messages=cls._build_messages(message),
+            max_tokens=MAX_TOKENS,
+        )
         if isinstance(response, dict) and response.get("error"):
             raise RuntimeError(response["error"])
+        usage = response.get("usage") or {}
+        cls._record_usage(model, user_id, usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0)
         return response["choices"][0]["message"]["content"]
+
+    @classmethod
+    async def _stream(cls, model: str, message: str, user_id: int | None = None, premium: bool = False) -> AsyncIterator[str]:
+        # llm_first_token is what the user waits for before the placeholder changes,
+        # llm_stream is the whole generation; the scheduler slot is held until generation ends
+        async with LLMScheduler.slot(model, premium):
+            IN_FLIGHT.inc("llm_requests")
+            start = perf_counter()
+            first = True
+            try:
+                async for chunk in cls._request_stream(model, message, user_id):
+                    if first:
+                        now = perf_counter()
+                        STAGE_SECONDS.observe(now - start, "llm_first_token")
+                        add_span("llm_first_token", start, now, model=model)
+                        first = False
+                    yield chunk
+            except Exception as e:
+                ERRORS.inc("llm", type(e).__name__)
+                raise
+            finally:
+                end = perf_counter()
+                STAGE_SECONDS.observe(end - start, "llm_stream")
+                add_span("llm_stream", start, end, model=model)
+                IN_FLIGHT.dec("llm_requests")
+
+    @classmethod
+    async def _request_stream(cls, model: str, message: str, user_id: int | None) -> AsyncIterator[str]:
+        if cls._is_mock:
+            # the mock delay is the time to the first token, as in the mock NIM server
+            words = f"mock({model}): {message[:50]}".split(" ")
+            delay_s = cls._mock_delay_s()
+            if delay_s:
+                await async_sleep(delay_s)
+            for i, word in enumerate(words):
+                if i and cls._mock_token_ms:
+                    await async_sleep(cls._mock_token_ms / 1000)
+                yield word if i == 0 else " " + word
+            cls._record_usage(model, user_id, len(SYSTEM_PROMPT.split()) + len(message.split()), len(words))
+            return
+
+        await cls._ensure_init()
+        if cls._nv_client is None:
+            raise RuntimeError("AsyncNvidiaNIMClient not initialized")
+
+        response = await cls._nv_client.chat_completion(
+            model=model,
+            messages=cls._build_messages(message),
+            max_tokens=MAX_TOKENS,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        if isinstance(response, dict) and response.get("error"):
+            raise RuntimeError(response["error"])
+        async with response:
+            async for chunk in response:
+                if chunk.usage is not None:
+                    cls._record_usage(model, user_id, chunk.usage.prompt_tokens or 0, chunk.usage.completion_tokens or 0)
+                if not chunk.choices:
+                    continue
+                content = chunk.choices[0].delta.content
+                if content:
+                    yield content
@@ -0,0 +1,171 @@
+from asyncio import Task, create_task, to_thread, sleep as async_sleep
+from collections import OrderedDict
+from json import dumps, loads
+from time import time
+from typing import Any, Mapping
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from src.backend.DB import DB
+from src.bot.services.tracing import traced_to_thread
+
+
+class SQLiteStorage(BaseStorage):
+    # FSM state and data in the FSMState table behind a write-through LRU cache: reads are
+    # served from memory (absent keys are cached too, so the "no state" lookup every message
+    # does stays off the DB), writes update the cache immediately and reach SQLite in one
+    # transaction per flush interval. Rows neither read nor written for longer than ttl_s are
+    # ignored and pruned: reads refresh UpdatedAt too, at most once per touch interval per key.
+    # Data must be JSON-serializable.
+    def __init__(self, db: DB, max_size: int = 100_000, ttl_s: float = 7 * 24 * 3600.0, flush_interval_s: float = 1.0,
+                 prune_interval_s: float = 3600.0, touch_interval_s: float = 3600.0, key_builder: KeyBuilder | None = None):
+        self.db = db
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self.flush_interval_s = flush_interval_s
+        self.prune_interval_s = prune_interval_s
+        self.touch_interval_s = min(touch_interval_s, ttl_s / 2)
+        self.key_builder = key_builder or DefaultKeyBuilder()
+        self._records: OrderedDict[str, tuple[str | None, dict[str, Any]]] = OrderedDict()
+        self._pending: dict[str, tuple[str | None, dict[str, Any]]] = {}
+        self._flushing: dict[str, tuple[str | None, dict[str, Any]]] = {}  # pending rows being written right now
+        self._stamped: dict[str, float] = {}  # key -> when its row's UpdatedAt was last set by us
+        self._touched: set[str] = set()
+        self._flush_task: Task | None = None
+        self._next_prune = time() + prune_interval_s
+        self.hits = 0
+        self.misses = 0
+        self.flushed = 0
+        self.touched = 0
+        db.ensure_fsm_schema()
+        db.prune_fsm(int(time() - ttl_s))
+
+    async def _load(self, key: str) -> tuple[str | None, dict[str, Any]]:
+        record = self._records.get(key)
+        if record is not None:
+            self._records.move_to_end(key)
+            self.hits += 1
+            self._touch(key, record)
+            return record
+        # evicted before its write reached SQLite: the unflushed record is the current one
+        record = self._pending.get(key) or self._flushing.get(key)
+        if record is not None:
+            self.hits += 1
+            self._remember(key, record)
+            return record
+        self.misses += 1
+        row = await traced_to_thread("db.get_fsm_record", self.db.get_fsm_record, key, int(time() - self.ttl_s))
+        # a write may have landed while we were reading; it is newer than the row
+        record = self._records.get(key)
+        if record is None:
+            record = (row[0], loads(row[1])) if row is not None else (None, {})
+            self._remember(key, record)
+            self._touch(key, record)
+        return record
+
+    def _touch(self, key: str, record: tuple[str | None, dict[str, Any]]):
+        # keeps a row that is only being read from expiring; rows we never stamped (loaded from
+        # SQLite) are touched on first read since their UpdatedAt is unknown
+        state, data = record
+        if (state is None and not data) or key in self._pending:
+            return
+        if time() - self._stamped.get(key, 0.0) < self.touch_interval_s:
+            return
+        self._touched.add(key)
+        self._schedule_flush()
+
+    def _store(self, key: str, record: tuple[str | None, dict[str, Any]]):
+        self._remember(key, record)
+        self._pending[key] = record
+        self._touched.discard(key)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = create_task(self._flush_later())
+
+    def _remember(self, key: str, record: tuple[str | None, dict[str, Any]]):
+        self._records[key] = record
+        self._records.move_to_end(key)
+        while len(self._records) > self.max_size:
+            evicted, _ = self._records.popitem(last=False)
+            self._stamped.pop(evicted, None)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        name = self.key_builder.build(key)
+        _, data = await self._load(name)
+        self._store(name, (state.state if isinstance(state, State) else state, data))
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        state, _ = await self._load(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        name = self.key_builder.build(key)
+        state, _ = await self._load(name)
+        self._store(name, (state, data.copy()))
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, data = await self._load(self.key_builder.build(key))
+        return data.copy()
+
+    async def _flush_later(self):
+        await async_sleep(self.flush_interval_s)
+        await self.flush()
+
+    async def flush(self):
+        if not self._pending and not self._touched:
+            return
+        pending, self._pending = self._pending, {}
+        touched, self._touched = list(self._touched), set()
+        self._flushing = pending
+        now = int(time())
+        rows = [(key, state, dumps(data), now) for key, (state, data) in pending.items() if state is not None or data]
+        deleted = [key for key, (state, data) in pending.items() if state is None and not data]
+        if pending:
+            try:
+                await to_thread(self.db.save_fsm_records, rows, deleted)
+                self.flushed += len(pending)
+                for key, *_ in rows:
+                    if key in self._records:
+                        self._stamped[key] = now
+                for key in deleted:
+                    self._stamped.pop(key, None)
+            except Exception as e:
+                print(f"Failed to persist {len(pending)} FSM records: {e}")
+                for key, record in pending.items():
+                    self._pending.setdefault(key, record)  # newer writes win
+            finally:
+                self._flushing = {}
+        if touched:
+            try:
+                await to_thread(self.db.touch_fsm_records, touched, now)
+                self.touched += len(touched)
+                for key in touched:
+                    if key in self._records:
+                        self._stamped[key] = now
+            except Exception as e:
+                print(f"Failed to refresh {len(touched)} FSM records: {e}")
+                self._touched.update(key for key in touched if key not in self._pending)
+        if now >= self._next_prune:
+            self._next_prune = now + self.prune_interval_s
+            await to_thread(self.db.prune_fsm, int(now - self.ttl_s))
+
+    async def close(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._records),
+            "pending": len(self._pending),
+            "hits": self.hits,
+            "misses": self.misses,
+            "flushed": self.flushed,
+            "touched": self.touched,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,128 @@
+from asyncio import Future, get_running_loop
+from collections import deque
+from contextlib import asynccontextmanager
+from time import perf_counter
+
+DEFAULT_CONCURRENCY = 8
+MODEL_CONCURRENCY = {
+    "llama405b": 2,
+    "nemotron340b": 2,
+    "deepseekv3": 4,
+    "kimi2.5": 4,
+}
+PREMIUM_WEIGHT = 4
+
+
+class _ModelQueue:
+    __slots__ = ("limit", "active", "premium", "free", "premium_streak", "stats")
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.premium: deque[Future] = deque()
+        self.free: deque[Future] = deque()
+        self.premium_streak = 0
+        self.stats = {
+            "admitted": 0,
+            "queued": 0,
+            "wait_total_s": {"premium": 0.0, "free": 0.0},
+            "wait_max_s": {"premium": 0.0, "free": 0.0},
+            "served": {"premium": 0, "free": 0},
+            "run_total_s": 0.0,
+        }
+
+
+class LLMScheduler:
+    # Per-model concurrency limits with weighted round robin between tiers: when a slot
+    # frees up, premium waiters get PREMIUM_WEIGHT turns for every free-tier turn, so a
+    # free-tier flood cannot starve premium users and vice versa.
+    _queues: dict[str, _ModelQueue] = {}
+    _default_limit = DEFAULT_CONCURRENCY
+    _limits: dict[str, int] = dict(MODEL_CONCURRENCY)
+    _premium_weight = PREMIUM_WEIGHT
+
+    @classmethod
+    def setup(cls, default_limit: int = DEFAULT_CONCURRENCY, limits: dict[str, int] | None = None, premium_weight: int = PREMIUM_WEIGHT):
+        cls._queues = {}
+        cls._default_limit = default_limit
+        cls._limits = dict(MODEL_CONCURRENCY if limits is None else limits)
+        cls._premium_weight = premium_weight
+
+    @classmethod
+    def _queue(cls, model: str) -> _ModelQueue:
+        queue = cls._queues.get(model)
+        if queue is None:
+            queue = cls._queues[model] = _ModelQueue(cls._limits.get(model, cls._default_limit))
+        return queue
+
+    @classmethod
+    @asynccontextmanager
+    async def slot(cls, model: str, premium: bool):
+        queue = cls._queue(model)
+        tier = "premium" if premium else "free"
+        start = perf_counter()
+        if queue.active < queue.limit and not queue.premium and not queue.free:
+            queue.active += 1
+        else:
+            waiter = get_running_loop().create_future()
+            (queue.premium if premium else queue.free).append(waiter)
+            queue.stats["queued"] += 1
+            try:
+                await waiter
+            except BaseException:
+                if waiter.done() and not waiter.cancelled():
+                    cls._release(queue)  # the slot was handed over just as we were cancelled
+                else:
+                    try:
+                        (queue.premium if premium else queue.free).remove(waiter)
+                    except ValueError:
+                        pass  # already skipped by _release
+                raise
+        waited = perf_counter() - start
+        stats = queue.stats
+        stats["admitted"] += 1
+        stats["served"][tier] += 1
+        stats["wait_total_s"][tier] += waited
+        stats["wait_max_s"][tier] = max(stats["wait_max_s"][tier], waited)
+        started = perf_counter()
+        try:
+            yield waited
+        finally:
+            stats["run_total_s"] += perf_counter() - started
+            cls._release(queue)
+
+    @classmethod
+    def _release(cls, queue: _ModelQueue):
+        # hand the slot straight to the next waiter so active never drops below the backlog
+        while queue.premium or queue.free:
+            take_premium = queue.premium and (not queue.free or queue.premium_streak < cls._premium_weight)
+            if take_premium:
+                waiter = queue.premium.popleft()
+                queue.premium_streak += 1
+            else:
+                waiter = queue.free.popleft()
+                queue.premium_streak = 0
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        queue.active -= 1
+
+    @classmethod
+    def stats(cls) -> dict:
+        out = {}
+        for model, queue in cls._queues.items():
+            s = queue.stats
+            out[model] = {
+                "limit": queue.limit,
+                "active": queue.active,
+                "waiting": {"premium": len(queue.premium), "free": len(queue.free)},
+                "admitted": s["admitted"],
+                "queued": s["queued"],
+                "wait_avg_ms": {
+                    tier: s["wait_total_s"][tier] / s["served"][tier] * 1000 if s["served"][tier] else 0.0
+                    for tier in ("premium", "free")
+                },
+                "wait_max_ms": {tier: s["wait_max_s"][tier] * 1000 for tier in ("premium", "free")},
+                "run_avg_ms": s["run_total_s"] / s["admitted"] * 1000 if s["admitted"] else 0.0,
+            }
+        return out
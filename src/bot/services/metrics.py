@@ -0,0 +1,193 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Callable, Iterator
+from aiohttp import web
+
+# Prometheus-format metrics without a client library. Every metric is a dict keyed by its
+# label values, so an observation on the hot path is one dict lookup plus an increment; all
+# formatting happens when /metrics is scraped. Everything runs on the event loop thread,
+# except DB pool waits, which are a single dict update and tolerate the GIL interleaving.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple, object] = {}
+
+    def _labels(self, values: tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> list[str]:
+        return [f"{self.name}{self._labels(key)} {value:g}" for key, value in self._values.items()]
+
+    def clear(self):
+        self._values.clear()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0.0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), collect: Callable[[], dict[tuple, float]] | None = None):
+        super().__init__(name, help, labels)
+        self._collect = collect  # read at scrape time instead of being kept up to date
+
+    def inc(self, *labels, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) - amount
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0.0)
+
+    def _samples(self) -> list[str]:
+        if self._collect is not None:
+            try:
+                self._values = dict(self._collect())
+            except Exception as e:
+                print(f"Failed to collect {self.name}: {e}")
+        return super()._samples()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1  # buckets are "<= le"
+        series[1] += value
+
+    @contextmanager
+    def time(self, *labels) -> Iterator[None]:
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, *labels)
+
+    def count(self, *labels) -> int:
+        series = self._values.get(labels)
+        return sum(series[0]) if series is not None else 0
+
+    def snapshot(self) -> dict[str, dict[str, float]]:
+        # count and mean per label set, for reports that don't scrape
+        result = {}
+        for key, (counts, total) in self._values.items():
+            n = sum(counts)
+            result[",".join(map(str, key))] = {"count": n, "avg_ms": total / n * 1000 if n else 0.0}
+        return result
+
+    def _samples(self) -> list[str]:
+        lines = []
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{bound:g}"'
+                lines.append(f"{self.name}_bucket{self._labels(key, le)} {cumulative}")
+            cumulative += counts[-1]
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{self._labels(key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {total:g}")
+            lines.append(f"{self.name}_count{self._labels(key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def unregister(self, name: str):
+        self._metrics.pop(name, None)
+
+    def counter(self, name: str, help: str, labels: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: tuple[str, ...] = (), collect: Callable[[], dict[tuple, float]] | None = None) -> Gauge:
+        return self.register(Gauge(name, help, labels, collect))
+
+    def histogram(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        for metric in self._metrics.values():
+            metric.clear()
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.histogram("bot_handler_duration_seconds", "Time spent in a message handler", ("handler",))
+STAGE_SECONDS = REGISTRY.histogram("bot_stage_duration_seconds", "Time spent in one stage of handling an update", ("stage",))
+TELEGRAM_SECONDS = REGISTRY.histogram("bot_telegram_request_duration_seconds", "Bot API request latency", ("method",))
+IN_FLIGHT = REGISTRY.gauge("bot_in_flight", "Operations currently in progress", ("kind",))
+ERRORS = REGISTRY.counter("bot_errors_total", "Failures by stage and exception type", ("stage", "error"))
+LLM_TOKENS = REGISTRY.counter("bot_llm_tokens_total", "LLM tokens by model and direction", ("model", "type"))
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(body=REGISTRY.render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+
+def build_metrics_app(path: str = "/metrics") -> web.Application:
+    app = web.Application()
+    app.router.add_get(path, metrics_handler)
+    return app
+
+
+async def start_metrics_server(host: str = "0.0.0.0", port: int = 9100) -> web.AppRunner:
+    runner = web.AppRunner(build_metrics_app(), access_log=None, handle_signals=False)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Metrics on http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,192 @@
+from asyncio import Task, create_task, gather, sleep as async_sleep
+from time import time
+from typing import Hashable
+from src.backend.Consts import MODEL_TOKEN_WEIGHTS, QUOTA_PERIOD_S
+from src.backend.DB import User
+from src.bot.services.user_manager import UserManager
+
+
+class TimerWheel:
+    # Hierarchical timing wheel: level l has wheel_size slots of wheel_size**l ticks each.
+    # A tick only touches the due slot plus, on a level boundary, the higher-level slot
+    # being cascaded down, so the work is O(expired + cascaded) however many keys are armed.
+    def __init__(self, tick_s: float = 1.0, wheel_size: int = 64, levels: int = 4, now: float | None = None):
+        self.tick_s = tick_s
+        self.wheel_size = wheel_size
+        self.levels = [[set() for _ in range(wheel_size)] for _ in range(levels)]
+        self.spans = [wheel_size ** level for level in range(levels + 1)]
+        self.current = int((time() if now is None else now) // tick_s)
+        self.deadlines: dict[Hashable, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.deadlines)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.deadlines
+
+    def schedule(self, key: Hashable, at: float):
+        tick = max(int(-(-at // self.tick_s)), self.current + 1)
+        self.deadlines[key] = tick
+        self._insert(key, tick)
+
+    def cancel(self, key: Hashable):
+        # stale slot entries are skipped lazily when their slot is reached
+        self.deadlines.pop(key, None)
+
+    def _insert(self, key: Hashable, tick: int):
+        delta = tick - self.current
+        for level in range(len(self.levels)):
+            if delta < self.spans[level + 1] or level == len(self.levels) - 1:
+                slot = (tick // self.spans[level]) % self.wheel_size
+                self.levels[level][slot].add(key)
+                return
+
+    def advance(self, now: float) -> list:
+        expired = []
+        target = int(now // self.tick_s)
+        while self.current < target:
+            self.current += 1
+            for level in range(len(self.levels) - 1, 0, -1):
+                if self.current % self.spans[level]:
+                    continue
+                slot = self.levels[level][(self.current // self.spans[level]) % self.wheel_size]
+                keys = list(slot)
+                slot.clear()
+                for key in keys:
+                    tick = self.deadlines.get(key)
+                    if tick is not None:
+                        self._insert(key, tick)
+            slot = self.levels[0][self.current % self.wheel_size]
+            keys = list(slot)
+            slot.clear()
+            for key in keys:
+                tick = self.deadlines.get(key)
+                if tick is None:
+                    continue
+                if tick <= self.current:
+                    del self.deadlines[key]
+                    expired.append(key)
+                else:
+                    self._insert(key, tick)
+        return expired
+
+
+class QuotaManager:
+    _wheel: TimerWheel | None = None
+    _tick_task: Task | None = None
+    _period_s: float = QUOTA_PERIOD_S
+    _resets = 0
+    _token_weights: dict[str, float] = dict(MODEL_TOKEN_WEIGHTS)
+    _tokens_charged = 0
+    _enforce = True
+    _would_refuse = 0
+    _late_charges = 0
+    _charge_tasks: set[Task] = set()
+
+    @classmethod
+    def setup(cls, period_s: float = QUOTA_PERIOD_S, tick_s: float = 1.0, token_weights: dict[str, float] | None = None, enforce: bool = True):
+        # enforce=False keeps all the bookkeeping but lets every request through, counting the
+        # ones that would have been refused (load runs measure the chat path, not quota replies)
+        cls._period_s = period_s
+        cls._wheel = TimerWheel(tick_s=tick_s)
+        cls._resets = 0
+        cls._token_weights = dict(MODEL_TOKEN_WEIGHTS if token_weights is None else token_weights)
+        cls._tokens_charged = 0
+        cls._enforce = enforce
+        cls._would_refuse = 0
+        cls._late_charges = 0
+
+    @classmethod
+    def try_consume(cls, user: User) -> bool:
+        # Windows open on the first request and are persisted with the user (reset_at), so
+        # after a restart a stale window is reset lazily here instead of by scanning Users.
+        if cls._wheel is None:
+            cls.setup()
+        now = time()
+        changed = False
+        if user.reset_at and user.reset_at <= now:
+            cls._wheel.cancel(user.id)
+            user.reset_requests()
+            changed = True
+        if not user.reset_at:
+            user.reset_at = int(now + cls._period_s)
+            changed = True
+        if user.id not in cls._wheel:
+            cls._wheel.schedule(user.id, user.reset_at)
+            cls._ensure_ticker()
+        allowed = user.can_make_request()
+        if not allowed and not cls._enforce:
+            cls._would_refuse += 1
+            allowed = True
+        if allowed or changed:  # a refused request inside an open window changes nothing
+            UserManager.save_user(user)
+        return allowed
+
+    @classmethod
+    def charge_tokens(cls, user_id: int, model: str, tokens: int):
+        # called once the answer's usage is known; big models drain the budget faster
+        weighted = round(tokens * cls._token_weights.get(model, 1))
+        user = UserManager.peek_user(user_id)
+        if user is None:
+            # evicted while the answer was generated: load it back instead of losing the charge
+            task = create_task(cls._charge_loaded(user_id, weighted))
+            cls._charge_tasks.add(task)
+            task.add_done_callback(cls._charge_tasks.discard)
+            return
+        cls._charge(user, weighted)
+
+    @classmethod
+    async def _charge_loaded(cls, user_id: int, weighted: int):
+        try:
+            user = await UserManager.get_user(user_id)
+        except Exception as e:
+            print(f"Failed to charge {weighted} tokens to user {user_id}: {e}")
+            return
+        cls._late_charges += 1
+        cls._charge(user, weighted)
+
+    @classmethod
+    def _charge(cls, user: User, weighted: int):
+        user.charge_tokens(weighted)
+        UserManager.save_user(user)
+        cls._tokens_charged += weighted
+
+    @classmethod
+    def _ensure_ticker(cls):
+        if cls._tick_task is None or cls._tick_task.done():
+            cls._tick_task = create_task(cls._tick_loop())
+
+    @classmethod
+    async def _tick_loop(cls):
+        while True:
+            await async_sleep(cls._wheel.tick_s)
+            cls.tick(time())
+
+    @classmethod
+    def tick(cls, now: float):
+        for user_id in cls._wheel.advance(now):
+            # evicted users keep their persisted reset_at and are reset lazily on next use
+            user = UserManager.peek_user(user_id)
+            if user is None or not user.reset_at or user.reset_at > now:
+                continue
+            user.reset_requests()
+            UserManager.save_user(user)
+            cls._resets += 1
+
+    @classmethod
+    def stats(cls) -> dict:
+        return {
+            "armed": len(cls._wheel) if cls._wheel is not None else 0,
+            "resets": cls._resets,
+            "tokens_charged": cls._tokens_charged,
+            "would_refuse": cls._would_refuse,
+            "late_charges": cls._late_charges,
+        }
+
+    @classmethod
+    async def shutdown(cls):
+        if cls._tick_task is not None:
+            cls._tick_task.cancel()
+            cls._tick_task = None
+        if cls._charge_tasks:
+            await gather(*cls._charge_tasks)
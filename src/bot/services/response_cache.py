@@ -0,0 +1,94 @@
+from asyncio import Task, create_task, to_thread, sleep as async_sleep
+from collections import OrderedDict
+from hashlib import sha1
+from time import monotonic, time
+from typing import Iterable
+from src.backend.DB import DB
+
+
+class ResponseCache:
+    # In-memory LRU+TTL tier in front of an optional SQLite tier (ResponseCache table).
+    # SQLite writes are buffered and flushed in one transaction per flush interval.
+    def __init__(self, max_size: int = 10_000, ttl_s: float = 3600.0, db: DB | None = None, db_ttl_s: float = 24 * 3600.0,
+                 opt_out: Iterable[str] = (), flush_interval_s: float = 1.0):
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self.db = db
+        self.db_ttl_s = db_ttl_s
+        self.opt_out = set(opt_out)
+        self.flush_interval_s = flush_interval_s
+        self._entries: OrderedDict[str, tuple[str, float]] = OrderedDict()  # key -> (answer, stored_at)
+        self._pending: list[tuple] = []
+        self._flush_task: Task | None = None
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        if db is not None:
+            db.ensure_response_cache_schema()
+            db.prune_response_cache(int(time() - db_ttl_s))
+
+    @staticmethod
+    def normalize(message: str) -> str:
+        return " ".join(message.casefold().split())
+
+    def key(self, model_id: str, system_prompt: str, message: str) -> str | None:
+        if model_id in self.opt_out:
+            self.bypassed += 1
+            return None
+        return sha1(f"{model_id}\0{system_prompt}\0{self.normalize(message)}".encode()).hexdigest()
+
+    async def get(self, key: str) -> str | None:
+        entry = self._entries.get(key)
+        if entry is not None:
+            if monotonic() - entry[1] <= self.ttl_s:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return entry[0]
+            del self._entries[key]
+        if self.db is not None:
+            answer = await to_thread(self.db.get_cached_response, key, int(time() - self.db_ttl_s))
+            if answer is not None:
+                self._remember(key, answer)
+                self.db_hits += 1
+                return answer
+        self.misses += 1
+        return None
+
+    def put(self, key: str, model_id: str, answer: str):
+        self._remember(key, answer)
+        if self.db is None:
+            return
+        self._pending.append((key, model_id, answer, int(time())))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = create_task(self._flush_later())
+
+    def _remember(self, key: str, answer: str):
+        self._entries[key] = (answer, monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def _flush_later(self):
+        await async_sleep(self.flush_interval_s)
+        await self.flush()
+
+    async def flush(self):
+        if not self._pending or self.db is None:
+            return
+        rows, self._pending = self._pending, []
+        try:
+            await to_thread(self.db.put_cached_responses, rows)
+        except Exception as e:
+            print(f"Failed to persist {len(rows)} cached responses: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.db_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": (self.memory_hits + self.db_hits) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,115 @@
+from asyncio import CancelledError, Event, Task, create_task, shield
+from typing import Any, AsyncIterator, Awaitable, Callable, Hashable
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: Task):
+        self.task = task
+        self.waiters = 0
+
+
+class _StreamCall:
+    __slots__ = ("task", "waiters", "chunks", "done", "error", "changed")
+
+    def __init__(self):
+        self.task: Task | None = None
+        self.waiters = 0
+        self.chunks: list = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.changed = Event()
+
+
+class SingleFlight:
+    # Collapses concurrent identical calls into one upstream call. The upstream call only
+    # gets cancelled when every waiter has gone away; a waiter leaving on its own does not
+    # affect the others.
+    def __init__(self):
+        self._calls: dict[Hashable, _Call | _StreamCall] = {}
+        self.leaders = 0
+        self.followers = 0
+        self.cancelled = 0
+
+    def _forget(self, key: Hashable, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(create_task(factory()))
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            self._calls[key] = call
+            self.leaders += 1
+        else:
+            self.followers += 1
+        call.waiters += 1
+        try:
+            return await shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                self._forget(key, call)
+                call.task.cancel()
+                self.cancelled += 1
+
+    async def stream(self, key: Hashable, factory: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        call = self._calls.get(key)
+        if call is None:
+            call = _StreamCall()
+            call.task = create_task(self._pump(key, call, factory))
+            self._calls[key] = call
+            self.leaders += 1
+        else:
+            self.followers += 1
+        call.waiters += 1
+        try:
+            # late joiners replay the chunks received so far, then follow live
+            sent = 0
+            while True:
+                changed = call.changed
+                while sent < len(call.chunks):
+                    yield call.chunks[sent]
+                    sent += 1
+                if call.done:
+                    if call.error is not None:
+                        raise call.error
+                    return
+                await changed.wait()
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.done:
+                self._forget(key, call)
+                call.task.cancel()
+                self.cancelled += 1
+
+    async def _pump(self, key: Hashable, call: _StreamCall, factory: Callable[[], AsyncIterator[Any]]):
+        try:
+            async for chunk in factory():
+                call.chunks.append(chunk)
+                self._notify(call)
+        except CancelledError:
+            call.error = CancelledError()
+        except Exception as e:
+            call.error = e
+        finally:
+            call.done = True
+            self._forget(key, call)
+            self._notify(call)
+
+    @staticmethod
+    def _notify(call: _StreamCall):
+        changed, call.changed = call.changed, Event()
+        changed.set()
+
+    def stats(self) -> dict:
+        total = self.leaders + self.followers
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "cancelled": self.cancelled,
+            "coalescing_ratio": self.followers / total if total else 0.0,
+        }
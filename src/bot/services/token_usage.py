@@ -0,0 +1,114 @@
+from asyncio import Task, create_task, to_thread, sleep as async_sleep
+from time import time
+from src.backend.DB import DB
+from src.bot.services.api import MODELS
+from src.bot.services.quota_manager import QuotaManager
+
+
+class TokenUsage:
+    # Prompt/completion tokens per request, summed in memory per (user, model, hour) and
+    # written to the TokenUsage table as increments, one transaction per flush interval.
+    # Every recorded request is also charged against the user's token quota.
+    _db: DB | None = None
+    _pending: dict[tuple[int, str, int], list[int]] = {}  # (user, model, bucket) -> [requests, prompt, completion]
+    _by_model: dict[str, list[int]] = {}
+    _flush_task: Task | None = None
+    _batch_task: Task | None = None
+    _flush_interval_s = 5.0
+    _flush_batch_size = 1000
+    _bucket_s = 3600
+    _flushed = 0
+
+    @classmethod
+    def setup(cls, db: DB | None = None, flush_interval_s: float = 5.0, flush_batch_size: int = 1000, bucket_s: int = 3600):
+        cls._db = db
+        cls._pending = {}
+        cls._by_model = {}
+        cls._flush_interval_s = flush_interval_s
+        cls._flush_batch_size = flush_batch_size
+        cls._bucket_s = bucket_s
+        cls._flushed = 0
+        if db is not None:
+            db.ensure_token_usage_schema()
+
+    @classmethod
+    def record(cls, user_id: int, model: str, prompt_tokens: int, completion_tokens: int):
+        name = MODELS.get(model, model)
+        totals = cls._by_model.get(name)
+        if totals is None:
+            totals = cls._by_model[name] = [0, 0, 0]
+        totals[0] += 1
+        totals[1] += prompt_tokens
+        totals[2] += completion_tokens
+        QuotaManager.charge_tokens(user_id, model, prompt_tokens + completion_tokens)
+        if cls._db is None:
+            return
+        bucket = int(time()) // cls._bucket_s * cls._bucket_s
+        row = cls._pending.get((user_id, name, bucket))
+        if row is None:
+            row = cls._pending[(user_id, name, bucket)] = [0, 0, 0]
+        row[0] += 1
+        row[1] += prompt_tokens
+        row[2] += completion_tokens
+        if len(cls._pending) >= cls._flush_batch_size:
+            if cls._batch_task is None or cls._batch_task.done():  # one batch flush in flight; it takes everything pending
+                cls._batch_task = create_task(cls.flush())
+        elif cls._flush_task is None or cls._flush_task.done():
+            cls._flush_task = create_task(cls._flush_later())
+
+    @classmethod
+    async def usage_for(cls, user_id: int, since: int) -> dict[str, list[int]]:
+        # one user's usage by model since a unix time, flushed rows plus what is still pending:
+        # model -> [requests, prompt, completion]
+        result = {}
+        if cls._db is not None:
+            for model, requests, prompt, completion in await to_thread(cls._db.get_token_usage, user_id, since // cls._bucket_s * cls._bucket_s):
+                result[model] = [requests, prompt, completion]
+        for (uid, model, bucket), row in cls._pending.items():
+            if uid == user_id and bucket + cls._bucket_s > since:
+                totals = result.setdefault(model, [0, 0, 0])
+                for i, value in enumerate(row):
+                    totals[i] += value
+        return result
+
+    @classmethod
+    async def _flush_later(cls):
+        await async_sleep(cls._flush_interval_s)
+        await cls.flush()
+
+    @classmethod
+    async def flush(cls):
+        if not cls._pending or cls._db is None:
+            return
+        pending, cls._pending = cls._pending, {}
+        rows = [(user_id, model, bucket, *row) for (user_id, model, bucket), row in pending.items()]
+        try:
+            await to_thread(cls._db.add_token_usage, rows)
+            cls._flushed += len(rows)
+        except Exception as e:
+            print(f"Failed to flush token usage for {len(rows)} rows: {e}")
+            for key, row in pending.items():
+                merged = cls._pending.setdefault(key, [0, 0, 0])
+                for i, value in enumerate(row):
+                    merged[i] += value
+
+    @classmethod
+    async def shutdown(cls):
+        if cls._flush_task is not None and not cls._flush_task.done():
+            cls._flush_task.cancel()
+        cls._flush_task = None
+        if cls._batch_task is not None:
+            await cls._batch_task
+            cls._batch_task = None
+        await cls.flush()
+
+    @classmethod
+    def stats(cls) -> dict:
+        return {
+            "pending": len(cls._pending),
+            "flushed": cls._flushed,
+            "by_model": {
+                model: {"requests": requests, "prompt_tokens": prompt, "completion_tokens": completion}
+                for model, (requests, prompt, completion) in cls._by_model.items()
+            },
+        }
@@ -0,0 +1,222 @@
+import json
+from argparse import ArgumentParser
+from asyncio import Task, create_task, to_thread, sleep as async_sleep
+from collections import defaultdict
+from contextvars import ContextVar
+from pathlib import Path
+from random import Random
+from time import perf_counter, time
+from typing import Any, Callable
+
+# Per-update span tracing. TracingMiddleware opens a Trace for every update and puts it in a
+# context variable, so services and the DB layer (to_thread copies the context) add spans
+# without passing anything around; with no trace in the context every hook is one
+# ContextVar.get. Spans are flat (name, start offset, duration, attrs) in arrival order.
+# When a trace finishes it is kept if it was head-sampled, took longer than slow_ms or failed
+# (tail-based), and kept traces are appended to a JSONL file in batches from a worker thread.
+
+DEFAULT_TRACE_FILE = "traces.jsonl"
+MAX_SPANS = 256
+
+_current: ContextVar["Trace | None"] = ContextVar("trace", default=None)
+
+
+class Trace:
+    __slots__ = ("update_id", "started_at", "start", "end", "spans", "attrs", "error", "sampled", "kept", "dropped_spans")
+
+    def __init__(self, update_id: int, sampled: bool):
+        self.update_id = update_id
+        self.started_at = time()
+        self.start = perf_counter()
+        self.end: float | None = None
+        self.spans: list[tuple[str, float, float, dict[str, Any] | None]] = []
+        self.attrs: dict[str, Any] = {}
+        self.error: str | None = None
+        self.sampled = sampled
+        self.kept: str | None = None  # why the trace was kept: sampled, slow or error
+        self.dropped_spans = 0
+
+    @property
+    def duration_s(self) -> float:
+        return (self.end if self.end is not None else perf_counter()) - self.start
+
+    def add(self, name: str, start: float, end: float, attrs: dict[str, Any] | None = None):
+        # background tasks started during the update inherit its context and outlive it
+        if self.end is not None:
+            return
+        if len(self.spans) >= MAX_SPANS:
+            self.dropped_spans += 1
+            return
+        self.spans.append((name, start, end, attrs))
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "update_id": self.update_id,
+            "ts": round(self.started_at, 3),
+            "duration_ms": round(self.duration_s * 1000, 3),
+            "kept": self.kept,
+            **({"error": self.error} if self.error else {}),
+            **self.attrs,
+            "spans": [
+                {"name": name, "start_ms": round((start - self.start) * 1000, 3), "duration_ms": round((end - start) * 1000, 3), **(attrs or {})}
+                for name, start, end, attrs in self.spans
+            ],
+            **({"dropped_spans": self.dropped_spans} if self.dropped_spans else {}),
+        }
+
+
+def current() -> Trace | None:
+    return _current.get()
+
+
+def add_span(name: str, start: float, end: float | None = None, **attrs: Any):
+    # start/end are perf_counter() values; hooks that already time themselves just report
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, start, perf_counter() if end is None else end, attrs or None)
+
+
+def annotate(**attrs: Any):
+    trace = _current.get()
+    if trace is not None:
+        trace.attrs.update(attrs)
+
+
+async def traced_to_thread(name: str, func: Callable, *args: Any) -> Any:
+    # queue_ms is the time spent waiting for a free thread of the default executor
+    trace = _current.get()
+    if trace is None:
+        return await to_thread(func, *args)
+    submitted = perf_counter()
+    started = None
+
+    def run():
+        nonlocal started
+        started = perf_counter()
+        return func(*args)
+
+    try:
+        return await to_thread(run)
+    finally:
+        end = perf_counter()
+        trace.add(name, submitted, end, {"queue_ms": round(((started or end) - submitted) * 1000, 3)})
+
+
+class Tracer:
+    def __init__(self, path: str | Path = DEFAULT_TRACE_FILE, sample_rate: float = 0.01, slow_ms: float = 2000.0,
+                 flush_interval_s: float = 1.0, max_pending: int = 10_000, seed: int | None = None):
+        self.path = Path(path)
+        self.sample_rate = sample_rate
+        self.slow_s = slow_ms / 1000
+        self.flush_interval_s = flush_interval_s
+        self.max_pending = max_pending
+        self._rng = Random(seed)
+        self._pending: list[dict[str, Any]] = []
+        self._flush_task: Task | None = None
+        self.started = 0
+        self.kept = 0
+        self.dropped = 0
+        self.written = 0
+
+    def start(self, update_id: int) -> Trace:
+        self.started += 1
+        return Trace(update_id, sampled=self.sample_rate > 0 and self._rng.random() < self.sample_rate)
+
+    def finish(self, trace: Trace):
+        trace.end = perf_counter()
+        if trace.error is not None:  # a failure is the most useful reason, even if it was also slow or sampled
+            trace.kept = "error"
+        elif trace.sampled:
+            trace.kept = "sampled"
+        elif trace.end - trace.start >= self.slow_s:
+            trace.kept = "slow"
+        else:
+            return
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1  # the writer can't keep up; losing traces beats growing without bound
+            return
+        self.kept += 1
+        self._pending.append(trace.to_dict())
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await async_sleep(self.flush_interval_s)
+        await self.flush()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        try:
+            await to_thread(self._write, batch)
+            self.written += len(batch)
+        except Exception as e:
+            print(f"Failed to write {len(batch)} traces: {e}")
+
+    def _write(self, batch: list[dict[str, Any]]):
+        # one write per batch in append mode, so several processes can share a file line-wise
+        text = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in batch)
+        with self.path.open("a", encoding="utf-8") as f:
+            f.write(text)
+
+    async def close(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {"started": self.started, "kept": self.kept, "dropped": self.dropped, "written": self.written, "path": str(self.path)}
+
+
+def load_traces(path: Path) -> list[dict[str, Any]]:
+    traces = []
+    with path.open(encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                traces.append(json.loads(line))
+    return traces
+
+
+def summarize(traces: list[dict[str, Any]], top: int = 10) -> str:
+    lines = [f"{len(traces)} traces"]
+    if not traces:
+        return lines[0]
+    slowest = sorted(traces, key=lambda t: t["duration_ms"], reverse=True)[:top]
+
+    # where the time goes across the slowest traces: total per span name
+    totals: dict[str, float] = defaultdict(float)
+    counts: dict[str, int] = defaultdict(int)
+    for trace in slowest:
+        for span in trace["spans"]:
+            totals[span["name"]] += span["duration_ms"]
+            counts[span["name"]] += 1
+    overall = sum(t["duration_ms"] for t in slowest)
+    lines.append(f"\nTime by span over the {len(slowest)} slowest traces ({overall:.1f} ms total):")
+    for name, total in sorted(totals.items(), key=lambda kv: kv[1], reverse=True):
+        lines.append(f"  {name:<32} {total:>10.1f} ms  {total / overall * 100 if overall else 0:5.1f}%  x{counts[name]}")
+
+    lines.append(f"\nSlowest {len(slowest)}:")
+    for trace in slowest:
+        header = f"  update {trace['update_id']}  {trace['duration_ms']:.1f} ms  [{trace['kept']}]"
+        extras = " ".join(f"{k}={trace[k]}" for k in ("handler", "user_id", "error") if k in trace)
+        lines.append(f"{header}  {extras}".rstrip())
+        for span in trace["spans"]:
+            attrs = " ".join(f"{k}={v}" for k, v in span.items() if k not in ("name", "start_ms", "duration_ms"))
+            lines.append(f"    +{span['start_ms']:>9.1f} {span['duration_ms']:>9.1f} ms  {span['name']}  {attrs}".rstrip())
+    return "\n".join(lines)
+
+
+def main():
+    p = ArgumentParser(description="Summarize the slowest traces from a trace JSONL file")
+    p.add_argument("path", nargs="?", default=DEFAULT_TRACE_FILE)
+    p.add_argument("--top", type=int, default=10)
+    p.add_argument("--min-ms", type=float, default=0.0, help="Ignore traces faster than this")
+    args = p.parse_args()
+    traces = [t for t in load_traces(Path(args.path)) if t["duration_ms"] >= args.min_ms]
+    print(summarize(traces, top=args.top))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+from asyncio import Lock
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from time import monotonic
+from typing import Callable
+from src.backend.DB import User
+
+
+class UserCache:
+    # LRU order doubles as idle order: the least recently used entry is also the one
+    # idle for the longest, so both size and TTL eviction only look at the front.
+    def __init__(self, max_size: int = 100_000, ttl_s: float = 3600.0, on_evict: Callable[[User], None] | None = None, clock: Callable[[], float] = monotonic):
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self.on_evict = on_evict
+        self.clock = clock
+        self._entries: OrderedDict[int, User] = OrderedDict()  # last access lives in User.touched
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, user_id: int, count: bool = True) -> User | None:
+        user = self._entries.get(user_id)
+        if user is None:
+            self.misses += count
+            return None
+        now = self.clock()
+        if now - user.touched > self.ttl_s:
+            del self._entries[user_id]
+            self.expirations += 1
+            self.misses += count
+            self._evicted(user)
+            return None
+        user.touched = now
+        self._entries.move_to_end(user_id)
+        self.hits += count
+        return user
+
+    def put(self, user: User):
+        now = self.clock()
+        user.touched = now
+        self._entries[user.id] = user
+        self._entries.move_to_end(user.id)
+        self._shrink(now)
+
+    def _shrink(self, now: float):
+        while self._entries:
+            user = next(iter(self._entries.values()))
+            if len(self._entries) > self.max_size:
+                self.evictions += 1
+            elif now - user.touched > self.ttl_s:
+                self.expirations += 1
+            else:
+                return
+            del self._entries[user.id]
+            self._evicted(user)
+
+    def _evicted(self, user: User):
+        if self.on_evict is not None:
+            self.on_evict(user)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class KeyedLock:
+    # per-key locks that are dropped from the table as soon as nobody holds or waits on them
+    def __init__(self):
+        self._locks: dict[int, list] = {}  # key -> [Lock, holders_and_waiters]
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, key: int):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
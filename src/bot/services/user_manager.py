@@ -1,53 +1,189 @@
-from collections import defaultdict
-from asyncio import Lock, to_thread, sleep as async_sleep
+import sqlite3
+from itertools import islice
+from asyncio import Event, Lock, Task, create_task, shield, wait_for, to_thread, sleep as async_sleep
+from time import perf_counter
 from src.backend.DB import DB, User
 from src.backend.ConnectionPool import Pool
+from src.bot.services.user_cache import UserCache, KeyedLock
+from src.bot.services.metrics import ERRORS, REGISTRY, STAGE_SECONDS
+from src.bot.services.tracing import add_span, traced_to_thread
+from typing import Callable
 
 class UserManager:
-    _users: dict[int, User] = {}
+    _users = UserCache()
     _db: DB | None = None
     _is_mock = False
     _mock_delay_ms: int | None = None
-    _user_locks: dict[int, Lock] = defaultdict(Lock)
+    _mock_latency: Callable[[], float] | None = None  # seconds per mocked DB round trip
+    _mock_lock_error: Callable[[], bool] | None = None  # True -> fail like a locked SQLite file
+    _user_locks = KeyedLock()
+
+    # write-behind: dirty users are persisted in batches by a background task
+    _dirty: dict[int, User] = {}
+    _flush_task: Task | None = None
+    _flush_event: Event | None = None
+    _flush_lock = Lock()
+    _flush_interval_s = 1.0
+    _flush_batch_size = 500
 
     @classmethod
-    def setup(cls, mock: bool = False, mock_delay_ms: int = 0):
+    def setup(cls, mock: bool = False, mock_delay_ms: int = 0, flush_interval_s: float = 1.0, flush_batch_size: int = 500, db_pool_size: int = 4,
+              cache_size: int = 100_000, cache_ttl_s: float = 3600.0, mock_latency: Callable[[], float] | None = None,
+              mock_lock_error: Callable[[], bool] | None = None):
         cls._is_mock = mock
         cls._mock_delay_ms = mock_delay_ms
-        cls._users = {}
+        cls._mock_latency = mock_latency
+        cls._mock_lock_error = mock_lock_error
+        cls._users = UserCache(max_size=cache_size, ttl_s=cache_ttl_s, on_evict=cls._on_evict)
+        cls._user_locks = KeyedLock()
+        cls._dirty = {}
+        cls._flush_interval_s = flush_interval_s
+        cls._flush_batch_size = flush_batch_size
         if mock:
             cls._db = None
             return
 
-        db_pool = Pool(number_of_connections=1)
+        db_pool = Pool(number_of_connections=db_pool_size, on_wait=cls._observe_pool_wait)
         cls._db = DB(pool=db_pool)
+        cls._db.ensure_schema()
+
+    @classmethod
+    def pool_stats(cls) -> dict:
+        if cls._db is None:
+            return {}
+        return cls._db.pool.stats()
+
+    @classmethod
+    def cache_stats(cls) -> dict:
+        stats = cls._users.stats()
+        stats["locks"] = len(cls._user_locks)
+        stats["dirty"] = len(cls._dirty)
+        return stats
+
+    @classmethod
+    def _on_evict(cls, user: User):
+        # the dirty map keeps the object alive until it is persisted; just don't wait for the interval
+        if user.id in cls._dirty and cls._flush_event is not None:
+            cls._flush_event.set()
+
+    @staticmethod
+    def _observe_pool_wait(waited_s: float):
+        STAGE_SECONDS.observe(waited_s, "db_pool_wait")
+        now = perf_counter()
+        add_span("db_pool_wait", now - waited_s, now)
 
     @classmethod
     async def get_user(cls, user_id: int) -> User:
+        start = perf_counter()
+        try:
+            return await cls._get_user(user_id)
+        except Exception as e:
+            ERRORS.inc("get_user", type(e).__name__)
+            raise
+        finally:
+            end = perf_counter()
+            STAGE_SECONDS.observe(end - start, "get_user")
+            add_span("get_user", start, end)
+
+    @classmethod
+    async def _get_user(cls, user_id: int) -> User:
         if cls._is_mock:
-            if cls._mock_delay_ms:
+            start = perf_counter()
+            if cls._mock_latency is not None:
+                await async_sleep(cls._mock_latency())
+            elif cls._mock_delay_ms:
                 await async_sleep(cls._mock_delay_ms / 1000)
+            add_span("db_mock", start)
+            if cls._mock_lock_error is not None and cls._mock_lock_error():
+                raise sqlite3.OperationalError("database is locked")
             cached = cls._users.get(user_id)
             if cached is not None:
                 return cached
             user = User("mock", user_id, last_model="LLaMA-8b")
-            cls._users[user_id] = user
+            cls._users.put(user)
             return user
         if cls._db is None:
             raise RuntimeError("Run setup method first, class is uninitialized")
         cached = cls._users.get(user_id)
         if cached is not None:
             return cached
-        lock = cls._user_locks[user_id]
-        async with lock:
-            cached = cls._users.get(user_id)
+        lock_start = perf_counter()
+        async with cls._user_locks.hold(user_id):
+            add_span("user_lock_wait", lock_start)
+            cached = cls._users.get(user_id, count=False)
             if cached is not None:
                 return cached
-            user = await to_thread(cls._db.get_user, user_id)
-            if user is None:
-                await to_thread(cls._db.create_user, user_id)
-                user = await to_thread(cls._db.get_user, user_id)
+            user = cls._dirty.get(user_id)
+            if user is not None:
+                cls._users.put(user)
+                return user
+            with STAGE_SECONDS.time("db_load_user"):
+                user = await traced_to_thread("db.get_user", cls._db.get_user, user_id)
+                if user is None:
+                    await traced_to_thread("db.create_user", cls._db.create_user, user_id)
+                    user = await traced_to_thread("db.get_user", cls._db.get_user, user_id)
             if user is None:
                 raise RuntimeError(f"Failed to create/load user_id={user_id}")
-            cls._users[user_id] = user
-            return user
\ No newline at end of file
+            cls._users.put(user)
+            return user
+
+    @classmethod
+    def peek_user(cls, user_id: int) -> User | None:
+        # in-memory only: never touches the DB and does not count as a cache lookup
+        user = cls._users.get(user_id, count=False)
+        if user is None:
+            user = cls._dirty.get(user_id)
+        return user
+
+    @classmethod
+    def save_user(cls, user: User):
+        if cls._is_mock:
+            return
+        cls._dirty[user.id] = user
+        if cls._flush_task is None or cls._flush_task.done():
+            cls._flush_event = Event()
+            cls._flush_task = create_task(cls._flush_loop())
+        if len(cls._dirty) >= cls._flush_batch_size:
+            cls._flush_event.set()
+
+    @classmethod
+    async def _flush_loop(cls):
+        while True:
+            try:
+                await wait_for(cls._flush_event.wait(), cls._flush_interval_s)
+            except TimeoutError:
+                pass
+            cls._flush_event.clear()
+            await shield(cls.flush())
+
+    @classmethod
+    async def flush(cls):
+        async with cls._flush_lock:
+            while cls._dirty:
+                batch = {}
+                for user_id in list(islice(cls._dirty, cls._flush_batch_size)):
+                    batch[user_id] = cls._dirty.pop(user_id)
+                rows = [user.as_row() for user in batch.values()]
+                try:
+                    with STAGE_SECONDS.time("db_flush"):
+                        await to_thread(cls._db.save_users, rows)
+                except Exception as e:
+                    ERRORS.inc("db_flush", type(e).__name__)
+                    print(f"Failed to flush {len(rows)} users: {e}")
+                    for user_id, user in batch.items():
+                        cls._dirty.setdefault(user_id, user)
+                    return
+
+    @classmethod
+    async def shutdown(cls):
+        if cls._flush_task is not None:
+            cls._flush_task.cancel()
+            cls._flush_task = None
+        if cls._db is not None:
+            await cls.flush()
+
+
+REGISTRY.gauge("bot_db_pool_in_use", "Connections checked out of the UserManager pool",
+               collect=lambda: {(): UserManager.pool_stats().get("in_use", 0)})
+REGISTRY.gauge("bot_user_cache_size", "Users held in memory", collect=lambda: {(): UserManager.cache_stats().get("size", 0)})
+REGISTRY.gauge("bot_users_dirty", "Users waiting for the write-behind flush", collect=lambda: {(): len(UserManager._dirty)})
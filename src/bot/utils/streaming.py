@@ -0,0 +1,69 @@
+from asyncio import sleep as async_sleep
+from time import monotonic
+from typing import AsyncIterator
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+EDIT_INTERVAL_S = 1.0
+PLACEHOLDER = "⏳"
+EMPTY_ANSWER = "⚠️ Модель вернула пустой ответ"
+STREAM_ERROR = "⚠️ Не удалось получить ответ модели. Попробуйте ещё раз."
+TELEGRAM_TEXT_LIMIT = 4096
+
+
+class StreamingAnswer:
+    # Telegram allows roughly one edit per second per chat, so chunks that arrive
+    # in between are coalesced into the next edit instead of being sent one by one.
+    # The final edit skips the throttle and only honours an explicit retry_after.
+    def __init__(self, message: Message, edit_interval_s: float = EDIT_INTERVAL_S):
+        self.message = message
+        self.edit_interval_s = edit_interval_s
+        self.shown = PLACEHOLDER
+        self.next_edit_at = 0.0
+        self.retry_at = 0.0
+
+    async def _edit(self, text: str) -> bool:
+        try:
+            await self.message.edit_text(text[:TELEGRAM_TEXT_LIMIT])
+        except TelegramRetryAfter as e:
+            self.retry_at = monotonic() + e.retry_after
+            self.next_edit_at = max(self.next_edit_at, self.retry_at)
+            return False
+        except TelegramBadRequest as e:
+            if "message is not modified" not in e.message:
+                raise
+        self.shown = text
+        self.next_edit_at = monotonic() + self.edit_interval_s
+        return True
+
+    async def update(self, text: str):
+        if not text.strip() or text == self.shown or monotonic() < self.next_edit_at:
+            return
+        await self._edit(text)
+
+    async def finish(self, text: str):
+        text = text.strip() or EMPTY_ANSWER
+        while text != self.shown:
+            delay = self.retry_at - monotonic()
+            if delay > 0:
+                await async_sleep(delay)
+            await self._edit(text)
+
+
+async def answer_streaming(message: Message, chunks: AsyncIterator[str], reply_markup=None) -> str:
+    placeholder = await message.answer(PLACEHOLDER, reply_markup=reply_markup)
+    answer = StreamingAnswer(placeholder)
+    text = ""
+    try:
+        async for chunk in chunks:
+            text += chunk
+            await answer.update(text)
+    except Exception:
+        # never leave the placeholder hanging: keep what arrived and say the rest failed
+        try:
+            await answer.finish(f"{text.strip()}\n\n{STREAM_ERROR}" if text.strip() else STREAM_ERROR)
+        except Exception as e:
+            print(f"Failed to replace the streaming placeholder: {e}")
+        raise
+    await answer.finish(text)
+    return text
@@ -0,0 +1,116 @@
+from asyncio import Event, Semaphore, create_task, get_running_loop, wait
+from signal import SIGINT, SIGTERM
+from typing import Any
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from src.bot.services.metrics import metrics_handler
+
+DEFAULT_MAX_UPDATES = 256
+DEFAULT_DRAIN_S = 30.0
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    # Answers Telegram as soon as an update is accepted, but holds the HTTP response while
+    # max_updates are already being processed, so Telegram's own per-bot connection limit
+    # turns into backpressure instead of an unbounded pile of background tasks.
+    # While draining, new updates get 503 and Telegram redelivers them (to another instance).
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, max_updates: int = DEFAULT_MAX_UPDATES,
+                 drain_timeout_s: float = DEFAULT_DRAIN_S, **kwargs: Any):
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, **kwargs)
+        self.max_updates = max_updates
+        self.drain_timeout_s = drain_timeout_s
+        self.draining = False
+        self._slots = Semaphore(max_updates)
+        self.accepted = 0
+        self.rejected = 0
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        if self.draining:
+            self.rejected += 1
+            return web.Response(status=503, text="draining")
+        update = await request.json(loads=bot.session.json_loads)
+        await self._slots.acquire()
+        task = create_task(self._background_feed_update(bot=bot, update=update))
+        self._background_feed_update_tasks.add(task)
+        task.add_done_callback(self._done)
+        self.accepted += 1
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    def _done(self, task):
+        self._background_feed_update_tasks.discard(task)
+        self._slots.release()
+
+    async def drain(self):
+        self.draining = True
+        pending = set(self._background_feed_update_tasks)
+        if not pending:
+            return
+        print(f"Draining {len(pending)} in-flight updates...")
+        _, still_running = await wait(pending, timeout=self.drain_timeout_s)
+        for task in still_running:
+            task.cancel()
+        if still_running:
+            print(f"Cancelled {len(still_running)} updates after {self.drain_timeout_s}s drain timeout")
+
+    async def close(self):
+        await self.drain()
+        await super().close()
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats(), status=503 if self.draining else 200)
+
+    def stats(self) -> dict:
+        return {
+            "status": "draining" if self.draining else "ok",
+            "in_flight": len(self._background_feed_update_tasks),
+            "max_updates": self.max_updates,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+        }
+
+
+WEBHOOK_HANDLER = web.AppKey("webhook_handler", BoundedRequestHandler)
+
+
+def build_app(dp: Dispatcher, bot: Bot, path: str = "/webhook", secret_token: str | None = None,
+              max_updates: int = DEFAULT_MAX_UPDATES, drain_timeout_s: float = DEFAULT_DRAIN_S) -> web.Application:
+    app = web.Application()
+    handler = BoundedRequestHandler(dp, bot, max_updates=max_updates, drain_timeout_s=drain_timeout_s, secret_token=secret_token)
+    # registered before setup_application: on shutdown the in-flight updates drain first,
+    # then dp.shutdown flushes the services they were writing to
+    handler.register(app, path=path)
+    app.router.add_get("/healthz", handler.health)
+    app.router.add_get("/metrics", metrics_handler)
+    app[WEBHOOK_HANDLER] = handler
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, base_url: str, host: str = "0.0.0.0", port: int = 8080,
+                      path: str = "/webhook", secret_token: str | None = None,
+                      max_updates: int = DEFAULT_MAX_UPDATES, drain_timeout_s: float = DEFAULT_DRAIN_S):
+    app = build_app(dp, bot, path=path, secret_token=secret_token, max_updates=max_updates, drain_timeout_s=drain_timeout_s)
+    runner = web.AppRunner(app, handle_signals=False)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    await bot.set_webhook(
+        f"{base_url.rstrip('/')}{path}",
+        secret_token=secret_token,
+        max_connections=min(100, max_updates),
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    print(f"Webhook server listening on {host}:{port}{path}")
+
+    stop = Event()
+    loop = get_running_loop()
+    for sig in (SIGINT, SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass  # Windows: KeyboardInterrupt still stops the loop
+    try:
+        await stop.wait()
+    finally:
+        # the webhook stays registered so other instances keep receiving updates
+        await runner.cleanup()
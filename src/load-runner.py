@@ -4,14 +4,17 @@ import argparse
 import asyncio
 import csv
 import json
+import math
+import multiprocessing
 import os
+import queue
 import random
-import statistics
+import sys
 import time
 from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 from dotenv import load_dotenv
 
@@ -26,7 +29,21 @@ from src.bot.handlers.chat import handler_chat
 
 from src.bot.services.user_manager import UserManager
 from src.bot.services.api_manager import ApiManager
+from src.bot.services.quota_manager import QuotaManager
+from src.bot.services.token_usage import TokenUsage
+from src.bot.services.llm_scheduler import LLMScheduler
+from src.bot.services.fsm_storage import SQLiteStorage
+from src.backend.ConnectionPool import Pool
+from src.backend.DB import DB
+from src.bot.middlewares.flood_control import FloodControlMiddleware
+from src.bot.middlewares.admission_control import AdmissionControlMiddleware, AdaptiveLimiter
+from src.bot.middlewares.metrics import MetricsMiddleware, TelegramMetricsMiddleware
+from src.bot.middlewares.tracing import TracingMiddleware
+from src.bot.services.tracing import Tracer
+from src.bot.services.metrics import HANDLER_SECONDS, REGISTRY, STAGE_SECONDS, TELEGRAM_SECONDS, start_metrics_server
 from src.mocks.mock_telegram_session import MockTelegramSession
+from src.mocks.mock_nim_server import NimServerConfig, start_server as start_nim_server
+from src.mocks.latency import FaultInjector, LatencyModel
 
 
 # ----------------------------- helpers: updates -----------------------------
@@ -86,61 +103,238 @@ class Record:
     latency_ms: float
     ok: bool
     error: str | None
+    ttft_ms: float | None = None
+    send_lag_ms: float | None = None
 
 
-def _pct(sorted_values: List[float], p: float) -> Optional[float]:
-    if not sorted_values:
-        return None
-    if p <= 0:
-        return sorted_values[0]
-    if p >= 100:
-        return sorted_values[-1]
-    k = int(round((p / 100) * (len(sorted_values) - 1)))
-    return sorted_values[k]
-
-
-def summarize(latencies_ms: List[float], total_seconds: float, errors: int) -> Dict[str, Any]:
-    lat = sorted(latencies_ms)
-    ok = len(latencies_ms) - errors
-    rps = ok / total_seconds if total_seconds > 0 else 0
-    return {
-        "total": len(latencies_ms),
-        "ok": ok,
-        "errors": errors,
-        "seconds": total_seconds,
-        "rps": rps,
-        "avg_ms": statistics.mean(lat) if lat else None,
-        "p50_ms": _pct(lat, 50),
-        "p95_ms": _pct(lat, 95),
-        "p99_ms": _pct(lat, 99),
-        "max_ms": max(lat) if lat else None,
-    }
+class LogHistogram:
+    # HDR-style histogram: bucket i holds values in [base^i, base^(i+1)) ms with
+    # base = 1 + precision, so any percentile comes back within `precision` relative error
+    # while memory stays O(log(max/min)) however many values are recorded.
+    __slots__ = ("precision", "_log_base", "buckets", "count", "total", "min", "max")
 
+    MIN_VALUE_MS = 0.001
 
-def build_timeseries(records: List[Record]) -> List[Dict[str, Any]]:
-    buckets: Dict[int, List[Record]] = {}
-    for r in records:
-        sec = int(r.t_s)
-        buckets.setdefault(sec, []).append(r)
-
-    out: List[Dict[str, Any]] = []
-    for sec in sorted(buckets.keys()):
-        rs = buckets[sec]
-        lat = sorted([x.latency_ms for x in rs if x.ok])
-        errors = sum(0 if x.ok else 1 for x in rs)
-        out.append(
-            {
-                "t_s": sec,
-                "count": len(rs),
-                "errors": errors,
-                "avg_ms": statistics.mean(lat) if lat else None,
-                "p50_ms": _pct(lat, 50),
-                "p95_ms": _pct(lat, 95),
-                "p99_ms": _pct(lat, 99),
-                "max_ms": max(lat) if lat else None,
-            }
-        )
-    return out
+    def __init__(self, precision: float = 0.01):
+        self.precision = precision
+        self._log_base = math.log1p(precision)
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def record(self, value_ms: float) -> None:
+        self.count += 1
+        self.total += value_ms
+        if value_ms < self.min:
+            self.min = value_ms
+        if value_ms > self.max:
+            self.max = value_ms
+        i = math.floor(math.log(max(value_ms, self.MIN_VALUE_MS)) / self._log_base)
+        self.buckets[i] = self.buckets.get(i, 0) + 1
+
+    def merge(self, other: "LogHistogram") -> None:
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        for i, n in other.buckets.items():
+            self.buckets[i] = self.buckets.get(i, 0) + n
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(p / 100 * self.count))
+        seen = 0
+        for i in sorted(self.buckets):
+            seen += self.buckets[i]
+            if seen >= rank:
+                # geometric middle of the bucket, clamped to what was actually observed
+                return min(self.max, max(self.min, math.exp((i + 0.5) * self._log_base)))
+        return self.max
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "total": self.count,
+            "avg_ms": self.total / self.count if self.count else None,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            "max_ms": self.max if self.count else None,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "precision": self.precision,
+            "count": self.count,
+            "total": self.total,
+            "min": self.min if self.count else None,
+            "max": self.max,
+            "buckets": {str(i): n for i, n in self.buckets.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "LogHistogram":
+        h = cls(data["precision"])
+        h.count = data["count"]
+        h.total = data["total"]
+        h.min = data["min"] if data["min"] is not None else math.inf
+        h.max = data["max"]
+        h.buckets = {int(i): n for i, n in data["buckets"].items()}
+        return h
+
+
+class StepStats:
+    __slots__ = ("latency", "errors")
+
+    def __init__(self):
+        self.latency = LogHistogram()
+        self.errors = 0
+
+
+class RunMetrics:
+    # Everything the summary and timeseries need, updated online per record: overall,
+    # per-step and per-second latency histograms plus TTFT and open-loop send lag.
+    def __init__(self):
+        self.latency = LogHistogram()
+        self.ttft = LogHistogram()
+        self.send_lag = LogHistogram()
+        self.errors = 0
+        self.steps: Dict[str, StepStats] = {}
+        self.seconds: Dict[int, StepStats] = {}  # per-second: ok latencies + error count
+
+    def add(self, rec: Record) -> None:
+        self.latency.record(rec.latency_ms)
+        step = self.steps.get(rec.step)
+        if step is None:
+            step = self.steps[rec.step] = StepStats()
+        step.latency.record(rec.latency_ms)
+        sec = self.seconds.get(int(rec.t_s))
+        if sec is None:
+            sec = self.seconds[int(rec.t_s)] = StepStats()
+        if rec.ok:
+            sec.latency.record(rec.latency_ms)
+        else:
+            self.errors += 1
+            step.errors += 1
+            sec.errors += 1
+        if rec.ttft_ms is not None:
+            self.ttft.record(rec.ttft_ms)
+        if rec.send_lag_ms is not None:
+            self.send_lag.record(rec.send_lag_ms)
+
+    def summary(self, total_seconds: float) -> Dict[str, Any]:
+        ok = self.latency.count - self.errors
+        latency = self.latency.summary()
+        return {
+            "total": latency.pop("total"),
+            "ok": ok,
+            "errors": self.errors,
+            "seconds": total_seconds,
+            "rps": ok / total_seconds if total_seconds > 0 else 0,
+            **latency,
+            "ttft": self.ttft.summary(),
+            "steps": {
+                name: {**s.latency.summary(), "errors": s.errors}
+                for name, s in self.steps.items()
+            },
+        }
+
+    def merge(self, other: "RunMetrics") -> None:
+        self.latency.merge(other.latency)
+        self.ttft.merge(other.ttft)
+        self.send_lag.merge(other.send_lag)
+        self.errors += other.errors
+        for target, source in ((self.steps, other.steps), (self.seconds, other.seconds)):
+            for key, stats in source.items():
+                mine = target.get(key)
+                if mine is None:
+                    mine = target[key] = StepStats()
+                mine.latency.merge(stats.latency)
+                mine.errors += stats.errors
+
+    def to_dict(self) -> Dict[str, Any]:
+        def _stats(stats: StepStats) -> Dict[str, Any]:
+            return {"latency": stats.latency.to_dict(), "errors": stats.errors}
+
+        return {
+            "latency": self.latency.to_dict(),
+            "ttft": self.ttft.to_dict(),
+            "send_lag": self.send_lag.to_dict(),
+            "errors": self.errors,
+            "steps": {name: _stats(s) for name, s in self.steps.items()},
+            "seconds": {str(sec): _stats(s) for sec, s in self.seconds.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RunMetrics":
+        def _stats(item: Dict[str, Any]) -> StepStats:
+            stats = StepStats()
+            stats.latency = LogHistogram.from_dict(item["latency"])
+            stats.errors = item["errors"]
+            return stats
+
+        m = cls()
+        m.latency = LogHistogram.from_dict(data["latency"])
+        m.ttft = LogHistogram.from_dict(data["ttft"])
+        m.send_lag = LogHistogram.from_dict(data["send_lag"])
+        m.errors = data["errors"]
+        m.steps = {name: _stats(item) for name, item in data["steps"].items()}
+        m.seconds = {int(sec): _stats(item) for sec, item in data["seconds"].items()}
+        return m
+
+    def timeseries(self) -> List[Dict[str, Any]]:
+        out: List[Dict[str, Any]] = []
+        for sec in sorted(self.seconds):
+            s = self.seconds[sec]
+            latency = s.latency.summary()
+            out.append({"t_s": sec, "count": latency.pop("total") + s.errors, "errors": s.errors, **latency})
+        return out
+
+
+class RawCsvWriter:
+    # Rows are buffered as plain tuples on the hot path; formatting and file I/O happen in a
+    # worker thread once per batch, one batch at a time so rows keep their order.
+    def __init__(self, path: Path, batch_size: int = 5_000):
+        self.path = path
+        self.batch_size = batch_size
+        self._f = path.open("w", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._f)
+        self._writer.writerow(RAW_CSV_FIELDS)
+        self._buffer: List[Record] = []
+        self._pending: asyncio.Task | None = None
+
+    def add(self, rec: Record) -> None:
+        self._buffer.append(rec)
+        if len(self._buffer) >= self.batch_size:
+            self._flush_soon()
+
+    def _flush_soon(self) -> None:
+        rows, self._buffer = self._buffer, []
+        self._pending = asyncio.create_task(self._write(self._pending, rows))
+
+    async def _write(self, previous: asyncio.Task | None, rows: List[Record]) -> None:
+        if previous is not None:
+            await previous
+        await asyncio.to_thread(self._writer.writerows, map(format_record, rows))
+
+    async def close(self) -> None:
+        if self._buffer:
+            self._flush_soon()
+        if self._pending is not None:
+            await self._pending
+        self._f.close()
+
+
+class RecordSink:
+    def __init__(self, metrics: RunMetrics, raw_csv: RawCsvWriter):
+        self.metrics = metrics
+        self.raw_csv = raw_csv
+
+    def add(self, rec: Record) -> None:
+        self.metrics.add(rec)
+        self.raw_csv.add(rec)
 
 
 # ----------------------------- load scenario -----------------------------
@@ -153,17 +347,57 @@ async def feed_and_measure(
     t0: float,
     user_id: int,
     step: str,
+    intended_at: float | None = None,
 ) -> Record:
-    start = time.perf_counter()
+    # open loop: latency counts from when the update was due, not from when we got to send it
+    session: MockTelegramSession = bot.session
+    sent_at = time.perf_counter()
+    start = intended_at if intended_at is not None else sent_at
     err: str | None = None
     ok = True
-    try:
-        await dp.feed_update(bot, upd)
-    except Exception as e:
-        ok = False
-        err = f"{type(e).__name__}: {e}"
+    with session.measure() as timings:
+        try:
+            await dp.feed_update(bot, upd)
+        except Exception as e:
+            ok = False
+            err = f"{type(e).__name__}: {e}"
     latency_ms = (time.perf_counter() - start) * 1000
-    return Record(t_s=time.perf_counter() - t0, user_id=user_id, step=step, latency_ms=latency_ms, ok=ok, error=err)
+    first_edit_at = timings.get("first_edit_at")
+    ttft_ms = (first_edit_at - start) * 1000 if first_edit_at is not None else None
+    return Record(
+        t_s=(start if intended_at is not None else time.perf_counter()) - t0,
+        user_id=user_id,
+        step=step,
+        latency_ms=latency_ms,
+        ok=ok,
+        error=err,
+        ttft_ms=ttft_ms,
+        send_lag_ms=(sent_at - intended_at) * 1000 if intended_at is not None else None,
+    )
+
+
+RAW_CSV_FIELDS = ["t_s", "user_id", "step", "latency_ms", "ok", "error", "ttft_ms", "send_lag_ms"]
+
+SAMPLE_TEXTS = [
+    "Привет!",
+    "Объясни простыми словами, что такое нагрузочное тестирование?",
+    "Сгенерируй короткий план урока.",
+    "Напиши 3 идеи для домашнего задания.",
+    "Сделай краткое резюме текста (тест).",
+]
+
+
+def format_record(rec: Record) -> tuple:
+    return (
+        f"{rec.t_s:.6f}",
+        rec.user_id,
+        rec.step,
+        f"{rec.latency_ms:.3f}",
+        int(rec.ok),
+        rec.error or "",
+        f"{rec.ttft_ms:.3f}" if rec.ttft_ms is not None else "",
+        f"{rec.send_lag_ms:.3f}" if rec.send_lag_ms is not None else "",
+    )
 
 
 async def virtual_user(
@@ -176,9 +410,7 @@ async def virtual_user(
     turns: int,
     think_time_ms: int,
     start_delay_s: float,
-    record_sink: List[Record],
-    csv_writer: csv.DictWriter,
-    csv_lock: asyncio.Lock,
+    sink: RecordSink,
     update_id_base: int,
 ):
     if start_delay_s:
@@ -188,18 +420,7 @@ async def virtual_user(
 
     async def _do(step: str, upd: Update):
         rec = await feed_and_measure(dp=dp, bot=bot, upd=upd, t0=t0, user_id=user_id, step=step)
-        record_sink.append(rec)
-        async with csv_lock:
-            csv_writer.writerow(
-                {
-                    "t_s": f"{rec.t_s:.6f}",
-                    "user_id": rec.user_id,
-                    "step": rec.step,
-                    "latency_ms": f"{rec.latency_ms:.3f}",
-                    "ok": int(rec.ok),
-                    "error": rec.error or "",
-                }
-            )
+        sink.add(rec)
 
     # 1 /start
     await _do("start", make_start_update(upd_id, user_id=user_id, chat_id=chat_id))
@@ -210,16 +431,8 @@ async def virtual_user(
     upd_id += 1
 
     # 3 несколько сообщений в активном чате
-    sample_texts = [
-        "Привет!",
-        "Объясни простыми словами, что такое нагрузочное тестирование?",
-        "Сгенерируй короткий план урока.",
-        "Напиши 3 идеи для домашнего задания.",
-        "Сделай краткое резюме текста (тест).",
-    ]
-
     for _ in range(turns):
-        text = random.choice(sample_texts)
+        text = random.choice(SAMPLE_TEXTS)
         await _do("chat_msg", make_text_update(upd_id, user_id=user_id, chat_id=chat_id, text=text))
         upd_id += 1
         if think_time_ms:
@@ -229,7 +442,108 @@ async def virtual_user(
     await _do("exit_chat", make_text_update(upd_id, user_id=user_id, chat_id=chat_id, text="❌Завершить чат"))
 
 
-async def run_load(
+# ----------------------------- open loop -----------------------------
+
+def parse_steps(spec: str) -> List[Tuple[float, float]]:
+    # "100:10,200:10" -> [(100 rps, 10 s), (200 rps, 10 s)]
+    steps = []
+    for part in spec.split(","):
+        rate, duration = part.split(":")
+        steps.append((float(rate), float(duration)))
+    return steps
+
+
+def build_phases(*, rate: float, duration_s: float, rate_end: float | None, steps: str | None) -> List[Tuple[float, float, float]]:
+    # (rate at start, rate at end, duration) per phase; constant and step phases have equal ends
+    if steps:
+        return [(r, r, d) for r, d in parse_steps(steps)]
+    return [(rate, rate if rate_end is None else rate_end, duration_s)]
+
+
+def arrival_times(phases: List[Tuple[float, float, float]], arrival: str, rng: random.Random) -> Iterator[float]:
+    # Intended send offsets (seconds from t0). The k-th arrival of a phase is due when the
+    # integral of its (linear) rate reaches k; for poisson, k grows by Exp(1) steps instead of 1.
+    phase_start = 0.0
+    for r0, r1, duration in phases:
+        slope = (r1 - r0) / duration
+        expected = (r0 + r1) / 2 * duration
+        n = rng.expovariate(1.0) if arrival == "poisson" else 0.0
+        while n < expected:
+            if abs(slope) < 1e-12:
+                t = n / r0
+            else:
+                t = (-r0 + math.sqrt(max(0.0, r0 * r0 + 2 * slope * n))) / slope
+            yield phase_start + t
+            n += rng.expovariate(1.0) if arrival == "poisson" else 1.0
+        phase_start += duration
+
+
+async def warm_up_user(*, dp: Dispatcher, bot: Bot, user_id: int, chat_id: int, update_id: int) -> None:
+    # /start + "💬Новый чат" so the user is inside a chat when arrivals begin; not measured
+    await dp.feed_update(bot, make_start_update(update_id, user_id=user_id, chat_id=chat_id))
+    await dp.feed_update(bot, make_text_update(update_id + 1, user_id=user_id, chat_id=chat_id, text="💬Новый чат"))
+
+
+async def open_loop(
+    *,
+    dp: Dispatcher,
+    bot: Bot,
+    users: int,
+    phases: List[Tuple[float, float, float]],
+    arrival: str,
+    seed: int,
+    sink: RecordSink,
+    first_user: int = 0,
+) -> Dict[str, Any]:
+    # Chat messages are sent on a fixed schedule regardless of how fast the bot answers, so a
+    # slowdown shows up as queueing in the latencies instead of as a lower offered load.
+    # Arrivals go round robin over `users` warmed-up users.
+    await asyncio.gather(*(
+        warm_up_user(dp=dp, bot=bot, user_id=10_000 + first_user + u, chat_id=20_000 + first_user + u, update_id=1 + 2 * u)
+        for u in range(users)
+    ))
+    rng = random.Random(seed)
+    update_id = 1 + 2 * users
+    tasks = set()
+
+    async def _do(intended_at: float, user: int, upd: Update):
+        rec = await feed_and_measure(dp=dp, bot=bot, upd=upd, t0=t0, user_id=10_000 + first_user + user, step="chat_msg", intended_at=intended_at)
+        sink.add(rec)
+
+    t0 = time.perf_counter()
+    scheduled = 0
+    for offset in arrival_times(phases, arrival, rng):
+        intended_at = t0 + offset
+        delay = intended_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        user = scheduled % users
+        upd = make_text_update(update_id, user_id=10_000 + first_user + user, chat_id=20_000 + first_user + user, text=rng.choice(SAMPLE_TEXTS))
+        task = asyncio.create_task(_do(intended_at, user, upd))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        scheduled += 1
+        update_id += 1
+    send_span = time.perf_counter() - t0
+    if tasks:
+        await asyncio.gather(*tasks)
+    seconds = time.perf_counter() - t0
+
+    duration = sum(d for _, _, d in phases)
+    ok = sink.metrics.latency.count - sink.metrics.errors
+    return {
+        "seconds": seconds,
+        "arrival": arrival,
+        "phases": [{"rate_start": r0, "rate_end": r1, "duration_s": d} for r0, r1, d in phases],
+        "scheduled": scheduled,
+        "target_rps": scheduled / duration if duration > 0 else 0.0,
+        "offered_rps": scheduled / send_span if send_span > 0 else 0.0,
+        "achieved_rps": ok / seconds if seconds > 0 else 0.0,
+        "send_lag": sink.metrics.send_lag.summary(),
+    }
+
+
+async def generate_load(
     *,
     users: int,
     turns: int,
@@ -238,76 +552,371 @@ async def run_load(
     tg_delay_ms: int,
     db_delay_ms: int,
     llm_delay_ms: int,
-    out_dir: Path,
+    raw_csv_path: Path,
+    flood_control: bool = False,
+    response_cache: bool = False,
+    quota: bool = False,
+    llm_concurrency: int = 0,
+    admission_limit: int = 0,
+    admission_target_ms: int = 5000,
+    fsm_sqlite: bool = False,
+    mode: str = "closed",
+    arrival: str = "constant",
+    rate: float = 100.0,
+    rate_end: float | None = None,
+    duration_s: float = 30.0,
+    steps: str | None = None,
+    seed: int = 0,
+    nim_base_url: str | None = None,
+    nim_mock_server: bool = False,
+    nim_keys: int = 4,
+    nim_rpm: float = 40.0,
+    tg_latency: str | None = None,
+    db_latency: str | None = None,
+    llm_latency: str | None = None,
+    llm_token_ms: float = 0.0,
+    tg_429_rate: float = 0.0,
+    tg_retry_after_s: int = 1,
+    db_lock_rate: float = 0.0,
+    metrics_port: int = 0,
+    trace_sample: float = 0.0,
+    trace_slow_ms: float = 0.0,
+    first_user: int = 0,
+    start_barrier=None,
 ) -> Dict[str, Any]:
-    out_dir.mkdir(parents=True, exist_ok=True)
-    run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
-
-    raw_csv_path = out_dir / f"raw_{run_id}.csv"
-    timeseries_csv_path = out_dir / f"timeseries_{run_id}.csv"
-    summary_json_path = out_dir / f"summary_{run_id}.json"
-
+    # One load generator: its own bot, dispatcher and mocked services driving users
+    # first_user..first_user+users-1 in this event loop.
     bot_key = os.getenv("TGBOT_KEY", "TEST:TOKEN")
-    bot = Bot(token=bot_key, session=MockTelegramSession(delay_ms=tg_delay_ms))
+    # every mock draws from its own seeded stream so runs with the same --seed repeat exactly
+    tg_retry_after = FaultInjector(tg_429_rate, seed=seed * 16 + 1)
+    db_lock_error = FaultInjector(db_lock_rate, seed=seed * 16 + 2)
+    session = MockTelegramSession(
+        delay_ms=tg_delay_ms,
+        latency=LatencyModel.parse(tg_latency, seed * 16 + 3) if tg_latency else None,
+        retry_after=tg_retry_after,
+        retry_after_s=tg_retry_after_s,
+    )
+    bot = Bot(token=bot_key, session=session)
+    bot.session.middleware(TelegramMetricsMiddleware())
+    REGISTRY.clear()
+    metrics_runner = await start_metrics_server("127.0.0.1", metrics_port) if metrics_port else None
 
-    dp = Dispatcher()
+    # the FSM table goes to its own file so runs don't leave state behind in db.db
+    storage = SQLiteStorage(DB(pool=Pool(number_of_connections=1, db_path=str(raw_csv_path.with_name(raw_csv_path.stem.replace("raw_", "fsm_") + ".db"))))) if fsm_sqlite else None
+    dp = Dispatcher(storage=storage)
+    tracer: Tracer | None = None
+    if trace_sample > 0 or trace_slow_ms > 0:
+        tracer = Tracer(raw_csv_path.with_name(raw_csv_path.stem.replace("raw_", "traces_") + ".jsonl"),
+                        sample_rate=trace_sample, slow_ms=trace_slow_ms or float("inf"), seed=seed)
+        dp.update.outer_middleware(TracingMiddleware(tracer))
+    if flood_control:
+        dp.message.middleware(FloodControlMiddleware())
+    admission: AdmissionControlMiddleware | None = None
+    if admission_limit > 0:
+        admission = AdmissionControlMiddleware(AdaptiveLimiter(initial_limit=admission_limit, target_latency_s=admission_target_ms / 1000))
+        dp.message.outer_middleware(admission)
+    dp.message.middleware(MetricsMiddleware())
     dp.include_routers(handler_startup, handler_models, handler_profile, handler_rules, handler_chat)
 
-    UserManager.setup(mock=True, mock_delay_ms=db_delay_ms)
-    ApiManager.setup(mock=True, mock_delay_ms=llm_delay_ms)
+    UserManager.setup(
+        mock=True,
+        mock_delay_ms=db_delay_ms,
+        mock_latency=LatencyModel.parse(db_latency, seed * 16 + 4) if db_latency else None,
+        mock_lock_error=db_lock_error,
+    )
+    llm_model = LatencyModel.parse(llm_latency, seed * 16 + 5) if llm_latency else None
+    nim_runner = nim_server = None
+    if nim_mock_server and not nim_base_url:
+        # in-process stand-in: shares this loop with the generator, prefer a separate
+        # `python -m src.mocks.mock_nim_server` plus --nim-base-url for heavy runs
+        nim_runner, nim_base_url, nim_server = await start_nim_server(NimServerConfig(ttft_ms=llm_delay_ms, ttft_spec=llm_latency, token_ms=llm_token_ms, seed=seed))
+    if nim_base_url:
+        ApiManager.setup(cache=response_cache, base_url=nim_base_url, api_keys=[f"mock-key-{i}" for i in range(nim_keys)], requests_per_minute=nim_rpm)
+    else:
+        ApiManager.setup(mock=True, mock_delay_ms=llm_delay_ms, cache=response_cache, mock_latency=llm_model, mock_token_ms=llm_token_ms)
+    QuotaManager.setup(enforce=quota)
+    TokenUsage.setup()
+    if llm_concurrency > 0:
+        LLMScheduler.setup(default_limit=llm_concurrency)
+    else:
+        LLMScheduler.setup(default_limit=1_000_000_000, limits={})
+    dp.shutdown.register(QuotaManager.shutdown)
 
     try:
         await dp.emit_startup(bot)
     except Exception:
         pass
 
-    records: List[Record] = []
-    csv_lock = asyncio.Lock()
+    metrics = RunMetrics()
+    raw_csv = RawCsvWriter(raw_csv_path)
+    sink = RecordSink(metrics, raw_csv)
+    open_stats: Dict[str, Any] | None = None
 
+    if start_barrier is not None:
+        # every generator process starts its clock together so per-second buckets line up
+        await asyncio.to_thread(start_barrier.wait)
     t0 = time.perf_counter()
-    with raw_csv_path.open("w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=["t_s", "user_id", "step", "latency_ms", "ok", "error"])
-        writer.writeheader()
+    if mode == "open":
+        open_stats = await open_loop(
+            dp=dp,
+            bot=bot,
+            users=users,
+            phases=build_phases(rate=rate, duration_s=duration_s, rate_end=rate_end, steps=steps),
+            arrival=arrival,
+            seed=seed,
+            sink=sink,
+            first_user=first_user,
+        )
+
+    tasks = []
+    step_delay = (ramp_up_s / users) if (users > 0 and ramp_up_s > 0) else 0.0
 
-        tasks = []
-        step_delay = (ramp_up_s / users) if (users > 0 and ramp_up_s > 0) else 0.0
-
-        for u in range(users):
-            user_id = 10_000 + u
-            chat_id = 20_000 + u
-            start_delay_s = u * step_delay
-            update_id_base = 1_000_000 + (u * 10_000)
-            tasks.append(
-                asyncio.create_task(
-                    virtual_user(
-                        dp=dp,
-                        bot=bot,
-                        t0=t0,
-                        user_id=user_id,
-                        chat_id=chat_id,
-                        turns=turns,
-                        think_time_ms=think_time_ms,
-                        start_delay_s=start_delay_s,
-                        record_sink=records,
-                        csv_writer=writer,
-                        csv_lock=csv_lock,
-                        update_id_base=update_id_base,
-                    )
+    for u in range(users if mode == "closed" else 0):
+        user_id = 10_000 + first_user + u
+        chat_id = 20_000 + first_user + u
+        start_delay_s = u * step_delay
+        update_id_base = 1_000_000 + ((first_user + u) * 10_000)
+        tasks.append(
+            asyncio.create_task(
+                virtual_user(
+                    dp=dp,
+                    bot=bot,
+                    t0=t0,
+                    user_id=user_id,
+                    chat_id=chat_id,
+                    turns=turns,
+                    think_time_ms=think_time_ms,
+                    start_delay_s=start_delay_s,
+                    sink=sink,
+                    update_id_base=update_id_base,
                 )
             )
+        )
 
-        await asyncio.gather(*tasks)
+    await asyncio.gather(*tasks)
+
+    total_seconds = open_stats.pop("seconds") if open_stats is not None else time.perf_counter() - t0
+    await raw_csv.close()
+    components: Dict[str, Any] = {
+        "response_cache": ApiManager.cache_stats(),
+        "single_flight": ApiManager.flight_stats(),
+        "llm_scheduler": LLMScheduler.stats(),
+        "stages": STAGE_SECONDS.snapshot(),
+        "handlers": HANDLER_SECONDS.snapshot(),
+        "telegram": TELEGRAM_SECONDS.snapshot(),
+    }
+    if tg_429_rate or db_lock_rate:
+        components["faults"] = {"tg_retry_after": tg_retry_after.injected, "db_locked": db_lock_error.injected}
+    if nim_base_url:
+        components["nim_keys"] = ApiManager.key_stats()
+    if nim_server is not None:
+        components["nim_server"] = dict(nim_server.stats)
+    if storage is not None:
+        components["fsm_storage"] = storage.stats()
+    if admission is not None:
+        components["admission"] = admission.stats()
+    components["quota"] = QuotaManager.stats()
+    components["token_usage"] = TokenUsage.stats()
+    if tracer is not None:
+        await tracer.close()
+        components["tracing"] = tracer.stats()
+
+    try:
+        await dp.emit_shutdown(bot)
+    except Exception:
+        pass
+    await bot.session.close()
+    if nim_runner is not None:
+        await nim_runner.cleanup()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+
+    return {"metrics": metrics, "seconds": total_seconds, "open_loop": open_stats, "components": components}
+
+
+def _generator_process(index: int, kwargs: Dict[str, Any], start_barrier, results) -> None:
+    try:
+        result = asyncio.run(generate_load(**kwargs, start_barrier=start_barrier))
+        result["metrics"] = result["metrics"].to_dict()
+        results.put((index, result))
+    except BaseException as e:
+        start_barrier.abort()
+        results.put((index, {"error": f"{type(e).__name__}: {e}"}))
+
+
+def run_generator_processes(processes: int, kwargs: Dict[str, Any]) -> List[Dict[str, Any]]:
+    # Each process gets its own Bot/Dispatcher/mock stack and an equal share of the users
+    # (and of the arrival rate in open mode); results come back as serialized histograms.
+    users = kwargs["users"]
+    if processes > users:
+        raise ValueError(f"{processes} generator processes for {users} users: every process needs at least one user")
+    ctx = multiprocessing.get_context("spawn")
+    start_barrier = ctx.Barrier(processes)
+    results = ctx.Queue()
+    workers = []
+    first_user = 0
+    for i in range(processes):
+        share = users // processes + (1 if i < users % processes else 0)
+        part = dict(
+            kwargs,
+            users=share,
+            first_user=first_user,
+            seed=kwargs["seed"] + i,
+            rate=kwargs["rate"] / processes,
+            rate_end=kwargs["rate_end"] / processes if kwargs["rate_end"] is not None else None,
+            steps=",".join(f"{r / processes}:{d}" for r, d in parse_steps(kwargs["steps"])) if kwargs["steps"] else None,
+            raw_csv_path=kwargs["raw_csv_path"].with_name(f"{kwargs['raw_csv_path'].stem}_p{i}.csv"),
+            metrics_port=kwargs["metrics_port"] + i if kwargs["metrics_port"] else 0,
+        )
+        first_user += share
+        worker = ctx.Process(target=_generator_process, args=(i, part, start_barrier, results), name=f"load-gen-{i}")
+        worker.start()
+        workers.append(worker)
+    # results arrive in finish order; put them back in process order so parts match their files
+    parts: Dict[int, Dict[str, Any]] = {}
+    while len(parts) < len(workers):
+        try:
+            index, result = results.get(timeout=1.0)
+        except queue.Empty:
+            # a process killed by the OOM killer or a signal never reports back
+            dead = [i for i, w in enumerate(workers) if i not in parts and w.exitcode not in (None, 0)]
+            if dead:
+                for worker in workers:
+                    if worker.is_alive():
+                        worker.terminate()  # the others may be stuck on the start barrier
+                raise RuntimeError(f"generator process {dead[0]} died with exit code {workers[dead[0]].exitcode}")
+            continue
+        parts[index] = result
+    out = [parts[i] for i in range(len(workers))]
+    for worker in workers:
+        worker.join()
+    errors = [r["error"] for r in out if "error" in r]
+    if errors:
+        raise RuntimeError(f"{len(errors)} generator process(es) failed: {errors[0]}")
+    return out
+
+
+def merge_open_loop(parts: List[Dict[str, Any]], metrics: RunMetrics, seconds: float) -> Dict[str, Any]:
+    merged = dict(parts[0])
+    for key in ("scheduled", "target_rps", "offered_rps"):
+        merged[key] = sum(p[key] for p in parts)
+    merged["phases"] = [
+        {**phase, "rate_start": sum(p["phases"][i]["rate_start"] for p in parts), "rate_end": sum(p["phases"][i]["rate_end"] for p in parts)}
+        for i, phase in enumerate(parts[0]["phases"])
+    ]
+    merged["achieved_rps"] = (metrics.latency.count - metrics.errors) / seconds if seconds > 0 else 0.0
+    merged["send_lag"] = metrics.send_lag.summary()
+    return merged
+
+
+async def run_load(
+    *,
+    users: int,
+    turns: int,
+    ramp_up_s: float,
+    think_time_ms: int,
+    tg_delay_ms: int,
+    db_delay_ms: int,
+    llm_delay_ms: int,
+    out_dir: Path,
+    flood_control: bool = False,
+    response_cache: bool = False,
+    quota: bool = False,
+    llm_concurrency: int = 0,
+    admission_limit: int = 0,
+    admission_target_ms: int = 5000,
+    fsm_sqlite: bool = False,
+    mode: str = "closed",
+    arrival: str = "constant",
+    rate: float = 100.0,
+    rate_end: float | None = None,
+    duration_s: float = 30.0,
+    steps: str | None = None,
+    seed: int = 0,
+    nim_base_url: str | None = None,
+    nim_mock_server: bool = False,
+    nim_keys: int = 4,
+    nim_rpm: float = 40.0,
+    tg_latency: str | None = None,
+    db_latency: str | None = None,
+    llm_latency: str | None = None,
+    llm_token_ms: float = 0.0,
+    tg_429_rate: float = 0.0,
+    tg_retry_after_s: int = 1,
+    db_lock_rate: float = 0.0,
+    metrics_port: int = 0,
+    trace_sample: float = 0.0,
+    trace_slow_ms: float = 0.0,
+    processes: int = 1,
+) -> Dict[str, Any]:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
 
-    total_seconds = time.perf_counter() - t0
-    latencies = [r.latency_ms for r in records]
-    errors = sum(0 if r.ok else 1 for r in records)
-    summary = summarize(latencies, total_seconds=total_seconds, errors=errors)
+    timeseries_csv_path = out_dir / f"timeseries_{run_id}.csv"
+    summary_json_path = out_dir / f"summary_{run_id}.json"
+
+    gen_kwargs = dict(
+        users=users,
+        turns=turns,
+        ramp_up_s=ramp_up_s,
+        think_time_ms=think_time_ms,
+        tg_delay_ms=tg_delay_ms,
+        db_delay_ms=db_delay_ms,
+        llm_delay_ms=llm_delay_ms,
+        raw_csv_path=out_dir / f"raw_{run_id}.csv",
+        flood_control=flood_control,
+        response_cache=response_cache,
+        quota=quota,
+        llm_concurrency=llm_concurrency,
+        admission_limit=admission_limit,
+        admission_target_ms=admission_target_ms,
+        fsm_sqlite=fsm_sqlite,
+        mode=mode,
+        arrival=arrival,
+        rate=rate,
+        rate_end=rate_end,
+        duration_s=duration_s,
+        steps=steps,
+        seed=seed,
+        nim_base_url=nim_base_url,
+        nim_mock_server=nim_mock_server,
+        nim_keys=nim_keys,
+        nim_rpm=nim_rpm,
+        tg_latency=tg_latency,
+        db_latency=db_latency,
+        llm_latency=llm_latency,
+        llm_token_ms=llm_token_ms,
+        tg_429_rate=tg_429_rate,
+        tg_retry_after_s=tg_retry_after_s,
+        db_lock_rate=db_lock_rate,
+        metrics_port=metrics_port,
+        trace_sample=trace_sample,
+        trace_slow_ms=trace_slow_ms,
+    )
+    if processes <= 1:
+        result = await generate_load(**gen_kwargs)
+        metrics, total_seconds, open_stats = result["metrics"], result["seconds"], result["open_loop"]
+        summary = metrics.summary(total_seconds)
+        if open_stats is not None:
+            summary["open_loop"] = open_stats
+        summary.update(result["components"])
+        raw_csv_files = [str(gen_kwargs["raw_csv_path"])]
+    else:
+        parts = await asyncio.to_thread(run_generator_processes, processes, gen_kwargs)
+        metrics = RunMetrics()
+        for part in parts:
+            metrics.merge(RunMetrics.from_dict(part["metrics"]))
+        total_seconds = max(part["seconds"] for part in parts)
+        summary = metrics.summary(total_seconds)
+        if mode == "open":
+            summary["open_loop"] = merge_open_loop([part["open_loop"] for part in parts], metrics, total_seconds)
+        summary["processes"] = [part["components"] for part in parts]
+        raw_csv_files = [str(gen_kwargs["raw_csv_path"].with_name(f"raw_{run_id}_p{i}.csv")) for i in range(processes)]
 
-    ts = build_timeseries(records)
     with timeseries_csv_path.open("w", newline="", encoding="utf-8") as f:
         writer = csv.DictWriter(f, fieldnames=["t_s", "count", "errors", "avg_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms"])
         writer.writeheader()
-        for row in ts:
+        for row in metrics.timeseries():
             writer.writerow(row)
 
     payload = {
@@ -320,38 +929,232 @@ async def run_load(
             "tg_delay_ms": tg_delay_ms,
             "db_delay_ms": db_delay_ms,
             "llm_delay_ms": llm_delay_ms,
+            "llm_delay_is_ttft": True,  # older runners slept llm_delay_ms for the whole reply; no default, so they mismatch
+            "llm_token_ms": llm_token_ms,
+            "flood_control": flood_control,
+            "response_cache": response_cache,
+            "quota": quota,
+            "llm_concurrency": llm_concurrency,
+            "admission_limit": admission_limit,
+            "admission_target_ms": admission_target_ms,
+            "fsm_sqlite": fsm_sqlite,
+            "mode": mode,
+            "arrival": arrival,
+            "rate": rate,
+            "rate_end": rate_end,
+            "duration_s": duration_s,
+            "steps": steps,
+            "seed": seed,
+            "processes": processes,
+            "nim_base_url": nim_base_url,
+            "nim_mock_server": nim_mock_server,
+            "nim_keys": nim_keys,
+            "nim_rpm": nim_rpm,
+            "tg_latency": tg_latency,
+            "db_latency": db_latency,
+            "llm_latency": llm_latency,
+            "tg_429_rate": tg_429_rate,
+            "tg_retry_after_s": tg_retry_after_s,
+            "db_lock_rate": db_lock_rate,
         },
         "summary": summary,
         "files": {
-            "raw_csv": str(raw_csv_path),
+            "raw_csv": raw_csv_files[0] if len(raw_csv_files) == 1 else raw_csv_files,
             "timeseries_csv": str(timeseries_csv_path),
             "summary_json": str(summary_json_path),
         },
     }
     summary_json_path.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
 
-    try:
-        await dp.emit_shutdown(bot)
-    except Exception:
-        pass
-    await bot.session.close()
+    return payload
+
+
+# ----------------------------- compare -----------------------------
+
+# metric -> True when higher is better
+COMPARED_METRICS = {"rps": True, "p50_ms": False, "p95_ms": False, "p99_ms": False}
+# which timeseries column shows the per-second spread of each metric
+NOISE_COLUMNS = {"rps": "count", "p50_ms": "p50_ms", "p95_ms": "p95_ms", "p99_ms": "p99_ms"}
+# Every param is written to every summary. Older runners left some out (because the feature
+# did not exist yet or was off); these are the values they effectively ran with. Any other key
+# missing on one side is a mismatch.
+PARAM_DEFAULTS = {
+    "response_cache": False,
+    "flood_control": False,
+    "llm_concurrency": 0,
+    "admission_limit": 0,
+    "admission_target_ms": 5000,
+    "fsm_sqlite": False,
+    "mode": "closed",
+    "arrival": "constant",
+    "rate": 100.0,
+    "rate_end": None,
+    "duration_s": 30.0,
+    "steps": None,
+    "seed": 0,
+    "processes": 1,
+    "nim_base_url": None,
+    "nim_mock_server": False,
+    "nim_keys": 4,
+    "nim_rpm": 40.0,
+    "tg_latency": None,
+    "db_latency": None,
+    "llm_latency": None,
+    "tg_429_rate": 0.0,
+    "tg_retry_after_s": 1,
+    "db_lock_rate": 0.0,
+}
+MISSING = "<missing>"
 
+
+def load_run(path: Path) -> Dict[str, Any]:
+    payload = json.loads(path.read_text(encoding="utf-8"))
+    payload["_path"] = path
     return payload
 
 
+def _timeseries_path(run: Dict[str, Any]) -> Optional[Path]:
+    name = run.get("files", {}).get("timeseries_csv")
+    if not name:
+        return None
+    # summaries may have been written on another OS and from another working directory
+    candidate = run["_path"].parent / Path(name.replace("\\", "/")).name
+    return candidate if candidate.exists() else None
+
+
+def relative_noise(run: Dict[str, Any], column: str) -> float:
+    # Standard error of the mean of a per-second series, relative to its mean. The first and
+    # last seconds (ramp-up and ragged tail) are left out. 0.0 when there is nothing to go on.
+    path = _timeseries_path(run)
+    if path is None:
+        return 0.0
+    with path.open(newline="", encoding="utf-8") as f:
+        values = [float(row[column]) for row in csv.DictReader(f) if row.get(column)]
+    values = values[1:-1]
+    if len(values) < 3:
+        return 0.0
+    mean = sum(values) / len(values)
+    if mean <= 0:
+        return 0.0
+    variance = sum((v - mean) ** 2 for v in values) / (len(values) - 1)
+    return math.sqrt(variance / len(values)) / mean
+
+
+def param_mismatches(a: Dict[str, Any], b: Dict[str, Any]) -> Dict[str, Tuple[Any, Any]]:
+    pa = {**PARAM_DEFAULTS, **a.get("params", {})}
+    pb = {**PARAM_DEFAULTS, **b.get("params", {})}
+    return {k: (pa.get(k, MISSING), pb.get(k, MISSING)) for k in pa.keys() | pb.keys() if pa.get(k, MISSING) != pb.get(k, MISSING)}
+
+
+def compare_runs(baseline: Dict[str, Any], candidate: Dict[str, Any], *, min_pct: float, z: float, min_abs_ms: float = 1.0) -> List[Dict[str, Any]]:
+    # A change counts only if it is larger than both min_pct and z standard errors of the
+    # difference, estimated from each run's per-second variation; latency changes below
+    # min_abs_ms are timer noise on sub-millisecond steps and never count.
+    rows = []
+    for metric, higher_is_better in COMPARED_METRICS.items():
+        base = baseline["summary"].get(metric)
+        cand = candidate["summary"].get(metric)
+        if base is None or cand is None or base == 0:
+            continue
+        delta_pct = (cand - base) / base * 100
+        noise = math.hypot(relative_noise(baseline, NOISE_COLUMNS[metric]), relative_noise(candidate, NOISE_COLUMNS[metric]))
+        threshold_pct = max(min_pct, z * noise * 100)
+        if not higher_is_better:
+            threshold_pct = max(threshold_pct, min_abs_ms / base * 100)
+        worse = delta_pct < -threshold_pct if higher_is_better else delta_pct > threshold_pct
+        better = delta_pct > threshold_pct if higher_is_better else delta_pct < -threshold_pct
+        rows.append({
+            "metric": metric,
+            "baseline": base,
+            "candidate": cand,
+            "delta_pct": delta_pct,
+            "threshold_pct": threshold_pct,
+            "verdict": "regression" if worse else "improvement" if better else "ok",
+        })
+    return rows
+
+
+def run_compare(argv: List[str]) -> int:
+    p = argparse.ArgumentParser(prog="load-runner compare", description="Сравнение summary_*.json: первый файл — базовый прогон")
+    p.add_argument("summaries", nargs="+", type=Path, help="summary_*.json: базовый, затем один или несколько кандидатов")
+    p.add_argument("--min-pct", type=float, default=5.0, help="Минимальное изменение метрики в %%, которое считается значимым")
+    p.add_argument("--z", type=float, default=3.0, help="Сколько стандартных ошибок (по посекундному разбросу) должно превысить изменение")
+    p.add_argument("--min-abs-ms", type=float, default=1.0, help="Минимальное абсолютное изменение задержки в мс")
+    p.add_argument("--allow-param-mismatch", action="store_true", help="Сравнивать даже при разных params")
+    args = p.parse_args(argv)
+    if len(args.summaries) < 2:
+        p.error("нужно минимум два summary")
+
+    baseline, *candidates = [load_run(path) for path in args.summaries]
+    exit_code = 0
+    for candidate in candidates:
+        print(f"{baseline['_path'].name} -> {candidate['_path'].name}")
+        mismatches = param_mismatches(baseline, candidate)
+        if mismatches:
+            for key, (a, b) in sorted(mismatches.items()):
+                print(f"  params differ: {key}: {a!r} != {b!r}")
+            if not args.allow_param_mismatch:
+                exit_code = max(exit_code, 2)
+                continue
+        for row in compare_runs(baseline, candidate, min_pct=args.min_pct, z=args.z, min_abs_ms=args.min_abs_ms):
+            print(
+                f"  {row['metric']:<7} {row['baseline']:>12.2f} -> {row['candidate']:>12.2f}"
+                f"  {row['delta_pct']:+7.1f}% (±{row['threshold_pct']:.1f}%)  {row['verdict']}"
+            )
+            if row["verdict"] == "regression":
+                exit_code = max(exit_code, 1)
+    return exit_code
+
+
 def parse_args() -> argparse.Namespace:
     p = argparse.ArgumentParser(description="Local load-test for aiogram bot (feed_update)")
+    p.add_argument("--mode", choices=("closed", "open"), default=os.getenv("LOAD_MODE", "closed"), help="closed: пользователи ждут ответа; open: сообщения по расписанию с заданной частотой")
     p.add_argument("--users", type=int, default=int(os.getenv("LOAD_USERS", "50")), help="Сколько виртуальных пользователей")
     p.add_argument("--turns", type=int, default=int(os.getenv("LOAD_TURNS", "5")), help="Сколько сообщений в чате на пользователя")
     p.add_argument("--ramp-up-s", type=float, default=float(os.getenv("LOAD_RAMP_UP_S", "0")), help="Плавный старт пользователей (секунды)")
     p.add_argument("--think-time-ms", type=int, default=int(os.getenv("LOAD_THINK_MS", "0")), help="Пауза между сообщениями пользователя")
 
+    p.add_argument("--arrival", choices=("constant", "poisson"), default=os.getenv("LOAD_ARRIVAL", "constant"), help="open: равномерные или пуассоновские поступления")
+    p.add_argument("--rate", type=float, default=float(os.getenv("LOAD_RATE", "100")), help="open: целевая частота, сообщений/с")
+    p.add_argument("--rate-end", type=float, default=None, help="open: линейный разгон от --rate до --rate-end за --duration-s")
+    p.add_argument("--duration-s", type=float, default=float(os.getenv("LOAD_DURATION_S", "30")), help="open: длительность прогона")
+    p.add_argument("--steps", type=str, default=None, help="open: ступенчатый профиль \"rate:seconds,rate:seconds,...\" (вместо --rate/--duration-s)")
+    p.add_argument("--seed", type=int, default=int(os.getenv("LOAD_SEED", "0")), help="seed для расписания, текстов и случайностей моков")
+
     p.add_argument("--tg-delay-ms", type=int, default=int(os.getenv("MOCK_TG_DELAY_MS", "0")), help="Задержка Telegram API мока")
     p.add_argument("--db-delay-ms", type=int, default=int(os.getenv("MOCK_BD_DELAY_MS", "0")), help="Задержка БД мока")
-    p.add_argument("--llm-delay-ms", type=int, default=int(os.getenv("MOCK_LLM_DELAY_MS", "0")), help="Задержка LLM/API мока")
+    p.add_argument("--llm-delay-ms", type=int, default=int(os.getenv("MOCK_LLM_DELAY_MS", "0")), help="Время до первого токена LLM мока (и встроенного, и mock NIM)")
+
+    p.add_argument("--tg-latency", type=str, default=os.getenv("MOCK_TG_LATENCY"), help="Распределение задержки Telegram мока вместо --tg-delay-ms: 30 | uniform:10:50 | lognormal:30:0.5 | empirical:file.csv, можно +stall:EVERY_S:FOR_S:EXTRA_MS")
+    p.add_argument("--db-latency", type=str, default=os.getenv("MOCK_DB_LATENCY"), help="То же для БД мока")
+    p.add_argument("--llm-latency", type=str, default=os.getenv("MOCK_LLM_LATENCY"), help="Распределение времени до первого токена LLM мока (и встроенного, и mock NIM)")
+    p.add_argument("--llm-token-ms", type=float, default=float(os.getenv("MOCK_LLM_TOKEN_MS", "0")), help="Время на каждый следующий токен LLM мока (и встроенного, и mock NIM)")
+    p.add_argument("--tg-429-rate", type=float, default=0.0, help="Доля SendMessage/EditMessageText, отвечающих TelegramRetryAfter")
+    p.add_argument("--tg-retry-after-s", type=int, default=1, help="retry_after в инжектированных 429")
+    p.add_argument("--db-lock-rate", type=float, default=0.0, help="Доля обращений к БД мока, падающих с 'database is locked'")
+
+    p.add_argument("--flood-control", action="store_true", help="Включить FloodControlMiddleware как в src/main.py")
+    p.add_argument("--response-cache", action="store_true", help="Включить кэш ответов LLM (по умолчанию выключен: прогон меряет модель, а не кэш)")
+    p.add_argument("--quota", action="store_true", help="Применять квоты запросов/токенов (по умолчанию только считаются: отказы по квоте не попадают в задержки)")
+    p.add_argument("--admission-limit", type=int, default=int(os.getenv("LOAD_ADMISSION_LIMIT", "0")), help="Начальный лимит AdmissionControlMiddleware (0 = выключен)")
+    p.add_argument("--admission-target-ms", type=int, default=int(os.getenv("LOAD_ADMISSION_TARGET_MS", "5000")), help="Целевая задержка обработки для AIMD")
+    p.add_argument("--fsm-sqlite", action="store_true", help="Хранить FSM в SQLiteStorage (как в src/main.py) вместо MemoryStorage")
+    p.add_argument("--llm-concurrency", type=int, default=int(os.getenv("LOAD_LLM_CONCURRENCY", "0")), help="Лимит параллельных запросов к модели (0 = без лимита)")
+
+    p.add_argument("--nim-base-url", type=str, default=os.getenv("LOAD_NIM_BASE_URL"), help="Ходить в LLM через настоящий AsyncNvidiaNIMClient по этому base_url (например, src/mocks/mock_nim_server.py)")
+    p.add_argument("--nim-mock-server", action="store_true", help="Поднять mock NIM сервер в этом же процессе (TTFT = --llm-delay-ms/--llm-latency, токены = --llm-token-ms)")
+    p.add_argument("--nim-keys", type=int, default=4, help="Сколько фиктивных API-ключей отдать клиенту")
+    p.add_argument("--nim-rpm", type=float, default=40.0, help="Лимит запросов в минуту на ключ в клиенте")
+    p.add_argument("--metrics-port", type=int, default=0, help="Отдавать /metrics на 127.0.0.1:PORT во время прогона (процесс i — PORT+i)")
+    p.add_argument("--trace-sample", type=float, default=0.0, help="Доля апдейтов, трассируемых целиком (traces_*.jsonl в out-dir)")
+    p.add_argument("--trace-slow-ms", type=float, default=0.0, help="Сохранять все трейсы дольше N мс (0 = выкл)")
+    p.add_argument("--processes", type=int, default=int(os.getenv("LOAD_PROCESSES", "1")), help="Сколько процессов-генераторов нагрузки (у каждого свой Dispatcher и моки)")
 
     p.add_argument("--out-dir", type=str, default=os.getenv("LOAD_OUT_DIR", "load_results"), help="Куда сохранять CSV/JSON")
-    return p.parse_args()
+    args = p.parse_args()
+    if args.processes > args.users:
+        p.error("--processes не может быть больше --users: каждому процессу нужен хотя бы один пользователь")
+    return args
 
 
 async def _amain() -> None:
@@ -366,6 +1169,35 @@ async def _amain() -> None:
         tg_delay_ms=args.tg_delay_ms,
         db_delay_ms=args.db_delay_ms,
         llm_delay_ms=args.llm_delay_ms,
+        flood_control=args.flood_control,
+        response_cache=args.response_cache,
+        quota=args.quota,
+        llm_concurrency=args.llm_concurrency,
+        admission_limit=args.admission_limit,
+        admission_target_ms=args.admission_target_ms,
+        fsm_sqlite=args.fsm_sqlite,
+        mode=args.mode,
+        arrival=args.arrival,
+        rate=args.rate,
+        rate_end=args.rate_end,
+        duration_s=args.duration_s,
+        steps=args.steps,
+        seed=args.seed,
+        nim_base_url=args.nim_base_url,
+        nim_mock_server=args.nim_mock_server,
+        nim_keys=args.nim_keys,
+        nim_rpm=args.nim_rpm,
+        tg_latency=args.tg_latency,
+        db_latency=args.db_latency,
+        llm_latency=args.llm_latency,
+        llm_token_ms=args.llm_token_ms,
+        tg_429_rate=args.tg_429_rate,
+        tg_retry_after_s=args.tg_retry_after_s,
+        db_lock_rate=args.db_lock_rate,
+        metrics_port=args.metrics_port,
+        trace_sample=args.trace_sample,
+        trace_slow_ms=args.trace_slow_ms,
+        processes=args.processes,
         out_dir=Path(args.out_dir),
     )
 
@@ -373,6 +1205,8 @@ async def _amain() -> None:
 
 
 def main() -> None:
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        sys.exit(run_compare(sys.argv[2:]))
     try:
         asyncio.run(_amain())
     except KeyboardInterrupt:
@@ -1,3 +1,4 @@
+from argparse import ArgumentParser
 from asyncio import run as asyncio_run
 from aiogram import Bot, Dispatcher
 from dotenv import load_dotenv # remove on docker
@@ -7,21 +8,103 @@ from src.bot.handlers.models import handler_models
 from src.bot.handlers.profile import handler_profile
 from src.bot.handlers.rules_and_help import handler_rules
 from src.bot.handlers.chat import handler_chat
+from src.bot.middlewares.flood_control import FloodControlMiddleware
+from src.bot.middlewares.admission_control import AdmissionControlMiddleware
+from src.bot.middlewares.metrics import MetricsMiddleware, TelegramMetricsMiddleware
+from src.bot.middlewares.tracing import TracingMiddleware
 from src.bot.services.user_manager import UserManager
 from src.bot.services.api_manager import ApiManager
+from src.bot.services.llm_scheduler import DEFAULT_CONCURRENCY, MODEL_CONCURRENCY, LLMScheduler
+from src.bot.services.quota_manager import QuotaManager
+from src.bot.services.token_usage import TokenUsage
+from src.bot.services.fsm_storage import SQLiteStorage
+from src.bot.services.metrics import start_metrics_server
+from src.bot.services.tracing import Tracer
+from src.bot.webhook import run_webhook
+from src.backend.ConnectionPool import Pool
+from src.backend.DB import DB
 
-async def main():
+def build_dispatcher() -> Dispatcher:
+    storage = SQLiteStorage(DB(pool=Pool(number_of_connections=1))) if getenv("FSM_STORAGE", "sqlite") == "sqlite" else None
+    dp = Dispatcher(storage=storage)
+    if getenv("TRACING", "0") == "1":
+        tracer = Tracer(
+            getenv("TRACE_FILE", "traces.jsonl"),
+            sample_rate=float(getenv("TRACE_SAMPLE_RATE", "0.01")),
+            slow_ms=float(getenv("TRACE_SLOW_MS", "2000")),
+        )
+        dp.update.outer_middleware(TracingMiddleware(tracer))
+        dp.shutdown.register(tracer.close)
+    dp.message.outer_middleware(AdmissionControlMiddleware())
+    dp.message.middleware(FloodControlMiddleware())  # inner: needs the chosen handler's flags
+    dp.message.middleware(MetricsMiddleware())
+    dp.include_routers(handler_startup, handler_models, handler_profile, handler_rules, handler_chat)
+    return dp
+
+def worker_budget(workers: int, index: int) -> dict:
+    # NIM rate limits and model capacity are shared by the whole deployment, so with several
+    # worker processes each one gets its share of the per-key request rate and of the per-model
+    # concurrency; a model with fewer slots than workers still gets one slot per worker.
+    def share(total: int) -> int:
+        return max(1, total // workers + (1 if index < total % workers else 0))
+
+    return {
+        "requests_per_minute": float(getenv("NIM_RPM", "40")) / workers,
+        "default_limit": share(DEFAULT_CONCURRENCY),
+        "limits": {model: share(limit) for model, limit in MODEL_CONCURRENCY.items()},
+    }
+
+def setup_services(dp: Dispatcher, workers: int = 1, index: int = 0):
+    budget = worker_budget(workers, index)
+    UserManager.setup(db_pool_size=int(getenv("DB_POOL_SIZE", "4")))
+    ApiManager.setup(
+        cache_persistent=getenv("RESPONSE_CACHE_DB", "0") == "1",
+        cache_opt_out=[m for m in getenv("RESPONSE_CACHE_OPT_OUT", "").split(",") if m],
+        base_url=getenv("NIM_BASE_URL") or None,
+        requests_per_minute=budget["requests_per_minute"],
+    )
+    LLMScheduler.setup(default_limit=budget["default_limit"], limits=budget["limits"])
+    QuotaManager.setup()
+    TokenUsage.setup(DB(pool=Pool(number_of_connections=1)))
+    dp.shutdown.register(QuotaManager.shutdown)
+    dp.shutdown.register(TokenUsage.shutdown)
+    dp.shutdown.register(UserManager.shutdown)
+    dp.shutdown.register(ApiManager.shutdown)
+
+async def start_metrics(dp: Dispatcher, port_offset: int = 0):
+    # METRICS_PORT unset keeps the endpoint off; in webhook mode /metrics is also served next to the webhook
+    port = getenv("METRICS_PORT")
+    if not port:
+        return
+    runner = await start_metrics_server(getenv("METRICS_HOST", "0.0.0.0"), int(port) + port_offset)
+    dp.shutdown.register(runner.cleanup)
+
+async def main(mode: str = "polling"):
     bot_key = getenv("TGBOT_KEY")
     bot = Bot(token=bot_key)
-    dp = Dispatcher()
-    dp.include_routers(handler_startup, handler_models, handler_profile, handler_rules, handler_chat)
-    UserManager.setup()
-    ApiManager.setup()
-    await dp.start_polling(bot)
+    bot.session.middleware(TelegramMetricsMiddleware())
+    dp = build_dispatcher()
+    setup_services(dp)
+    await start_metrics(dp)
+    if mode == "webhook":
+        await run_webhook(
+            dp, bot,
+            base_url=getenv("WEBHOOK_URL"),
+            host=getenv("WEBHOOK_HOST", "0.0.0.0"),
+            port=int(getenv("WEBHOOK_PORT", "8080")),
+            path=getenv("WEBHOOK_PATH", "/webhook"),
+            secret_token=getenv("WEBHOOK_SECRET") or None,
+            max_updates=int(getenv("WEBHOOK_MAX_UPDATES", "256")),
+            drain_timeout_s=float(getenv("WEBHOOK_DRAIN_S", "30")),
+        )
+    else:
+        await dp.start_polling(bot)
 
 if __name__ == '__main__':
     try:
         load_dotenv()  # remove on docker
-        asyncio_run(main())
+        parser = ArgumentParser()
+        parser.add_argument("--mode", choices=("polling", "webhook"), default=getenv("BOT_MODE", "polling"))
+        asyncio_run(main(parser.parse_args().mode))
     except KeyboardInterrupt:
         print("Keyboard interrupt")
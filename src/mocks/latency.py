@@ -0,0 +1,103 @@
+import csv
+import math
+import random
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+
+class LatencyModel:
+    # Seeded latency source for the mocks. Specs:
+    #   "30" / "fixed:30"           always 30 ms
+    #   "uniform:10:50"             uniform in [10, 50] ms
+    #   "lognormal:30:0.5"          median 30 ms, sigma 0.5 (long right tail)
+    #   "empirical:latencies.csv"   resampled from a `latency_ms` column (or the first column)
+    # optionally followed by "+stall:EVERY_S:FOR_S:EXTRA_MS": every EVERY_S seconds, for FOR_S
+    # seconds, each sample gets EXTRA_MS on top (GC pauses, failovers, noisy neighbours).
+    def __init__(self, sample_ms: Callable[[random.Random], float], seed: Optional[int] = None, stall_every_s: float = 0.0,
+                 stall_for_s: float = 0.0, stall_ms: float = 0.0, clock: Callable[[], float] = time.monotonic):
+        self._sample_ms = sample_ms
+        self.rng = random.Random(seed)
+        self.stall_every_s = stall_every_s
+        self.stall_for_s = stall_for_s
+        self.stall_ms = stall_ms
+        self._clock = clock
+        self._start = clock()
+
+    def sample_ms(self) -> float:
+        value = max(0.0, self._sample_ms(self.rng))
+        if self.stall_every_s > 0 and (self._clock() - self._start) % self.stall_every_s < self.stall_for_s:
+            value += self.stall_ms
+        return value
+
+    def __call__(self) -> float:
+        # seconds, so a model can be passed anywhere a `() -> seconds` sampler is expected
+        return self.sample_ms() / 1000
+
+    @classmethod
+    def fixed(cls, ms: float) -> "LatencyModel":
+        return cls(lambda rng: ms)
+
+    @classmethod
+    def parse(cls, spec: str, seed: Optional[int] = None) -> "LatencyModel":
+        base, _, stall = spec.partition("+")
+        kind, _, args = base.partition(":")
+        if not args:
+            kind, args = "fixed", kind
+        if kind == "fixed":
+            ms = float(args)
+            sample = lambda rng: ms
+        elif kind == "uniform":
+            low, high = (float(x) for x in args.split(":"))
+            sample = lambda rng: rng.uniform(low, high)
+        elif kind == "lognormal":
+            median, sigma = (float(x) for x in args.split(":"))
+            mu = math.log(median)
+            sample = lambda rng: rng.lognormvariate(mu, sigma)
+        elif kind == "empirical":
+            values = load_latencies(Path(args))
+            sample = lambda rng: rng.choice(values)
+        else:
+            raise ValueError(f"Unknown latency distribution: {kind!r}")
+        stall_every_s = stall_for_s = stall_ms = 0.0
+        if stall:
+            name, every, duration, extra = stall.split(":")
+            if name != "stall":
+                raise ValueError(f"Unknown latency modifier: {name!r}")
+            stall_every_s, stall_for_s, stall_ms = float(every), float(duration), float(extra)
+        return cls(sample, seed=seed, stall_every_s=stall_every_s, stall_for_s=stall_for_s, stall_ms=stall_ms)
+
+
+def load_latencies(path: Path) -> list[float]:
+    # a load-runner raw CSV works as-is: only rows with a numeric latency_ms are used
+    with path.open(newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        column = header.index("latency_ms") if "latency_ms" in header else 0
+        values = []
+        try:
+            values.append(float(header[column]))  # headerless file
+        except ValueError:
+            pass
+        for row in reader:
+            try:
+                values.append(float(row[column]))
+            except (IndexError, ValueError):
+                continue
+    if not values:
+        raise ValueError(f"No latencies found in {path}")
+    return values
+
+
+class FaultInjector:
+    # seeded Bernoulli source so error sequences repeat run to run
+    def __init__(self, rate: float = 0.0, seed: Optional[int] = None):
+        self.rate = rate
+        self.rng = random.Random(seed)
+        self.injected = 0
+
+    def __call__(self) -> bool:
+        if self.rate <= 0 or self.rng.random() >= self.rate:
+            return False
+        self.injected += 1
+        return True
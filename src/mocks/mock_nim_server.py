@@ -0,0 +1,203 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Optional
+from aiohttp import web
+from src.bot.services.api import MODELS
+from src.mocks.latency import LatencyModel
+
+WORDS = (
+    "нагрузочное тестирование показывает как система ведёт себя под нагрузкой и где "
+    "появляются узкие места очереди задержки ошибки пропускная способность"
+).split()
+
+
+@dataclass
+class NimServerConfig:
+    ttft_ms: float = 300.0            # time before the first token (prefill + queueing)
+    ttft_jitter_ms: float = 0.0       # uniform +- jitter on ttft
+    token_ms: float = 20.0            # time per generated token
+    answer_tokens: int = 60           # tokens per answer, capped by max_tokens
+    rate_limit_rate: float = 0.0      # share of requests answered with 429
+    error_rate: float = 0.0           # share of requests answered with 500/503
+    retry_after_s: float = 1.0        # Retry-After sent with injected 429s
+    rpm_per_key: float = 0.0          # per-API-key requests/minute like the real NIM (0 = unlimited)
+    ttft_spec: Optional[str] = None   # LatencyModel spec, replaces ttft_ms/ttft_jitter_ms when set
+    seed: Optional[int] = None
+
+
+class MockNimServer:
+    # OpenAI-compatible stand-in for integrate.api.nvidia.com: /v1/models,
+    # /v1/chat/completions and /v1/completions, with SSE token streaming and injectable
+    # latency, 429s and 5xx, so load tests go through the real AsyncNvidiaNIMClient.
+    def __init__(self, config: NimServerConfig | None = None):
+        self.config = config or NimServerConfig()
+        self.rng = random.Random(self.config.seed)
+        self.ttft = LatencyModel.parse(self.config.ttft_spec, self.config.seed) if self.config.ttft_spec else None
+        self._key_windows: dict[str, tuple[float, int]] = {}  # key -> (window start, requests)
+        self.stats = {"requests": 0, "streamed": 0, "rate_limited": 0, "errors": 0, "completion_tokens": 0}
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/v1/models", self.models)
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_post("/v1/completions", self.completions)
+        app.router.add_get("/stats", self.get_stats)
+        return app
+
+    async def models(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "object": "list",
+            "data": [{"id": model, "object": "model", "created": 0, "owned_by": "mock"} for model in MODELS.values()],
+        })
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+    def _fault(self, request: web.Request) -> Optional[web.Response]:
+        cfg = self.config
+        self.stats["requests"] += 1
+        if cfg.rpm_per_key > 0:
+            key = request.headers.get("Authorization", "")
+            now = time.monotonic()
+            start, count = self._key_windows.get(key, (now, 0))
+            if now - start >= 60:
+                start, count = now, 0
+            if count >= cfg.rpm_per_key:
+                self.stats["rate_limited"] += 1
+                return self._error(429, "rate_limit_exceeded", retry_after=60 - (now - start))
+            self._key_windows[key] = (start, count + 1)
+        roll = self.rng.random()
+        if roll < cfg.rate_limit_rate:
+            self.stats["rate_limited"] += 1
+            return self._error(429, "rate_limit_exceeded", retry_after=cfg.retry_after_s)
+        if roll < cfg.rate_limit_rate + cfg.error_rate:
+            self.stats["errors"] += 1
+            return self._error(self.rng.choice((500, 503)), "server_error")
+        return None
+
+    @staticmethod
+    def _error(status: int, code: str, retry_after: Optional[float] = None) -> web.Response:
+        headers = {"Retry-After": f"{max(0.0, retry_after):.3f}"} if retry_after is not None else None
+        return web.json_response({"error": {"message": f"mock {code}", "type": code, "code": status}}, status=status, headers=headers)
+
+    def _ttft_s(self) -> float:
+        if self.ttft is not None:
+            return self.ttft()
+        cfg = self.config
+        return max(0.0, cfg.ttft_ms + self.rng.uniform(-cfg.ttft_jitter_ms, cfg.ttft_jitter_ms)) / 1000
+
+    def _tokens(self, max_tokens: Optional[int]) -> list[str]:
+        n = self.config.answer_tokens if max_tokens is None else min(max_tokens, self.config.answer_tokens)
+        return [self.rng.choice(WORDS) + " " for _ in range(max(1, n))]
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        return await self._generate(request, chat=True)
+
+    async def completions(self, request: web.Request) -> web.StreamResponse:
+        return await self._generate(request, chat=False)
+
+    async def _generate(self, request: web.Request, chat: bool) -> web.StreamResponse:
+        fault = self._fault(request)
+        if fault is not None:
+            return fault
+        body = await request.json()
+        model = body.get("model", "")
+        if chat:
+            prompt = " ".join(str(m.get("content", "")) for m in body.get("messages", []))
+        else:
+            prompt = str(body.get("prompt", ""))
+        usage = {"prompt_tokens": len(prompt.split()), "completion_tokens": 0, "total_tokens": 0}
+        tokens = self._tokens(body.get("max_tokens"))
+        usage["completion_tokens"] = len(tokens)
+        usage["total_tokens"] = usage["prompt_tokens"] + len(tokens)
+        self.stats["completion_tokens"] += len(tokens)
+        meta = {"id": f"mock-{uuid.uuid4().hex}", "created": int(time.time()), "model": model}
+
+        await asyncio.sleep(self._ttft_s())
+        if not body.get("stream"):
+            await asyncio.sleep(self.config.token_ms * len(tokens) / 1000)
+            text = "".join(tokens).rstrip()
+            if chat:
+                choice = {"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}
+                return web.json_response({**meta, "object": "chat.completion", "choices": [choice], "usage": usage})
+            choice = {"index": 0, "text": text, "finish_reason": "stop", "logprobs": None}
+            return web.json_response({**meta, "object": "text_completion", "choices": [choice], "usage": usage})
+
+        self.stats["streamed"] += 1
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        obj = "chat.completion.chunk" if chat else "text_completion"
+
+        async def send(choice: dict[str, Any], extra: dict[str, Any] | None = None):
+            chunk = {**meta, "object": obj, "choices": [choice] if choice else [], **(extra or {})}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+
+        for i, token in enumerate(tokens):
+            if i:
+                await asyncio.sleep(self.config.token_ms / 1000)
+            if chat:
+                delta = {"role": "assistant", "content": token} if i == 0 else {"content": token}
+                await send({"index": 0, "delta": delta, "finish_reason": None})
+            else:
+                await send({"index": 0, "text": token, "finish_reason": None, "logprobs": None})
+        await send({"index": 0, "delta": {}, "finish_reason": "stop"} if chat else {"index": 0, "text": "", "finish_reason": "stop", "logprobs": None})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await send({}, {"usage": usage})
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+
+async def start_server(config: NimServerConfig | None = None, host: str = "127.0.0.1", port: int = 0) -> tuple[web.AppRunner, str, MockNimServer]:
+    # returns the runner (for cleanup()), the base_url to give to the client, and the server
+    server = MockNimServer(config)
+    runner = web.AppRunner(server.build_app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = runner.addresses[0][1]
+    return runner, f"http://{host}:{bound_port}/v1", server
+
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Local OpenAI-compatible NVIDIA NIM stand-in")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--ttft-ms", type=float, default=300.0)
+    p.add_argument("--ttft-jitter-ms", type=float, default=0.0)
+    p.add_argument("--ttft", type=str, default=None, help="Распределение TTFT, например lognormal:300:0.5 (см. src/mocks/latency.py)")
+    p.add_argument("--token-ms", type=float, default=20.0)
+    p.add_argument("--answer-tokens", type=int, default=60)
+    p.add_argument("--rate-limit-rate", type=float, default=0.0, help="Доля ответов 429")
+    p.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов 500/503")
+    p.add_argument("--retry-after-s", type=float, default=1.0)
+    p.add_argument("--rpm-per-key", type=float, default=0.0, help="Лимит запросов в минуту на ключ (0 = без лимита)")
+    p.add_argument("--seed", type=int, default=None)
+    return p.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    config = NimServerConfig(
+        ttft_ms=args.ttft_ms,
+        ttft_jitter_ms=args.ttft_jitter_ms,
+        token_ms=args.token_ms,
+        answer_tokens=args.answer_tokens,
+        rate_limit_rate=args.rate_limit_rate,
+        error_rate=args.error_rate,
+        retry_after_s=args.retry_after_s,
+        rpm_per_key=args.rpm_per_key,
+        seed=args.seed,
+        ttft_spec=args.ttft,
+    )
+    print(f"Mock NIM listening on http://{args.host}:{args.port}/v1")
+    web.run_app(MockNimServer(config).build_app(), host=args.host, port=args.port, access_log=None, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,42 @@
 import asyncio
 import datetime
-from typing import Any, AsyncGenerator, Optional
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import count
+from typing import Any, AsyncGenerator, Iterator, Optional, get_args
 from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramRetryAfter
 from aiogram.methods.base import TelegramType
 from aiogram.methods import TelegramMethod
+from src.mocks.latency import FaultInjector, LatencyModel
+
+# methods Telegram flood-limits per chat; these are the ones that get injected 429s
+RATE_LIMITED_METHODS = ("SendMessage", "EditMessageText")
+
+# timings of the request being measured in this task (and the tasks it starts)
+_measured: ContextVar[dict[str, float] | None] = ContextVar("mock_telegram_measured", default=None)
 
 
 class MockTelegramSession(BaseSession):
-    def __init__(self, delay_ms: int = 0):
+    def __init__(self, delay_ms: int = 0, latency: LatencyModel | None = None, retry_after: FaultInjector | None = None, retry_after_s: int = 1):
         super().__init__()
         self.delay_ms = delay_ms
+        self.latency = latency or (LatencyModel.fixed(delay_ms) if delay_ms else None)
+        self.retry_after = retry_after
+        self.retry_after_s = retry_after_s
+        self._message_ids = count(1)
+
+    @contextmanager
+    def measure(self) -> Iterator[dict[str, float]]:
+        # Telegram calls made while handling one update note their timings in the yielded dict
+        # ("first_edit_at"), so overlapping requests in the same chat are measured separately
+        timings: dict[str, float] = {}
+        token = _measured.set(timings)
+        try:
+            yield timings
+        finally:
+            _measured.reset(token)
 
     async def close(self) -> None:
         return
@@ -32,14 +59,18 @@ class MockTelegramSession(BaseSession):
         method: TelegramMethod[TelegramType],
         timeout: Optional[int] = None,
     ) -> TelegramType:
-        if self.delay_ms:
-            await asyncio.sleep(self.delay_ms / 1000)
+        if self.latency is not None:
+            await asyncio.sleep(self.latency())
         name = method.__class__.__name__
+        if self.retry_after is not None and name in RATE_LIMITED_METHODS and self.retry_after():
+            raise TelegramRetryAfter(method=method, message=f"Too Many Requests: retry after {self.retry_after_s}", retry_after=self.retry_after_s)
 
         def build(result_payload: Any) -> TelegramType:
             returning_type = method.__returning__
             if isinstance(result_payload, (bool, int, float, str)) and returning_type in (bool, int, float, str):
                 return result_payload
+            if not hasattr(returning_type, "model_validate"):  # e.g. Message | bool for edits
+                returning_type = next(t for t in get_args(returning_type) if hasattr(t, "model_validate"))
             return returning_type.model_validate(result_payload, context={"bot": bot})
 
         if name == "GetMe":
@@ -55,7 +86,7 @@ class MockTelegramSession(BaseSession):
             text = getattr(method, "text", "")
             now = int(datetime.datetime.now().timestamp())
             return build({
-                "message_id": 1,
+                "message_id": next(self._message_ids),
                 "date": now,
                 "chat": {"id": chat_id, "type": "private"},
                 "text": text,
@@ -63,6 +94,9 @@ class MockTelegramSession(BaseSession):
 
         if name in ("EditMessageText", "EditMessageCaption"):
             chat_id = getattr(method, "chat_id", 0)
+            timings = _measured.get()
+            if timings is not None:
+                timings.setdefault("first_edit_at", time.perf_counter())
             text = getattr(method, "text", "") or getattr(method, "caption", "")
             now = int(datetime.datetime.now().timestamp())
             return build({
@@ -0,0 +1,273 @@
+from argparse import ArgumentParser
+from asyncio import Event, Semaphore, create_task, get_running_loop, run as asyncio_run, sleep as async_sleep, wait
+from multiprocessing import get_context
+from queue import Full
+from secrets import compare_digest
+from signal import SIGINT, SIGTERM, SIG_IGN, signal
+from typing import Any
+from aiohttp import web
+from aiogram import Bot
+from aiogram.methods import GetUpdates
+from aiogram.utils.backoff import Backoff, BackoffConfig
+from dotenv import load_dotenv # remove on docker
+from os import getenv
+
+# Runs the bot as one supervisor plus N worker processes. The supervisor is the only one
+# talking to Telegram for updates (long polling or webhook) and routes every update to a
+# worker by its sender's user_id, so one user's updates always land in the same process:
+# per-user ordering, the UserManager cache, flood control and quotas stay consistent without
+# cross-process coordination. Persistent state goes through the shared SQLite file.
+# Upstream budgets are split instead (src.main.worker_budget): each worker gets 1/N of the
+# per-key NIM rate and of the per-model LLM slots. Response cache and single-flight stay
+# per process, so identical prompts from users on different shards are not coalesced; set
+# RESPONSE_CACHE_DB=1 to share cached answers through SQLite.
+
+DEFAULT_BACKLOG = 10_000
+DEFAULT_MAX_UPDATES = 256
+RESTART_DELAY_S = 1.0
+POLLING_TIMEOUT_S = 30
+POLLING_BACKOFF = BackoffConfig(min_delay=1.0, max_delay=5.0, factor=1.3, jitter=0.1)
+
+
+def sender_of(update: dict[str, Any]) -> int | None:
+    # every user-originated update has its sender under "from" (or "user" for reactions,
+    # chat members etc.) one level down
+    for value in update.values():
+        if isinstance(value, dict):
+            sender = value.get("from") or value.get("user")
+            if isinstance(sender, dict) and "id" in sender:
+                return sender["id"]
+    return None
+
+
+def shard_of(update: dict[str, Any], workers: int) -> int:
+    # updates without a sender are spread by update_id
+    sender = sender_of(update)
+    if sender is not None:
+        return hash(sender) % workers
+    return update["update_id"] % workers
+
+
+def migrate():
+    # schema changes run once here, before any worker opens the database
+    from src.backend.ConnectionPool import Pool
+    from src.backend.DB import DB
+
+    db = DB(pool=Pool(number_of_connections=1))
+    db.ensure_schema()
+    db.ensure_fsm_schema()
+    db.ensure_response_cache_schema()
+    db.ensure_token_usage_schema()
+
+
+def run_worker(index: int, workers: int, inbox, max_updates: int):
+    signal(SIGINT, SIG_IGN)  # the supervisor decides when to stop and drains us via the inbox
+    asyncio_run(worker_main(index, workers, inbox, max_updates))
+
+
+async def worker_main(index: int, workers: int, inbox, max_updates: int = DEFAULT_MAX_UPDATES):
+    from src.main import build_dispatcher, setup_services, start_metrics
+    from src.bot.middlewares.metrics import TelegramMetricsMiddleware
+
+    bot = Bot(token=getenv("TGBOT_KEY"))
+    bot.session.middleware(TelegramMetricsMiddleware())
+    dp = build_dispatcher()
+    setup_services(dp, workers=workers, index=index)  # this worker's share of the NIM rate and model slots
+    await start_metrics(dp, port_offset=index + 1)  # METRICS_PORT + 1 + worker index, one scrape target per worker
+    await dp.emit_startup(bot=bot)
+
+    async def feed(update: dict[str, Any]):
+        try:
+            await dp.feed_raw_update(bot, update)
+        except Exception:
+            pass  # already logged by the dispatcher, same as in polling mode
+
+    print(f"Worker {index} started")
+    try:
+        await serve(inbox, feed, max_updates)
+    finally:
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
+        print(f"Worker {index} stopped")
+
+
+async def serve(inbox, feed, max_updates: int = DEFAULT_MAX_UPDATES):
+    # Up to max_updates updates run at once, but one user's updates run one after another in
+    # the order they were routed; a None in the inbox stops reading, in-flight updates finish.
+    from src.bot.services.user_cache import KeyedLock
+
+    loop = get_running_loop()
+    slots = Semaphore(max_updates)
+    senders = KeyedLock()
+    tasks = set()
+
+    async def handle(update: dict[str, Any], sender: int | None):
+        try:
+            if sender is None:
+                await feed(update)
+            else:
+                async with senders.hold(sender):
+                    await feed(update)
+        finally:
+            slots.release()
+
+    while True:
+        update = await loop.run_in_executor(None, inbox.get)
+        if update is None:
+            break
+        await slots.acquire()
+        # the lock is queued for in the order tasks start, which is the inbox order
+        task = create_task(handle(update, sender_of(update)))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await wait(tasks)
+
+
+class Supervisor:
+    def __init__(self, workers: int, backlog: int = DEFAULT_BACKLOG, max_updates: int = DEFAULT_MAX_UPDATES):
+        self._ctx = get_context("spawn")
+        self.max_updates = max_updates
+        self.inboxes = [self._ctx.Queue(maxsize=backlog) for _ in range(workers)]
+        self.processes = [None] * workers
+        self.routed = [0] * workers
+        self.restarts = 0
+        self._stopping = False
+
+    def _spawn(self, index: int):
+        process = self._ctx.Process(target=run_worker, args=(index, len(self.inboxes), self.inboxes[index], self.max_updates), name=f"bot-worker-{index}")
+        process.start()
+        self.processes[index] = process
+
+    def start(self):
+        for index in range(len(self.inboxes)):
+            self._spawn(index)
+
+    async def route(self, update: dict[str, Any]):
+        index = shard_of(update, len(self.inboxes))
+        inbox = self.inboxes[index]
+        try:
+            inbox.put_nowait(update)
+        except Full:
+            # a worker fell behind: block this producer (and with it Telegram) instead of dropping
+            await get_running_loop().run_in_executor(None, inbox.put, update)
+        self.routed[index] += 1
+
+    async def watch(self):
+        # a crashed worker is restarted on the same inbox, so its users' queued updates survive
+        while not self._stopping:
+            for index, process in enumerate(self.processes):
+                if not process.is_alive() and not self._stopping:
+                    print(f"Worker {index} exited with code {process.exitcode}, restarting")
+                    self.restarts += 1
+                    self._spawn(index)
+            await async_sleep(RESTART_DELAY_S)
+
+    async def stop(self, timeout_s: float = 30.0):
+        self._stopping = True
+        loop = get_running_loop()
+        for inbox in self.inboxes:
+            await loop.run_in_executor(None, inbox.put, None)
+        for index, process in enumerate(self.processes):
+            await loop.run_in_executor(None, process.join, timeout_s)
+            if process.is_alive():
+                print(f"Worker {index} did not drain in {timeout_s}s, terminating")
+                process.terminate()
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self.processes),
+            "alive": sum(p is not None and p.is_alive() for p in self.processes),
+            "routed": list(self.routed),
+            "restarts": self.restarts,
+        }
+
+
+async def poll_updates(bot: Bot, supervisor: Supervisor, allowed_updates: list[str]):
+    # the offset is confirmed by the next getUpdates, so updates not yet routed on stop are redelivered
+    backoff = Backoff(config=POLLING_BACKOFF)
+    get_updates = GetUpdates(timeout=POLLING_TIMEOUT_S, allowed_updates=allowed_updates)
+    # wait longer than the long poll itself so an empty poll is not mistaken for a timeout
+    request_timeout = int(bot.session.timeout + POLLING_TIMEOUT_S) if bot.session.timeout else None
+    while True:
+        try:
+            updates = await bot(get_updates, request_timeout=request_timeout)
+        except Exception as e:
+            print(f"Failed to fetch updates - {type(e).__name__}: {e}, retrying in {backoff.next_delay:.1f}s")
+            await backoff.asleep()
+            continue
+        backoff.reset()
+        for update in updates:
+            await supervisor.route(update.model_dump(mode="json", exclude_unset=True, by_alias=True))
+            get_updates.offset = update.update_id + 1
+
+
+def build_ingress(supervisor: Supervisor, path: str = "/webhook", secret_token: str | None = None) -> web.Application:
+    async def receive(request: web.Request) -> web.Response:
+        if secret_token and not compare_digest(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), secret_token):
+            return web.Response(status=401, text="Unauthorized")
+        await supervisor.route(await request.json())
+        return web.json_response({})
+
+    async def health(request: web.Request) -> web.Response:
+        stats = supervisor.stats()
+        return web.json_response(stats, status=200 if stats["alive"] == stats["workers"] else 503)
+
+    app = web.Application()
+    app.router.add_post(path, receive)
+    app.router.add_get("/healthz", health)
+    return app
+
+
+async def main(workers: int, mode: str = "polling"):
+    from src.main import build_dispatcher
+
+    bot = Bot(token=getenv("TGBOT_KEY"))
+    allowed_updates = build_dispatcher().resolve_used_update_types()
+    migrate()
+    supervisor = Supervisor(
+        workers,
+        backlog=int(getenv("WORKER_BACKLOG", str(DEFAULT_BACKLOG))),
+        max_updates=int(getenv("WORKER_MAX_UPDATES", str(DEFAULT_MAX_UPDATES))),
+    )
+    supervisor.start()
+    watcher = create_task(supervisor.watch())
+
+    stop = Event()
+    loop = get_running_loop()
+    for sig in (SIGINT, SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    runner = None
+    if mode == "webhook":
+        path = getenv("WEBHOOK_PATH", "/webhook")
+        secret_token = getenv("WEBHOOK_SECRET") or None
+        runner = web.AppRunner(build_ingress(supervisor, path=path, secret_token=secret_token), handle_signals=False)
+        await runner.setup()
+        await web.TCPSite(runner, getenv("WEBHOOK_HOST", "0.0.0.0"), int(getenv("WEBHOOK_PORT", "8080"))).start()
+        await bot.set_webhook(f"{getenv('WEBHOOK_URL').rstrip('/')}{path}", secret_token=secret_token, allowed_updates=allowed_updates)
+        await stop.wait()
+    else:
+        await bot.delete_webhook()
+        poller = create_task(poll_updates(bot, supervisor, allowed_updates))
+        await stop.wait()
+        poller.cancel()
+    print("Stopping workers...")
+    watcher.cancel()
+    if runner is not None:
+        await runner.cleanup()
+    await supervisor.stop()
+    await bot.session.close()
+    print(supervisor.stats())
+
+
+if __name__ == '__main__':
+    load_dotenv()  # remove on docker
+    parser = ArgumentParser()
+    parser.add_argument("--workers", type=int, default=int(getenv("WORKERS", "4")))
+    parser.add_argument("--mode", choices=("polling", "webhook"), default=getenv("BOT_MODE", "polling"))
+    args = parser.parse_args()
+    asyncio_run(main(args.workers, args.mode))
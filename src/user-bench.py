@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+from typing import Any, Callable, Dict
+
+from src.backend.Consts import LIMIT, PREMIUM_LIMIT, TOKEN_LIMIT, PREMIUM_TOKEN_LIMIT
+from src.backend.DB import User
+from src.bot.services.user_cache import UserCache
+
+
+# ----------------------------- baseline -----------------------------
+
+class DictUser:
+    # the pre-__slots__ User layout, kept here only as a benchmark baseline
+    def __init__(self, db, uid, balance=0, paid_requests=0, is_premium=False, premium_datetime=0, is_admin=False, last_model=None, requests=None, reset_at=0,
+                 tokens=None):
+        self.db = db
+        self.id = uid
+        self.balance = balance
+        self.paid_requests = paid_requests
+        self.is_premium = is_premium
+        self.premium_datetime = premium_datetime
+        self.is_admin = is_admin
+        self.last_model = last_model
+        self.requests = requests if requests is not None else (PREMIUM_LIMIT if is_premium else LIMIT)
+        self.reset_at = reset_at
+        self.tokens = tokens if tokens is not None else (PREMIUM_TOKEN_LIMIT if is_premium else TOKEN_LIMIT)
+        self.touched = 0.0
+
+
+def _row(uid: int) -> tuple:
+    return (str(uid), 0, 0, uid % 10 == 0, None, 0, "LLaMA-8b", None, 0, None)
+
+
+# ----------------------------- measurements -----------------------------
+
+def bytes_per_user(count: int, build: Callable[[tuple], Any], cached: bool) -> float:
+    rows = [_row(uid) for uid in range(count)]
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    if cached:
+        holder = UserCache(max_size=count + 1, ttl_s=3600)
+        for row in rows:
+            holder.put(build(row))
+    else:
+        holder = [build(row) for row in rows]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del holder
+    return (after - before) / count
+
+
+def users_per_second(count: int, build: Callable[[tuple], Any], repeats: int = 3) -> float:
+    rows = [_row(uid) for uid in range(count)]
+    best = float("inf")
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for row in rows:
+                build(row)
+            best = min(best, time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return count / best
+
+
+def run_bench(count: int) -> Dict[str, Any]:
+    variants: Dict[str, Callable[[tuple], Any]] = {
+        "dict_user": lambda row: DictUser(None, *row),
+        "slotted_user": lambda row: User(None, *row),
+        "slotted_user_from_row": lambda row: User.from_row(None, row),
+    }
+    out: Dict[str, Any] = {"users": count}
+    for name, build in variants.items():
+        out[name] = {
+            "bytes_per_user": bytes_per_user(count, build, cached=False),
+            "bytes_per_cached_user": bytes_per_user(count, build, cached=True),
+            "users_per_s": users_per_second(count, build),
+        }
+    return out
+
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Memory/throughput benchmark for cached User objects")
+    p.add_argument("--users", type=int, default=200_000, help="Сколько пользователей создать")
+    return p.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    print(json.dumps(run_bench(args.users), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
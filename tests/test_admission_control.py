@@ -0,0 +1,57 @@
+import asyncio
+from src.bot.middlewares.admission_control import AdaptiveLimiter
+
+
+def test_limit_grows_under_target_and_backs_off_above_it():
+    limiter = AdaptiveLimiter(initial_limit=10, min_limit=5, target_latency_s=1.0, backoff=0.5)
+    for _ in range(10):
+        asyncio.run(limiter.acquire())
+    for _ in range(10):  # the limit is fully used
+        limiter.release(0.1)
+        asyncio.run(limiter.acquire())
+    assert 10.9 < limiter.limit < 11.0
+    limiter.release(2.0)
+    assert 5.4 < limiter.limit < 5.6
+    limiter.release(2.0)
+    assert 5.4 < limiter.limit < 5.6  # at most one decrease per target window
+
+
+
+def test_limit_does_not_grow_under_light_load():
+    limiter = AdaptiveLimiter(initial_limit=10, target_latency_s=1.0)
+    for _ in range(1000):  # one request at a time, all fast
+        asyncio.run(limiter.acquire())
+        limiter.release(0.1)
+    assert limiter.limit == 10
+    for _ in range(5):
+        asyncio.run(limiter.acquire())
+    limiter.release(0.1)  # half the limit was in use: it was binding
+    assert limiter.limit > 10
+
+
+def test_queue_admits_on_release_and_sheds_overflow():
+    async def scenario():
+        limiter = AdaptiveLimiter(initial_limit=1, min_limit=1, max_queue=1, max_wait_s=0.05)
+        assert await limiter.acquire()
+        waiting = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        assert not await limiter.acquire()  # queue full
+        limiter.release(0.0)
+        assert await waiting
+        return limiter.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["shed_queue_full"] == 1
+    assert stats["admitted"] == 2
+
+
+def test_waiter_times_out_and_is_shed():
+    async def scenario():
+        limiter = AdaptiveLimiter(initial_limit=1, min_limit=1, max_wait_s=0.01)
+        assert await limiter.acquire()
+        assert not await limiter.acquire()
+        return limiter.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["shed_timeout"] == 1
+    assert stats["queue_depth"] == 0
@@ -0,0 +1,61 @@
+import asyncio
+from aiogram import Bot, Dispatcher, F
+from aiogram.methods import SendMessage
+from src.bot.middlewares.flood_control import FloodControlMiddleware, GCRALimiter
+from src.bot.services.user_manager import UserManager
+from src.mocks.mock_telegram_session import MockTelegramSession
+
+
+def test_gcra_allows_burst_then_enforces_interval():
+    limiter = GCRALimiter()
+    allowed = [limiter.allow(1, 0.0, 1.6, 3) for _ in range(4)]
+    assert allowed == [True, True, True, False]
+    assert not limiter.allow(1, 1.0, 1.6, 3)
+    assert limiter.allow(1, 1.7, 1.6, 3)
+
+
+def test_gcra_tracks_users_independently_and_prunes():
+    limiter = GCRALimiter()
+    assert limiter.allow(1, 0.0, 1.6, 1)
+    assert not limiter.allow(1, 0.5, 1.6, 1)
+    assert limiter.allow(2, 0.5, 1.6, 1)
+    limiter.prune(10.0)
+    assert len(limiter) == 0
+
+
+def test_middleware_limits_only_flagged_handlers_and_warns_once_per_burst():
+    sent = []
+
+    async def record(make_request, bot, method):
+        if isinstance(method, SendMessage):
+            sent.append(method.text)
+        return await make_request(bot, method)
+
+    async def scenario():
+        UserManager.setup(mock=True)
+        dp = Dispatcher()
+        middleware = FloodControlMiddleware(free_interval_s=60, free_burst=1)
+        dp.message.middleware(middleware)
+        handled = []
+
+        @dp.message(F.text == "❌Завершить чат")
+        async def leave(message):
+            handled.append(message.text)
+
+        @dp.message(flags={"rate_limit": True})
+        async def chat(message):
+            handled.append(message.text)
+
+        bot = Bot(token="123456:ABCdefGhIjklmnopQRstuvWXyz", session=MockTelegramSession())
+        bot.session.middleware(record)
+        for i, text in enumerate(["q1", "q2", "q3", "❌Завершить чат", "❌Завершить чат"]):
+            await dp.feed_raw_update(bot, {
+                "update_id": i,
+                "message": {"message_id": i, "date": 0, "chat": {"id": 7, "type": "private"}, "from": {"id": 7, "is_bot": False, "first_name": "u"}, "text": text},
+            })
+        return handled, middleware.stats()
+
+    handled, stats = asyncio.run(scenario())
+    assert handled == ["q1", "❌Завершить чат", "❌Завершить чат"]
+    assert stats["dropped"] == 2 and stats["allowed"] == 1
+    assert len(sent) == 1 and sent[0].startswith("⏳")
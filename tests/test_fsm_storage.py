@@ -0,0 +1,95 @@
+import asyncio
+import sqlite3
+import time
+from aiogram.fsm.storage.base import StorageKey
+from src.backend.ConnectionPool import Pool
+from src.backend.DB import DB
+from src.bot.services.fsm_storage import SQLiteStorage
+
+KEY = StorageKey(bot_id=1, chat_id=42, user_id=42)
+
+
+def make_db(tmp_path) -> DB:
+    return DB(pool=Pool(number_of_connections=1, db_path=str(tmp_path / "fsm.db")))
+
+
+def test_state_survives_restart_after_flush(tmp_path):
+    async def first_run():
+        storage = SQLiteStorage(make_db(tmp_path), flush_interval_s=60)
+        await storage.set_state(KEY, "ModelChoice:model")
+        await storage.set_data(KEY, {"model": "llama405b"})
+        assert storage.stats()["pending"] == 1  # both writes coalesced into one row
+        await storage.close()
+
+    async def second_run():
+        storage = SQLiteStorage(make_db(tmp_path))
+        return await storage.get_state(KEY), await storage.get_data(KEY), storage.stats()
+
+    asyncio.run(first_run())
+    state, data, stats = asyncio.run(second_run())
+    assert state == "ModelChoice:model"
+    assert data == {"model": "llama405b"}
+    assert stats["misses"] == 1 and stats["hits"] == 1
+
+
+def test_absent_keys_are_cached_and_cleared_state_is_deleted(tmp_path):
+    async def scenario():
+        storage = SQLiteStorage(make_db(tmp_path), flush_interval_s=60)
+        assert await storage.get_state(KEY) is None
+        assert await storage.get_state(KEY) is None
+        await storage.set_state(KEY, "Chat:waiting_for_exit")
+        await storage.flush()
+        await storage.set_state(KEY, None)
+        await storage.flush()
+        return storage.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["misses"] == 1
+    rows = sqlite3.connect(tmp_path / "fsm.db").execute("select count(*) from FSMState").fetchone()[0]
+    assert rows == 0
+
+
+def test_stale_rows_are_ignored(tmp_path):
+    async def scenario():
+        storage = SQLiteStorage(make_db(tmp_path), ttl_s=60)
+        await storage.set_state(KEY, "Chat:waiting_for_exit")
+        await storage.close()
+        conn = sqlite3.connect(tmp_path / "fsm.db")
+        conn.execute("update FSMState set UpdatedAt=0")
+        conn.commit()
+        return await SQLiteStorage(make_db(tmp_path), ttl_s=60).get_state(KEY)
+
+    assert asyncio.run(scenario()) is None
+
+
+def test_evicted_unflushed_write_is_not_read_back_from_sqlite(tmp_path):
+    other = StorageKey(bot_id=1, chat_id=43, user_id=43)
+
+    async def scenario():
+        storage = SQLiteStorage(make_db(tmp_path), max_size=1, flush_interval_s=60)
+        await storage.set_state(KEY, "Chat:waiting_for_exit")
+        await storage.set_state(other, "ModelChoice:model")  # evicts KEY before it was flushed
+        return await storage.get_state(KEY), storage.stats()
+
+    state, stats = asyncio.run(scenario())
+    assert state == "Chat:waiting_for_exit"
+    assert stats["misses"] == 2  # only the two first lookups before the writes
+
+
+def test_reads_keep_a_row_from_expiring(tmp_path):
+    async def scenario():
+        storage = SQLiteStorage(make_db(tmp_path), ttl_s=60, flush_interval_s=60)
+        await storage.set_state(KEY, "Chat:waiting_for_exit")
+        await storage.flush()
+        conn = sqlite3.connect(tmp_path / "fsm.db")
+        conn.execute("update FSMState set UpdatedAt=UpdatedAt-40")  # written 40 s ago, read since
+        conn.commit()
+        storage._stamped = {key: stamp - 40 for key, stamp in storage._stamped.items()}
+        assert await storage.get_state(KEY) == "Chat:waiting_for_exit"
+        assert await storage.get_state(KEY) == "Chat:waiting_for_exit"
+        await storage.close()
+        return storage.stats(), conn.execute("select UpdatedAt from FSMState").fetchone()[0]
+
+    stats, updated_at = asyncio.run(scenario())
+    assert stats["touched"] == 1  # at most once per touch interval
+    assert updated_at >= time.time() - 5
@@ -0,0 +1,68 @@
+from asyncio import Event, create_task, gather, run, sleep
+from src.bot.services.llm_scheduler import LLMScheduler
+
+
+def test_concurrency_limit_per_model():
+    LLMScheduler.setup(default_limit=2, limits={})
+    running = []
+    peak = []
+
+    async def job(model):
+        async with LLMScheduler.slot(model, premium=False):
+            running.append(model)
+            peak.append(running.count("a"))
+            await sleep(0.01)
+            running.remove(model)
+
+    async def scenario():
+        await gather(*(job("a") for _ in range(6)), job("b"))
+
+    run(scenario())
+    assert max(peak) == 2
+    stats = LLMScheduler.stats()
+    assert stats["a"]["admitted"] == 6 and stats["a"]["active"] == 0
+    assert stats["b"]["queued"] == 0
+
+
+def test_premium_is_weighted_ahead_of_free():
+    LLMScheduler.setup(default_limit=1, limits={}, premium_weight=2)
+    order = []
+
+    async def job(tag, premium, release=None):
+        async with LLMScheduler.slot("m", premium):
+            order.append(tag)
+            if release is not None:
+                await release.wait()
+
+    async def scenario():
+        release = Event()
+        holder = create_task(job("first", False, release))
+        await sleep(0)
+        waiting = [create_task(job(f"f{i}", False)) for i in range(2)]
+        waiting += [create_task(job(f"p{i}", True)) for i in range(3)]
+        await sleep(0)
+        release.set()
+        await gather(holder, *waiting)
+
+    run(scenario())
+    assert order == ["first", "p0", "p1", "f0", "p2", "f1"]
+
+
+def test_only_upstream_calls_take_a_slot():
+    from src.bot.services.api_manager import ApiManager
+
+    LLMScheduler.setup(default_limit=1, limits={})
+    ApiManager.setup(mock=True, mock_delay_ms=20)
+
+    async def consume():
+        return "".join([chunk async for chunk in ApiManager.stream_request("m", "same question", premium=True)])
+
+    async def scenario():
+        first = await gather(*(consume() for _ in range(4)))  # one leader, three single-flight followers
+        again = await consume()  # cache hit
+        return first, again
+
+    first, again = run(scenario())
+    assert len(set(first)) == 1 and again == first[0]
+    stats = LLMScheduler.stats()["m"]
+    assert stats["admitted"] == 1 and stats["queued"] == 0
@@ -0,0 +1,91 @@
+import csv
+import importlib.util
+import json
+import sys
+from pathlib import Path
+import pytest
+
+# src/load-runner.py is a script (hyphenated name), so it is loaded from its path
+spec = importlib.util.spec_from_file_location("load_runner", Path(__file__).parents[1] / "src" / "load-runner.py")
+load_runner = importlib.util.module_from_spec(spec)
+sys.modules["load_runner"] = load_runner
+spec.loader.exec_module(load_runner)
+
+COLUMNS = ["t_s", "count", "p50_ms", "p95_ms", "p99_ms"]
+
+
+def make_run(tmp_path: Path, name: str, summary: dict, series: list[float] | None = None, params: dict | None = None) -> dict:
+    # series is used as the per-second value of every timeseries column
+    files = {}
+    if series is not None:
+        timeseries = tmp_path / f"timeseries_{name}.csv"
+        with timeseries.open("w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(COLUMNS)
+            for second, value in enumerate(series):
+                writer.writerow([second, value, value, value, value])
+        files["timeseries_csv"] = str(timeseries)
+    path = tmp_path / f"summary_{name}.json"
+    path.write_text(json.dumps({"params": params or {}, "summary": summary, "files": files}), encoding="utf-8")
+    return load_runner.load_run(path)
+
+
+@pytest.mark.parametrize("series, expected", [
+    (None, 0.0),  # no timeseries file
+    ([10, 10, 10, 10, 10], 0.0),  # no spread
+    ([10, 10, 10, 10], 0.0),  # two seconds left after trimming: too few
+    ([0, 0, 0, 0, 0], 0.0),  # zero mean
+    ([99, 10, 12, 8, 10, 10, 1], (2 / 5) ** 0.5 / 10),  # first and last second are ignored
+])
+def test_relative_noise(tmp_path, series, expected):
+    run = make_run(tmp_path, "a", {}, series)
+    assert load_runner.relative_noise(run, "count") == pytest.approx(expected)
+
+
+QUIET = None
+NOISY = [99, 10, 12, 8, 10, 10, 1]  # ~6.3% relative standard error per run
+
+
+@pytest.mark.parametrize("metric, base, cand, series, verdict", [
+    ("rps", 100, 90, QUIET, "regression"),
+    ("rps", 100, 110, QUIET, "improvement"),
+    ("rps", 100, 103, QUIET, "ok"),  # below min_pct
+    ("rps", 100, 90, NOISY, "ok"),  # within z standard errors of the difference
+    ("rps", 100, 60, NOISY, "regression"),
+    ("p95_ms", 100, 110, QUIET, "regression"),
+    ("p95_ms", 100, 90, QUIET, "improvement"),
+    ("p50_ms", 0.5, 0.9, QUIET, "ok"),  # +80% but under min_abs_ms
+    ("p50_ms", 5.0, 7.0, QUIET, "regression"),
+])
+def test_compare_verdict(tmp_path, metric, base, cand, series, verdict):
+    baseline = make_run(tmp_path, "base", {metric: base}, series)
+    candidate = make_run(tmp_path, "cand", {metric: cand}, series)
+    [row] = load_runner.compare_runs(baseline, candidate, min_pct=5.0, z=3.0, min_abs_ms=1.0)
+    assert row["metric"] == metric
+    assert row["verdict"] == verdict
+    assert row["delta_pct"] == pytest.approx((cand - base) / base * 100)
+
+
+def test_metrics_missing_or_zero_in_the_baseline_are_skipped(tmp_path):
+    baseline = make_run(tmp_path, "base", {"rps": 0, "p50_ms": 10})
+    candidate = make_run(tmp_path, "cand", {"rps": 50, "p50_ms": 10, "p95_ms": 20})
+    assert [row["metric"] for row in load_runner.compare_runs(baseline, candidate, min_pct=5.0, z=3.0)] == ["p50_ms"]
+
+
+@pytest.mark.parametrize("a, b, expected", [
+    ({"users": 10, "mode": "open"}, {"users": 10, "mode": "open"}, {}),
+    ({"users": 10}, {"users": 20}, {"users": (10, 20)}),
+    ({"users": 10, "quota": True}, {"users": 10}, {"quota": (True, load_runner.MISSING)}),  # no known default
+    ({"users": 10, "seed": 0}, {"users": 10}, {}),  # older runners left seed 0 out
+    ({"users": 10}, {"users": 10, "tg_429_rate": 0.2, "nim_mock_server": True},
+     {"tg_429_rate": (0.0, 0.2), "nim_mock_server": (False, True)}),  # faults and mock NIM were only written when set
+    ({"llm_delay_ms": 500}, {"llm_delay_ms": 500, "llm_delay_is_ttft": True},
+     {"llm_delay_is_ttft": (load_runner.MISSING, True)}),  # the delay used to cover the whole reply
+    ({}, {"response_cache": False}, {}),  # missing means the cache was off
+    ({}, {"response_cache": True}, {"response_cache": (False, True)}),
+    ({"response_cache": True}, {}, {"response_cache": (True, False)}),
+])
+def test_param_mismatches(tmp_path, a, b, expected):
+    baseline = make_run(tmp_path, "base", {}, params=a)
+    candidate = make_run(tmp_path, "cand", {}, params=b)
+    assert load_runner.param_mismatches(baseline, candidate) == expected
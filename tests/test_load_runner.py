@@ -0,0 +1,158 @@
+import asyncio
+import csv
+import importlib.util
+import json
+import math
+import random
+import sys
+import time
+from pathlib import Path
+import pytest
+
+# src/load-runner.py is a script (hyphenated name), so it is loaded from its path
+spec = importlib.util.spec_from_file_location("load_runner", Path(__file__).parents[1] / "src" / "load-runner.py")
+load_runner = importlib.util.module_from_spec(spec)
+sys.modules["load_runner"] = load_runner
+spec.loader.exec_module(load_runner)
+
+
+def test_more_generator_processes_than_users_is_rejected():
+    with pytest.raises(ValueError):
+        load_runner.run_generator_processes(2, {"users": 1})
+
+
+def exact_percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(1, math.ceil(p / 100 * len(ordered))) - 1]
+
+
+@pytest.mark.parametrize("precision", [0.01, 0.05])
+def test_percentiles_are_within_precision_of_exact_values(precision):
+    rng = random.Random(3)
+    values = [rng.lognormvariate(math.log(50), 1.0) for _ in range(20_000)] + list(range(1, 1001))
+    histogram = load_runner.LogHistogram(precision)
+    for value in values:
+        histogram.record(value)
+    for p in (1, 25, 50, 90, 95, 99, 99.9, 100):
+        exact = exact_percentile(values, p)
+        assert abs(histogram.percentile(p) - exact) <= precision * exact
+    assert histogram.count == len(values) and histogram.max == max(values) and histogram.min == min(values)
+
+
+def test_merged_round_tripped_parts_equal_one_histogram():
+    values = [float(v % 997 + 1) for v in range(5_000)]  # integral values keep the sums exact
+    whole = load_runner.LogHistogram()
+    parts = [load_runner.LogHistogram() for _ in range(3)]
+    for i, value in enumerate(values):
+        whole.record(value)
+        parts[i % 3].record(value)
+    merged = load_runner.LogHistogram()
+    for part in parts:
+        merged.merge(load_runner.LogHistogram.from_dict(json.loads(json.dumps(part.to_dict()))))
+    assert merged.to_dict() == whole.to_dict()
+    assert merged.summary() == whole.summary()
+
+
+def record(t_s: float, step: str, latency_ms: float, ok: bool = True, user_id: int = 1):
+    return load_runner.Record(t_s=t_s, user_id=user_id, step=step, latency_ms=latency_ms, ok=ok, error=None if ok else "boom")
+
+
+RECORDS = [
+    (0.1, "start", 5.0, True),
+    (0.6, "chat_msg", 50.0, True),
+    (0.9, "chat_msg", 70.0, False),
+    (1.2, "chat_msg", 60.0, True),
+    (2.5, "exit_chat", 4.0, True),
+]
+
+
+def test_run_metrics_count_per_step_and_per_second():
+    metrics = load_runner.RunMetrics()
+    for t_s, step, latency, ok in RECORDS:
+        metrics.add(record(t_s, step, latency, ok))
+    summary = metrics.summary(total_seconds=2.0)
+    assert (summary["total"], summary["ok"], summary["errors"], summary["rps"]) == (5, 4, 1, 2.0)
+    steps = summary["steps"]
+    assert {name: (s["total"], s["errors"]) for name, s in steps.items()} == {"start": (1, 0), "chat_msg": (3, 1), "exit_chat": (1, 0)}
+    series = metrics.timeseries()
+    assert [(row["t_s"], row["count"], row["errors"]) for row in series] == [(0, 3, 1), (1, 1, 0), (2, 1, 0)]
+    assert series[0]["max_ms"] == 50.0  # per-second latencies are ok requests only
+
+
+def test_run_metrics_merge_and_round_trip():
+    whole = load_runner.RunMetrics()
+    parts = [load_runner.RunMetrics(), load_runner.RunMetrics()]
+    for i, (t_s, step, latency, ok) in enumerate(RECORDS):
+        whole.add(record(t_s, step, latency, ok))
+        parts[i % 2].add(record(t_s, step, latency, ok))
+    merged = load_runner.RunMetrics()
+    for part in parts:
+        merged.merge(load_runner.RunMetrics.from_dict(json.loads(json.dumps(part.to_dict()))))
+    assert merged.to_dict() == whole.to_dict()
+    assert merged.timeseries() == whole.timeseries()
+
+
+def test_raw_csv_keeps_row_order_across_batches(tmp_path):
+    path = tmp_path / "raw.csv"
+
+    async def scenario():
+        writer = load_runner.RawCsvWriter(path, batch_size=3)
+        for i in range(10):
+            writer.add(record(i / 10, "chat_msg", 10.0 + i, user_id=i))
+            if i % 4 == 0:
+                await asyncio.sleep(0)  # let some batches start while others are queued
+        await writer.close()
+
+    asyncio.run(scenario())
+    with path.open(newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    assert list(rows[0]) == load_runner.RAW_CSV_FIELDS
+    assert [int(row["user_id"]) for row in rows] == list(range(10))
+
+
+def test_constant_profile_is_evenly_spaced():
+    offsets = list(load_runner.arrival_times(load_runner.build_phases(rate=10, duration_s=2, rate_end=None, steps=None), "constant", random.Random(0)))
+    assert len(offsets) == 20
+    assert offsets == pytest.approx([k / 10 for k in range(20)])
+
+
+@pytest.mark.parametrize("phases, expected", [
+    ([(0.0, 20.0, 10.0)], 100),  # ramp: integral of 0..20 rps over 10 s
+    ([(10.0, 30.0, 5.0)], 100),
+    ([(100.0, 100.0, 1.0), (200.0, 200.0, 1.5)], 400),  # steps
+])
+def test_ramp_count_is_the_integral_of_the_rate(phases, expected):
+    offsets = list(load_runner.arrival_times(phases, "constant", random.Random(0)))
+    assert len(offsets) == expected
+    assert offsets == sorted(offsets) and offsets[-1] < sum(d for _, _, d in phases)
+
+
+def test_poisson_schedule_is_reproducible_for_a_seed():
+    phases = [(50.0, 50.0, 20.0)]
+    first = list(load_runner.arrival_times(phases, "poisson", random.Random(7)))
+    again = list(load_runner.arrival_times(phases, "poisson", random.Random(7)))
+    other = list(load_runner.arrival_times(phases, "poisson", random.Random(8)))
+    assert first == again and first != other
+    assert 900 < len(first) < 1100  # 1000 expected, sd ~32
+
+
+def test_open_loop_latency_starts_at_the_intended_time():
+    from aiogram import Bot, Dispatcher
+    from src.mocks.mock_telegram_session import MockTelegramSession
+
+    async def scenario():
+        dp = Dispatcher()
+
+        @dp.message()
+        async def handler(message):
+            await message.answer("ok")
+
+        bot = Bot(token="123456:ABCdefGhIjklmnopQRstuvWXyz", session=MockTelegramSession())
+        upd = load_runner.make_text_update(1, user_id=1, chat_id=1, text="hi")
+        t0 = time.perf_counter()
+        return await load_runner.feed_and_measure(dp=dp, bot=bot, upd=upd, t0=t0, user_id=1, step="chat_msg", intended_at=t0 - 0.2)
+
+    rec = asyncio.run(scenario())
+    assert rec.ok
+    assert rec.latency_ms >= 200 and rec.send_lag_ms >= 200  # the 200 ms we were late count as latency
+    assert rec.t_s == pytest.approx(-0.2)
@@ -0,0 +1,77 @@
+import asyncio
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Bot, Dispatcher
+from src.bot.middlewares.metrics import MetricsMiddleware, TelegramMetricsMiddleware
+from src.bot.services.metrics import ERRORS, HANDLER_SECONDS, IN_FLIGHT, REGISTRY, TELEGRAM_SECONDS, Registry, build_metrics_app
+from src.mocks.mock_telegram_session import MockTelegramSession
+
+TOKEN = "123456:ABCdefGhIjklmnopQRstuvWXyz"
+
+
+def make_update(update_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": 1, "type": "private"},
+            "from": {"id": 1, "is_bot": False, "first_name": "u"},
+            "text": text,
+        },
+    }
+
+
+def test_prometheus_text_format():
+    registry = Registry()
+    hist = registry.histogram("t_seconds", "help", ("stage",), buckets=(0.1, 1.0))
+    counter = registry.counter("t_total", "help", ("kind",))
+    gauge = registry.gauge("t_gauge", "help", collect=lambda: {(): 3})
+    hist.observe(0.05, "db")
+    hist.observe(0.1, "db")
+    hist.observe(5.0, "db")
+    counter.inc('a"b', amount=2)
+    text = registry.render()
+    assert 't_seconds_bucket{stage="db",le="0.1"} 2' in text
+    assert 't_seconds_bucket{stage="db",le="1"} 2' in text
+    assert 't_seconds_bucket{stage="db",le="+Inf"} 3' in text
+    assert 't_seconds_count{stage="db"} 3' in text
+    assert 't_total{kind="a\\"b"} 2' in text
+    assert "# TYPE t_gauge gauge\nt_gauge 3" in text
+    assert gauge.value() == 3
+
+
+def test_middlewares_record_handlers_telegram_calls_and_errors():
+    async def scenario():
+        REGISTRY.clear()
+        dp = Dispatcher()
+        dp.message.middleware(MetricsMiddleware())
+
+        @dp.message()
+        async def echo(message):
+            if message.text == "boom":
+                raise ValueError("boom")
+            await message.answer(message.text)
+
+        bot = Bot(token=TOKEN, session=MockTelegramSession())
+        bot.session.middleware(TelegramMetricsMiddleware())
+        await dp.feed_raw_update(bot, make_update(1, "hi"))
+        try:
+            await dp.feed_raw_update(bot, make_update(2, "boom"))
+        except ValueError:
+            pass
+        client = TestClient(TestServer(build_metrics_app()))
+        await client.start_server()
+        try:
+            response = await client.get("/metrics")
+            return response.headers["Content-Type"], await response.text()
+        finally:
+            await client.close()
+            await bot.session.close()
+
+    content_type, text = asyncio.run(scenario())
+    assert content_type.startswith("text/plain")
+    assert HANDLER_SECONDS.count("echo") == 2
+    assert TELEGRAM_SECONDS.count("SendMessage") == 1
+    assert ERRORS.value("handler", "ValueError") == 1
+    assert IN_FLIGHT.value("updates") == 0
+    assert 'bot_handler_duration_seconds_count{handler="echo"} 2' in text
@@ -0,0 +1,65 @@
+import time
+from asyncio import run
+import pytest
+from src.bot.services.api_manager import ApiManager
+from src.mocks.latency import FaultInjector, LatencyModel
+
+
+def test_parse_distributions():
+    assert LatencyModel.parse("30").sample_ms() == 30
+    assert LatencyModel.parse("fixed:12.5")() == 0.0125
+    uniform = LatencyModel.parse("uniform:10:50", seed=1)
+    assert all(10 <= uniform.sample_ms() <= 50 for _ in range(100))
+    lognormal = LatencyModel.parse("lognormal:30:0.5", seed=1)
+    samples = sorted(lognormal.sample_ms() for _ in range(2001))
+    assert 25 < samples[1000] < 35
+    with pytest.raises(ValueError):
+        LatencyModel.parse("gamma:1:2")
+
+
+def test_same_seed_same_samples():
+    a = LatencyModel.parse("lognormal:30:0.5", seed=7)
+    b = LatencyModel.parse("lognormal:30:0.5", seed=7)
+    assert [a.sample_ms() for _ in range(50)] == [b.sample_ms() for _ in range(50)]
+
+
+def test_stall_windows_add_latency():
+    now = [0.0]
+    model = LatencyModel(lambda rng: 10, stall_every_s=10, stall_for_s=2, stall_ms=500, clock=lambda: now[0])
+    assert model.sample_ms() == 510
+    now[0] = 5
+    assert model.sample_ms() == 10
+    now[0] = 11
+    assert model.sample_ms() == 510
+    assert LatencyModel.parse("30+stall:10:2:500").stall_ms == 500
+
+
+def test_empirical_reads_load_runner_csv(tmp_path):
+    path = tmp_path / "raw.csv"
+    path.write_text("user_id,latency_ms,status\n1,12.5,ok\n2,,timeout\n3,40,ok\n", encoding="utf-8")
+    model = LatencyModel.parse(f"empirical:{path}", seed=3)
+    assert {model.sample_ms() for _ in range(50)} <= {12.5, 40.0}
+
+
+def test_fault_injector_rate_and_count():
+    never = FaultInjector(0.0, seed=1)
+    always = FaultInjector(1.0, seed=1)
+    assert not any(never() for _ in range(100))
+    assert all(always() for _ in range(100)) and always.injected == 100
+    some = FaultInjector(0.3, seed=2)
+    hits = sum(some() for _ in range(1000))
+    assert 250 < hits < 350 and some.injected == hits
+
+
+def test_mock_llm_delay_is_time_to_first_token():
+    # same meaning as the mock NIM server: ttft before the first chunk, then token_ms per chunk
+    ApiManager.setup(mock=True, mock_delay_ms=50, mock_token_ms=10, cache=False)
+
+    async def scenario():
+        start = time.perf_counter()
+        arrivals = [time.perf_counter() - start async for _ in ApiManager.stream_request("m", "one two three")]
+        return arrivals
+
+    arrivals = run(scenario())
+    assert arrivals[0] >= 0.05
+    assert all(b - a >= 0.01 for a, b in zip(arrivals, arrivals[1:]))
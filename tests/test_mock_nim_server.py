@@ -0,0 +1,39 @@
+import asyncio
+from src.bot.services.api import AsyncNvidiaNIMClient
+from src.mocks.mock_nim_server import NimServerConfig, start_server
+
+FAST = dict(ttft_ms=1, token_ms=0, answer_tokens=5, seed=1)
+
+
+def test_client_completes_and_streams_against_mock_server():
+    async def scenario():
+        runner, base_url, server = await start_server(NimServerConfig(**FAST))
+        try:
+            client = AsyncNvidiaNIMClient({"llama8b": ["k"]}, base_url=base_url, requests_per_minute=100_000)
+            messages = [{"role": "user", "content": "привет"}]
+            response = await client.chat_completion("llama8b", messages, max_tokens=3)
+            stream = await client.chat_completion("llama8b", messages, stream=True)
+            chunks = [chunk.choices[0].delta.content async for chunk in stream if chunk.choices and chunk.choices[0].delta.content]
+            return response, chunks, server.stats
+        finally:
+            await runner.cleanup()
+
+    response, chunks, stats = asyncio.run(scenario())
+    assert response["usage"]["completion_tokens"] == 3
+    assert len(chunks) == 5
+    assert stats["requests"] == 2 and stats["streamed"] == 1
+
+
+def test_injected_rate_limits_reach_the_client_scheduler():
+    async def scenario():
+        runner, base_url, _ = await start_server(NimServerConfig(**FAST, rate_limit_rate=1.0, retry_after_s=5))
+        try:
+            client = AsyncNvidiaNIMClient({"llama8b": ["k"]}, base_url=base_url, requests_per_minute=100_000, max_retries=0)
+            response = await client.chat_completion("llama8b", [{"role": "user", "content": "x"}])
+            return response, client.key_stats()
+        finally:
+            await runner.cleanup()
+
+    response, stats = asyncio.run(scenario())
+    assert "error" in response
+    assert stats["meta/llama3-8b-instruct"][0]["rate_limited"] == 1
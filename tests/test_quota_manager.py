@@ -0,0 +1,90 @@
+import random
+from asyncio import run
+from src.backend.Consts import LIMIT
+from src.backend.ConnectionPool import Pool
+from src.backend.DB import DB, User
+from src.bot.services.quota_manager import QuotaManager, TimerWheel
+from src.bot.services.user_manager import UserManager
+
+
+def test_timer_wheel_fires_each_key_on_its_tick():
+    rng = random.Random(7)
+    wheel = TimerWheel(tick_s=1.0, wheel_size=8, levels=3, now=0)
+    deadlines = {key: rng.randint(1, 600) for key in range(500)}
+    for key, at in deadlines.items():
+        wheel.schedule(key, at)
+    wheel.cancel(0)
+    fired = {}
+    for now in range(1, 700):
+        for key in wheel.advance(now):
+            fired[key] = now
+    expected = dict(deadlines)
+    del expected[0]
+    assert fired == expected
+    assert len(wheel) == 0
+
+
+def test_timer_wheel_reschedule_uses_latest_deadline():
+    wheel = TimerWheel(tick_s=1.0, wheel_size=4, levels=2, now=0)
+    wheel.schedule("a", 3)
+    wheel.schedule("a", 9)
+    assert wheel.advance(5) == []
+    assert wheel.advance(9) == ["a"]
+
+
+def test_expired_window_is_reset_lazily():
+    async def scenario():
+        UserManager.setup(mock=True)
+        QuotaManager.setup(period_s=60)
+        user = User("mock", 1, requests=0, reset_at=1)
+        allowed = QuotaManager.try_consume(user)
+        await QuotaManager.shutdown()
+        return user, allowed
+
+    user, allowed = run(scenario())
+    assert allowed
+    assert user.requests == LIMIT - 1
+    assert user.reset_at > 1
+
+
+def test_unenforced_quota_counts_refusals_instead(monkeypatch):
+    async def scenario():
+        UserManager.setup(mock=True)
+        QuotaManager.setup(period_s=60, enforce=False)
+        monkeypatch.setattr(UserManager, "save_user", lambda user: None)
+        user = User("mock", 1, requests=2)
+        allowed = [QuotaManager.try_consume(user) for _ in range(5)]
+        await QuotaManager.shutdown()
+        return allowed
+
+    assert run(scenario()) == [True] * 5
+    assert QuotaManager.stats()["would_refuse"] == 3
+
+
+def test_refused_request_does_not_mark_the_user_dirty(monkeypatch):
+    async def scenario():
+        UserManager.setup(mock=True)
+        QuotaManager.setup(period_s=60)
+        saved = []
+        monkeypatch.setattr(UserManager, "save_user", saved.append)
+        user = User("mock", 1, requests=1)
+        first = QuotaManager.try_consume(user)
+        second = QuotaManager.try_consume(user)
+        await QuotaManager.shutdown()
+        return first, second, saved
+
+    first, second, saved = run(scenario())
+    assert first and not second
+    assert len(saved) == 1
+
+
+def test_schema_migration_tolerates_a_concurrent_migrator(tmp_path):
+    path = str(tmp_path / "users.db")
+    db = DB(pool=Pool(number_of_connections=1, db_path=path))
+    db.execute("create table Users(Id TEXT NOT NULL UNIQUE)")
+    db._add_column("Users", "Requests", "INTEGER")
+    db._add_column("Users", "Requests", "INTEGER")  # what the loser of the race runs
+    db.ensure_schema()
+    db.ensure_schema()
+    columns = [row[1] for row in db.execute("pragma table_info(Users)")]
+    assert columns == ["Id", "Requests", "ResetAt", "Tokens"]
@@ -0,0 +1,63 @@
+import httpx
+import openai
+from asyncio import run
+from src.bot.services.api import AsyncNvidiaNIMClient, RateLimitScheduler, retry_after_seconds
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _rate_limit_error(retry_after: str) -> openai.RateLimitError:
+    request = httpx.Request("POST", "http://nim.local/v1/chat/completions")
+    response = httpx.Response(429, headers={"retry-after": retry_after}, request=request)
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+
+def test_scheduler_spreads_requests_over_keys():
+    clock = FakeClock()
+    scheduler = RateLimitScheduler(requests_per_minute=60, clock=clock)
+    scheduler.add_model("m", 3)
+    reservations = [scheduler.reserve("m") for _ in range(6)]
+    assert sorted(index for index, _ in reservations[:3]) == [0, 1, 2]
+    assert all(delay == 0 for _, delay in reservations[:3])
+    assert all(delay == 1.0 for _, delay in reservations[3:])
+
+
+def test_scheduler_skips_penalized_key():
+    clock = FakeClock()
+    scheduler = RateLimitScheduler(requests_per_minute=60, clock=clock)
+    scheduler.add_model("m", 2)
+    clock.now = 10
+    scheduler.penalize("m", 0, 30)
+    assert scheduler.reserve("m") == (1, 0.0)
+    stats = scheduler.utilisation()["m"]
+    assert stats[0]["rate_limited"] == 1
+    assert stats[1]["requests"] == 1
+
+
+def test_retry_after_header():
+    assert retry_after_seconds(_rate_limit_error("7")) == 7.0
+
+
+def test_async_client_retries_on_another_key():
+    client = AsyncNvidiaNIMClient({"m": ["k1", "k2"]}, use_aliases=False, backoff_base=0.01)
+    calls = []
+
+    class Response(dict):
+        def model_dump(self):
+            return dict(self)
+
+    async def create(c):
+        calls.append(c)
+        if len(calls) == 1:
+            raise _rate_limit_error("30")
+        return Response(choices=[])
+
+    result = run(client._request("m", create, stream=False))
+    assert result == {"choices": []}
+    assert calls[0] is not calls[1]
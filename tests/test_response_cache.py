@@ -0,0 +1,40 @@
+from asyncio import run
+from src.backend.ConnectionPool import Pool
+from src.backend.DB import DB
+from src.bot.services.response_cache import ResponseCache
+
+
+def test_key_normalizes_message_and_respects_opt_out():
+    cache = ResponseCache(opt_out={"meta/llama-3.1-405b-instruct"})
+    assert cache.key("m", "sys", "  Привет!\n") == cache.key("m", "sys", "привет!")
+    assert cache.key("m", "sys", "hi") != cache.key("m", "other", "hi")
+    assert cache.key("meta/llama-3.1-405b-instruct", "sys", "hi") is None
+    assert cache.stats()["bypassed"] == 1
+
+
+def test_memory_tier_lru():
+    async def scenario():
+        cache = ResponseCache(max_size=2)
+        for key in ("a", "b", "c"):
+            cache.put(key, "m", key.upper())
+        return await cache.get("a"), await cache.get("c"), cache.stats()
+
+    first, last, stats = run(scenario())
+    assert first is None
+    assert last == "C"
+    assert stats["memory_hits"] == 1 and stats["misses"] == 1
+
+
+def test_sqlite_tier_survives_new_cache(tmp_path):
+    db = DB(pool=Pool(number_of_connections=1, db_path=str(tmp_path / "cache.db")))
+
+    async def scenario():
+        cache = ResponseCache(db=db, flush_interval_s=0)
+        cache.put("k", "m", "answer")
+        await cache.flush()
+        fresh = ResponseCache(db=db)
+        return await fresh.get("k"), fresh.stats()
+
+    answer, stats = run(scenario())
+    assert answer == "answer"
+    assert stats["db_hits"] == 1
@@ -0,0 +1,69 @@
+from asyncio import CancelledError, create_task, gather, run, sleep
+from src.bot.services.single_flight import SingleFlight
+
+
+def test_concurrent_calls_share_one_upstream_call():
+    flights = SingleFlight()
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        await sleep(0.01)
+        return "answer"
+
+    async def scenario():
+        return await gather(*(flights.do("k", upstream) for _ in range(5)))
+
+    assert run(scenario()) == ["answer"] * 5
+    assert len(calls) == 1
+    assert flights.stats()["followers"] == 4
+
+
+def test_cancelled_waiter_does_not_cancel_others():
+    flights = SingleFlight()
+
+    async def upstream():
+        await sleep(0.02)
+        return "answer"
+
+    async def scenario():
+        first = create_task(flights.do("k", upstream))
+        second = create_task(flights.do("k", upstream))
+        await sleep(0.005)
+        first.cancel()
+        try:
+            await first
+        except CancelledError:
+            pass
+        return await second
+
+    assert run(scenario()) == "answer"
+    assert flights.stats()["cancelled"] == 0
+
+
+def test_stream_fans_out_and_cancels_when_everyone_leaves():
+    flights = SingleFlight()
+    produced = []
+
+    async def upstream():
+        for i in range(3):
+            await sleep(0.01)
+            produced.append(i)
+            yield i
+
+    async def consume():
+        return [chunk async for chunk in flights.stream("k", upstream)]
+
+    async def abandon():
+        async for _ in flights.stream("k2", upstream):
+            break
+
+    async def scenario():
+        results = await gather(consume(), consume())
+        await abandon()
+        await sleep(0.05)
+        return results
+
+    assert run(scenario()) == [[0, 1, 2], [0, 1, 2]]
+    assert produced == [0, 1, 2, 0]
+    assert flights.stats()["cancelled"] == 1
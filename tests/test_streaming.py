@@ -0,0 +1,104 @@
+import pytest
+from asyncio import run
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.methods import EditMessageText
+from src.bot.utils import streaming
+from src.bot.utils.streaming import PLACEHOLDER, STREAM_ERROR, StreamingAnswer, answer_streaming
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float):
+        self.now += seconds
+
+
+class FakeMessage:
+    def __init__(self, fail_with: list | None = None):
+        self.edits = []
+        self.sent = []
+        self.fail_with = fail_with or []
+
+    async def answer(self, text, reply_markup=None):
+        self.sent.append(text)
+        return self
+
+    async def edit_text(self, text):
+        if self.fail_with:
+            raise self.fail_with.pop(0)
+        self.edits.append(text)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(streaming, "monotonic", clock.monotonic)
+    monkeypatch.setattr(streaming, "async_sleep", clock.sleep)
+    return clock
+
+
+def retry_after(seconds: int) -> TelegramRetryAfter:
+    return TelegramRetryAfter(method=EditMessageText(text="x"), message="Too Many Requests", retry_after=seconds)
+
+
+def test_edits_are_throttled_and_the_final_text_is_always_shown(clock):
+    message = FakeMessage()
+
+    async def chunks():
+        for word in ("a", " b", " c", " d"):
+            clock.now += 0.3
+            yield word
+
+    text = run(answer_streaming(message, chunks()))
+    assert text == "a b c d"
+    assert message.sent == [PLACEHOLDER]
+    assert message.edits == ["a", "a b c d"]  # " b" and " c" fall inside the 1 s window
+
+
+def test_retry_after_delays_the_final_edit(clock):
+    message = FakeMessage(fail_with=[retry_after(5)])
+    answer = StreamingAnswer(message)
+
+    async def scenario():
+        await answer.update("partial")  # rejected with retry_after=5
+        await answer.finish("full")
+
+    run(scenario())
+    assert message.edits == ["full"]
+    assert clock.now == 5
+
+
+def test_not_modified_is_ignored_but_other_bad_requests_raise(clock):
+    not_modified = TelegramBadRequest(method=EditMessageText(text="x"), message="Bad Request: message is not modified")
+    message = FakeMessage(fail_with=[not_modified])
+    run(StreamingAnswer(message).finish("same"))
+
+    broken = TelegramBadRequest(method=EditMessageText(text="x"), message="Bad Request: message to edit not found")
+    with pytest.raises(TelegramBadRequest):
+        run(StreamingAnswer(FakeMessage(fail_with=[broken])).finish("text"))
+
+
+def test_upstream_error_replaces_the_placeholder(clock):
+    message = FakeMessage()
+
+    async def chunks():
+        yield "half"
+        raise RuntimeError("upstream failed")
+
+    with pytest.raises(RuntimeError):
+        run(answer_streaming(message, chunks()))
+    assert message.edits[-1] == f"half\n\n{STREAM_ERROR}"
+
+    message = FakeMessage()
+
+    async def nothing():
+        raise RuntimeError("upstream failed")
+        yield
+
+    with pytest.raises(RuntimeError):
+        run(answer_streaming(message, nothing()))
+    assert message.edits == [STREAM_ERROR]
@@ -0,0 +1,85 @@
+import pytest
+from asyncio import run, sleep
+from queue import Empty, Queue
+from src.supervisor import Supervisor, serve, shard_of
+
+
+def message(update_id: int, user_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {"message_id": update_id, "date": 0, "chat": {"id": user_id, "type": "private"}, "from": {"id": user_id}, "text": "hi"},
+    }
+
+
+def test_updates_of_one_user_always_land_on_the_same_worker():
+    shards = {shard_of(message(i, 42), 4) for i in range(20)}
+    assert shards == {42 % 4}
+
+
+def test_users_are_spread_across_workers():
+    assert {shard_of(message(1, user_id), 4) for user_id in range(100)} == {0, 1, 2, 3}
+
+
+def test_callbacks_route_by_sender_and_unknown_updates_by_update_id():
+    callback = {"update_id": 7, "callback_query": {"id": "1", "from": {"id": 42}, "chat_instance": "x"}}
+    assert shard_of(callback, 4) == shard_of(message(1, 42), 4)
+    assert shard_of({"update_id": 7, "poll": {"id": "1"}}, 4) == 7 % 4
+
+
+def test_route_puts_each_update_into_its_workers_inbox():
+    supervisor = Supervisor(3, backlog=10)
+    updates = [message(i, user_id) for i, user_id in enumerate((1, 2, 3, 1, 4, 1))]
+
+    async def scenario():
+        for update in updates:
+            await supervisor.route(update)
+
+    run(scenario())
+    for index, inbox in enumerate(supervisor.inboxes):
+        expected = [u for u in updates if shard_of(u, 3) == index]
+        assert [inbox.get(timeout=1) for _ in expected] == expected
+        try:
+            inbox.get(timeout=0.05)
+            raise AssertionError(f"unexpected update in inbox {index}")
+        except Empty:
+            pass
+    assert supervisor.stats()["routed"] == [sum(shard_of(u, 3) == i for u in updates) for i in range(3)]
+
+
+def test_worker_runs_one_users_updates_in_order_and_others_concurrently():
+    inbox = Queue()
+    for i, user_id in enumerate((1, 1, 2, 1, 2)):
+        inbox.put(message(i, user_id))
+    inbox.put(None)
+    log = []
+    running = set()
+    overlap = []
+
+    async def feed(update):
+        user_id = update["message"]["from"]["id"]
+        assert user_id not in running
+        running.add(user_id)
+        overlap.append(len(running))
+        # the first update of each user is the slowest, so a racing second one would finish first
+        await sleep(0.03 if update["update_id"] < 3 else 0.0)
+        log.append(update["update_id"])
+        running.discard(user_id)
+
+    run(serve(inbox, feed, max_updates=10))
+    assert [i for i in log if i in (0, 1, 3)] == [0, 1, 3]
+    assert [i for i in log if i in (2, 4)] == [2, 4]
+    assert max(overlap) == 2
+
+
+@pytest.mark.parametrize("workers", [1, 3, 4, 8])
+def test_worker_budgets_add_up_to_the_configured_total(monkeypatch, workers):
+    from src.bot.services.llm_scheduler import DEFAULT_CONCURRENCY, MODEL_CONCURRENCY
+    from src.main import worker_budget
+
+    monkeypatch.setenv("NIM_RPM", "40")
+    budgets = [worker_budget(workers, index) for index in range(workers)]
+    assert sum(b["requests_per_minute"] for b in budgets) == pytest.approx(40)
+    assert sum(b["default_limit"] for b in budgets) == max(DEFAULT_CONCURRENCY, workers)
+    for model, total in MODEL_CONCURRENCY.items():
+        # every worker keeps at least one slot, so only small models can overshoot
+        assert sum(b["limits"][model] for b in budgets) == max(total, workers)
@@ -0,0 +1,101 @@
+from asyncio import run
+from src.backend.ConnectionPool import Pool
+from src.backend.Consts import TOKEN_LIMIT
+from src.backend.DB import DB, User
+from src.bot.services.quota_manager import QuotaManager
+from src.bot.services.token_usage import TokenUsage
+from src.bot.services.user_manager import UserManager
+
+
+def test_usage_is_weighted_by_model_and_blocks_when_budget_is_spent():
+    async def scenario():
+        UserManager.setup(mock=True)
+        QuotaManager.setup(period_s=60, token_weights={"llama8b": 1, "llama405b": 25})
+        TokenUsage.setup()
+        small = await UserManager.get_user(1)
+        big = await UserManager.get_user(2)
+        TokenUsage.record(1, "llama8b", 100, 300)
+        TokenUsage.record(2, "llama405b", 100, 300)
+        big_before = QuotaManager.try_consume(big)
+        TokenUsage.record(2, "llama405b", 1000, 1000)
+        big_after = QuotaManager.try_consume(big)
+        await QuotaManager.shutdown()
+        return small, big, big_before, big_after, TokenUsage.stats()
+
+    small, big, big_before, big_after, stats = run(scenario())
+    assert small.tokens == TOKEN_LIMIT - 400
+    assert big.tokens == TOKEN_LIMIT - 400 * 25 - 2000 * 25
+    assert big_before and not big_after
+    assert stats["by_model"]["meta/llama-3.1-405b-instruct"] == {"requests": 2, "prompt_tokens": 1100, "completion_tokens": 1300}
+
+
+def test_usage_is_flushed_to_sqlite_as_increments(tmp_path):
+    async def scenario():
+        UserManager.setup(mock=True)
+        QuotaManager.setup()
+        db = DB(pool=Pool(number_of_connections=1, db_path=str(tmp_path / "usage.db")))
+        TokenUsage.setup(db, flush_interval_s=60)
+        TokenUsage.record(7, "llama8b", 10, 20)
+        TokenUsage.record(7, "llama8b", 1, 2)
+        await TokenUsage.flush()
+        TokenUsage.record(7, "llama8b", 100, 200)
+        TokenUsage.record(7, "llama70b", 5, 5)
+        pending = await TokenUsage.usage_for(7, since=0)
+        await TokenUsage.shutdown()
+        return pending, await TokenUsage.usage_for(7, since=0), db.execute("select count(*) from TokenUsage")[0][0]
+
+    pending, flushed, rows = run(scenario())
+    assert pending == flushed == {"meta/llama3-8b-instruct": [3, 111, 222], "meta/llama3-70b-instruct": [1, 5, 5]}
+    assert rows == 2
+
+
+def test_a_full_batch_starts_one_flush(tmp_path):
+    async def scenario():
+        UserManager.setup(mock=True)
+        QuotaManager.setup()
+        db = DB(pool=Pool(number_of_connections=1, db_path=str(tmp_path / "usage.db")))
+        TokenUsage.setup(db, flush_interval_s=60, flush_batch_size=2)
+        TokenUsage.record(0, "llama8b", 1, 1)
+        TokenUsage.record(1, "llama8b", 1, 1)
+        first = TokenUsage._batch_task
+        for user_id in range(2, 10):  # the batch flush hasn't run yet: no new task per record
+            TokenUsage.record(user_id, "llama8b", 1, 1)
+        same = TokenUsage._batch_task is first
+        await TokenUsage.shutdown()
+        return first, same, db.execute("select count(*) from TokenUsage")[0][0]
+
+    first, same, rows = run(scenario())
+    assert first is not None and same and first.done()
+    assert rows == 10
+
+
+def test_charge_for_a_user_not_in_memory_loads_it():
+    async def scenario():
+        UserManager.setup(mock=True)
+        QuotaManager.setup(token_weights={"llama8b": 1})
+        TokenUsage.setup()
+        TokenUsage.record(5, "llama8b", 10, 20)  # user 5 was never loaded
+        await QuotaManager.shutdown()
+        return await UserManager.get_user(5), QuotaManager.stats()
+
+    user, stats = run(scenario())
+    assert user.tokens == TOKEN_LIMIT - 30
+    assert stats["late_charges"] == 1 and stats["tokens_charged"] == 30
+
+
+def test_profile_shows_usage_by_model(tmp_path):
+    from src.bot.handlers.profile import build_profile_message
+
+    async def scenario():
+        UserManager.setup(mock=True)
+        QuotaManager.setup()
+        TokenUsage.setup(DB(pool=Pool(number_of_connections=1, db_path=str(tmp_path / "usage.db"))), flush_interval_s=60)
+        QuotaManager.try_consume(await UserManager.get_user(7))
+        TokenUsage.record(7, "llama8b", 10, 20)
+        TokenUsage.record(7, "llama8b", 1, 2)
+        text = await build_profile_message(7)
+        await TokenUsage.shutdown()
+        await QuotaManager.shutdown()
+        return text
+
+    assert "<code>meta/llama3-8b-instruct</code>: 2 запр., 33 ток." in run(scenario())
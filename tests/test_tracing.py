@@ -0,0 +1,130 @@
+import asyncio
+import json
+import time
+from aiogram import Bot, Dispatcher
+from src.bot.middlewares.metrics import TelegramMetricsMiddleware
+from src.bot.middlewares.tracing import TracingMiddleware
+from src.bot.services.tracing import Tracer, add_span, load_traces, summarize, traced_to_thread
+from src.mocks.mock_telegram_session import MockTelegramSession
+
+TOKEN = "123456:ABCdefGhIjklmnopQRstuvWXyz"
+
+
+def make_update(update_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": 7, "type": "private"},
+            "from": {"id": 7, "is_bot": False, "first_name": "u"},
+            "text": text,
+        },
+    }
+
+
+def test_only_slow_or_sampled_traces_are_written(tmp_path):
+    path = tmp_path / "traces.jsonl"
+
+    async def scenario():
+        tracer = Tracer(path, sample_rate=0.0, slow_ms=50, flush_interval_s=0.01)
+        dp = Dispatcher()
+        dp.update.outer_middleware(TracingMiddleware(tracer))
+
+        @dp.message()
+        async def handler(message):
+            start = time.perf_counter()
+            await traced_to_thread("db.sleep", time.sleep, 0.001)
+            if message.text == "slow":
+                await asyncio.sleep(0.06)
+            add_span("work", start)
+            await message.answer("ok")
+
+        bot = Bot(token=TOKEN, session=MockTelegramSession())
+        bot.session.middleware(TelegramMetricsMiddleware())
+        await dp.feed_raw_update(bot, make_update(1, "fast"))
+        await dp.feed_raw_update(bot, make_update(2, "slow"))
+        await tracer.close()
+        await bot.session.close()
+        return tracer.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["started"] == 2 and stats["kept"] == 1 and stats["written"] == 1
+    [trace] = load_traces(path)
+    assert trace["update_id"] == 2 and trace["kept"] == "slow" and trace["user_id"] == 7
+    names = [span["name"] for span in trace["spans"]]
+    assert names == ["db.sleep", "work", "telegram.SendMessage"]
+    assert "queue_ms" in trace["spans"][0]
+    assert trace["duration_ms"] >= 60
+    assert "update 2" in summarize([trace])
+
+
+def test_failed_traces_are_kept_as_errors(tmp_path):
+    async def scenario():
+        tracer = Tracer(tmp_path / "t.jsonl", sample_rate=0.0, slow_ms=10_000)
+        trace = tracer.start(1)
+        trace.error = "RuntimeError"
+        tracer.finish(trace)
+        tracer.finish(tracer.start(2))
+        await tracer.close()
+
+    asyncio.run(scenario())
+    [trace] = load_traces(tmp_path / "t.jsonl")
+    assert trace["update_id"] == 1 and trace["kept"] == "error" and trace["error"] == "RuntimeError"
+
+
+def test_slow_failed_traces_are_kept_as_errors(tmp_path):
+    async def scenario():
+        tracer = Tracer(tmp_path / "t.jsonl", sample_rate=0.0, slow_ms=0)
+        trace = tracer.start(1)
+        trace.error = "TimeoutError"
+        tracer.finish(trace)
+        tracer.finish(tracer.start(2))
+        await tracer.close()
+
+    asyncio.run(scenario())
+    assert [(t["update_id"], t["kept"]) for t in load_traces(tmp_path / "t.jsonl")] == [(1, "error"), (2, "slow")]
+
+
+def test_spans_outside_a_trace_or_after_it_are_ignored(tmp_path):
+    async def scenario():
+        tracer = Tracer(tmp_path / "t.jsonl", sample_rate=1.0)
+        add_span("orphan", time.perf_counter())  # no trace in context: no-op
+        trace = tracer.start(1)
+        tracer.finish(trace)
+        trace.add("late", 0.0, 1.0)
+        await tracer.close()
+        return trace
+
+    trace = asyncio.run(scenario())
+    assert trace.spans == []
+    assert json.loads((tmp_path / "t.jsonl").read_text(encoding="utf-8"))["kept"] == "sampled"
+
+
+def test_mock_session_measures_overlapping_requests_in_one_chat_separately():
+    edits = {}
+
+    async def scenario():
+        dp = Dispatcher()
+
+        @dp.message()
+        async def handler(message):
+            placeholder = await message.answer("...")
+            await asyncio.sleep(0.05 if message.text == "slow" else 0.0)
+            before = time.perf_counter()
+            await placeholder.edit_text("done")
+            edits[message.text] = (before, time.perf_counter())
+
+        bot = Bot(token=TOKEN, session=MockTelegramSession())
+
+        async def measured(update):
+            with bot.session.measure() as timings:
+                await dp.feed_raw_update(bot, update)
+                return timings["first_edit_at"]
+
+        return await asyncio.gather(measured(make_update(1, "slow")), measured(make_update(2, "fast")))
+
+    slow, fast = asyncio.run(scenario())
+    # each request sees its own edit, not the first edit in the (shared) chat
+    assert edits["slow"][0] <= slow <= edits["slow"][1]
+    assert edits["fast"][0] <= fast <= edits["fast"][1]
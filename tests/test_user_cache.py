@@ -0,0 +1,59 @@
+from asyncio import gather, run, sleep
+from src.bot.services.user_cache import UserCache, KeyedLock
+
+
+class FakeUser:
+    def __init__(self, uid):
+        self.id = uid
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_eviction_keeps_recently_used():
+    evicted = []
+    cache = UserCache(max_size=2, ttl_s=60, on_evict=lambda user: evicted.append(user.id))
+    for uid in (1, 2):
+        cache.put(FakeUser(uid))
+    cache.get(1)
+    cache.put(FakeUser(3))
+    assert evicted == [2]
+    assert cache.get(2) is None
+    assert cache.get(1).id == 1
+    assert cache.stats()["evictions"] == 1
+
+
+def test_idle_users_expire():
+    clock = FakeClock()
+    cache = UserCache(max_size=10, ttl_s=5, clock=clock)
+    cache.put(FakeUser(1))
+    clock.now = 3
+    cache.put(FakeUser(2))
+    clock.now = 7
+    cache.put(FakeUser(3))
+    assert len(cache) == 2
+    assert cache.get(1) is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_keyed_lock_is_pruned():
+    locks = KeyedLock()
+    order = []
+
+    async def worker(tag):
+        async with locks.hold(1):
+            order.append(tag)
+            await sleep(0.01)
+            assert len(locks) == 1
+
+    async def scenario():
+        await gather(worker("a"), worker("b"))
+
+    run(scenario())
+    assert order == ["a", "b"]
+    assert len(locks) == 0
@@ -0,0 +1,51 @@
+from asyncio import run, sleep
+from src.backend.Consts import LIMIT, TOKEN_LIMIT
+from src.backend.DB import User
+from src.bot.services.user_manager import UserManager
+
+
+class FakeDB:
+    def __init__(self):
+        self.batches = []
+
+    def save_users(self, rows):
+        self.batches.append(rows)
+
+
+def setup_with(db, **kwargs):
+    # mock setup opens no Pool, so the tracked db.db is never touched; then swap in the fake
+    UserManager.setup(mock=True, **kwargs)
+    UserManager._is_mock = False
+    UserManager._db = db
+
+
+def test_save_user_is_batched():
+    async def scenario():
+        db = FakeDB()
+        setup_with(db, flush_interval_s=0.05, flush_batch_size=3)
+        users = [User(db, uid) for uid in range(5)]
+        for user in users:
+            UserManager.save_user(user)
+        users[0].last_model = "LLaMA-70b"
+        UserManager.save_user(users[0])
+        await sleep(0.1)
+        await UserManager.shutdown()
+        return db
+
+    db = run(scenario())
+    rows = [row for batch in db.batches for row in batch]
+    assert len(db.batches) == 2
+    assert sorted(row[0] for row in rows) == [0, 1, 2, 3, 4]
+    assert "LLaMA-70b" in rows[0]
+
+
+def test_shutdown_flushes_pending_users():
+    async def scenario():
+        db = FakeDB()
+        setup_with(db, flush_interval_s=60, flush_batch_size=100)
+        UserManager.save_user(User(db, 42))
+        await UserManager.shutdown()
+        return db
+
+    db = run(scenario())
+    assert db.batches == [[(42, 0, 0, False, 0, False, None, LIMIT, 0, TOKEN_LIMIT)]]
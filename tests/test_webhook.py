@@ -0,0 +1,62 @@
+import asyncio
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Bot, Dispatcher
+from src.bot.webhook import WEBHOOK_HANDLER, build_app
+from src.mocks.mock_telegram_session import MockTelegramSession
+
+TOKEN = "123456:ABCdefGhIjklmnopQRstuvWXyz"
+
+
+def make_update(update_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": update_id, "type": "private"},
+            "from": {"id": update_id, "is_bot": False, "first_name": "u"},
+            "text": "hi",
+        },
+    }
+
+
+def test_webhook_bounds_in_flight_updates_and_drains_on_shutdown():
+    async def scenario():
+        release = asyncio.Event()
+        peak = 0
+        running = 0
+        finished = 0
+        dp = Dispatcher()
+
+        @dp.message()
+        async def handler(message):
+            nonlocal peak, running, finished
+            running += 1
+            peak = max(peak, running)
+            await release.wait()
+            running -= 1
+            finished += 1
+
+        bot = Bot(token=TOKEN, session=MockTelegramSession())
+        app = build_app(dp, bot, max_updates=2, drain_timeout_s=5)
+        handler_ = app[WEBHOOK_HANDLER]
+        client = TestClient(TestServer(app))
+        await client.start_server()
+        try:
+            posts = [asyncio.create_task(client.post("/webhook", json=make_update(i))) for i in range(1, 4)]
+            await asyncio.sleep(0.1)
+            assert peak == 2
+            assert sum(p.done() for p in posts) == 2  # the third waits for a free slot
+            health = await client.get("/healthz")
+            assert health.status == 200
+            assert (await health.json())["in_flight"] == 2
+            release.set()
+            await asyncio.gather(*posts)
+            await asyncio.sleep(0.05)
+        finally:
+            await client.close()
+        assert finished == 3
+        assert handler_.draining
+        assert handler_.stats()["accepted"] == 3
+
+    asyncio.run(scenario())